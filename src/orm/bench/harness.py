@@ -0,0 +1,154 @@
+'''
+Created on Oct 17, 2026
+
+Timing, statistics and reporting for benchmarks
+
+@author: Benjamin Dezile
+'''
+
+from time import time
+import platform
+import resource
+import json
+import gc
+
+def percentile(sorted_values, p):
+    ''' Return the p-th percentile of a sorted list of values '''
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(sorted_values) - 1)
+    return sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f)
+
+
+class Benchmark(object):
+    ''' A single measured operation '''
+
+    def __init__(self, name, fn, setup=None, ops_per_call=1, **params):
+        ''' Create a new benchmark
+        name:           Unique name of the benchmark
+        fn:             Function to measure, called with the value returned by setup
+        setup:          Function preparing the state for a call, not measured
+        ops_per_call:   Number of operations performed by each call of fn
+        params:         Parameters to report along with the results (document size, count...)
+        '''
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.ops_per_call = ops_per_call
+        self.params = params
+
+    def run(self, iterations, warmup):
+        ''' Run this benchmark and return its results '''
+        for _ in range(warmup):
+            self.fn(self.setup() if self.setup else None)
+
+        latencies = list()
+        gc.collect()
+        gc.disable()
+        try:
+            objs_before = len(gc.get_objects())
+            for _ in range(iterations):
+                state = self.setup() if self.setup else None
+                t = time()
+                self.fn(state)
+                latencies.append(time() - t)
+                state = None
+            objs_after = len(gc.get_objects())
+        finally:
+            gc.enable()
+
+        latencies.sort()
+        total = sum(latencies)
+        n_ops = iterations * self.ops_per_call
+        return {
+            'name': self.name,
+            'params': self.params,
+            'iterations': iterations,
+            'ops': n_ops,
+            'ops_per_sec': n_ops / total if total > 0 else 0.0,
+            'latency_ms': {
+                'mean': total / iterations * 1000,
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'max': latencies[-1] * 1000,
+            },
+            # Net number of container objects left behind per operation (gc disabled while running)
+            'retained_objects_per_op': float(objs_after - objs_before) / n_ops,
+        }
+
+
+class BenchmarkRunner(object):
+    ''' Runs a list of benchmarks and collects their results '''
+
+    def __init__(self, iterations=200, warmup=20, pattern=None):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.pattern = pattern
+        self.results = list()
+
+    def run(self, benchmarks):
+        ''' Run the given benchmarks, return their results '''
+        for b in benchmarks:
+            if self.pattern and self.pattern not in b.name:
+                continue
+            res = b.run(self.iterations, self.warmup)
+            self.results.append(res)
+            print "%-45s %12.1f ops/s   p50 %8.3f ms   p99 %8.3f ms" % \
+                (res['name'], res['ops_per_sec'], res['latency_ms']['p50'], res['latency_ms']['p99'])
+        return self.results
+
+    def report(self, commit=None):
+        ''' Return the full report, ready to be saved as JSON '''
+        return {
+            'created': int(time()),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'iterations': self.iterations,
+            'results': self.results,
+        }
+
+    def save(self, filepath, commit=None):
+        ''' Save the report to a JSON file '''
+        fp = open(filepath, 'w')
+        try:
+            json.dump(self.report(commit), fp, indent=2, sort_keys=True)
+        finally:
+            fp.close()
+
+
+def load_report(filepath):
+    ''' Load a report saved as JSON '''
+    fp = open(filepath, 'r')
+    try:
+        return json.load(fp)
+    finally:
+        fp.close()
+
+def compare_reports(base, new, threshold=5.0):
+    ''' Compare two reports, return a list of (name, base ops/s, new ops/s, change %, flag) '''
+    base_results = dict([(r['name'], r) for r in base['results']])
+    rows = list()
+    for r in new['results']:
+        b = base_results.get(r['name'])
+        if b is None or not b['ops_per_sec']:
+            continue
+        change = (r['ops_per_sec'] - b['ops_per_sec']) / b['ops_per_sec'] * 100
+        flag = ""
+        if change <= -threshold:
+            flag = "REGRESSION"
+        elif change >= threshold:
+            flag = "improvement"
+        rows.append((r['name'], b['ops_per_sec'], r['ops_per_sec'], change, flag))
+    return rows
+
+def print_comparison(rows):
+    ''' Print the result of compare_reports '''
+    print "%-45s %12s %12s %9s" % ("benchmark", "base ops/s", "new ops/s", "change")
+    for name, base_ops, new_ops, change, flag in rows:
+        print "%-45s %12.1f %12.1f %+8.1f%% %s" % (name, base_ops, new_ops, change, flag)
+
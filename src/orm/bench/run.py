@@ -0,0 +1,44 @@
+'''
+Created on Oct 17, 2026
+
+Run the ORM benchmarks, save and compare their reports
+
+Usage:
+    python -m orm.bench.run [-o report.json] [--commit sha] [--iterations n] [--filter name]
+    python -m orm.bench.run --compare base.json new.json [--threshold pct]
+
+@author: Benjamin Dezile
+'''
+
+from orm.bench.harness import BenchmarkRunner, load_report, compare_reports, print_comparison
+from orm.bench.suites import all_benchmarks
+from optparse import OptionParser
+import sys
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options] | --compare base.json new.json")
+    parser.add_option("-o", "--output", dest="output", help="Save the report to this JSON file")
+    parser.add_option("--commit", dest="commit", help="Commit to record in the report")
+    parser.add_option("-n", "--iterations", dest="iterations", type="int", default=200, help="Measured calls per benchmark")
+    parser.add_option("-w", "--warmup", dest="warmup", type="int", default=20, help="Unmeasured calls per benchmark")
+    parser.add_option("-f", "--filter", dest="pattern", help="Only run benchmarks whose name contains this")
+    parser.add_option("--compare", dest="compare", action="store_true", default=False, help="Compare two saved reports")
+    parser.add_option("--threshold", dest="threshold", type="float", default=5.0, help="Change (in %) flagged when comparing")
+    options, args = parser.parse_args(argv)
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare requires two report files")
+        rows = compare_reports(load_report(args[0]), load_report(args[1]), options.threshold)
+        print_comparison(rows)
+        return 1 if [row for row in rows if row[4] == "REGRESSION"] else 0
+
+    runner = BenchmarkRunner(options.iterations, options.warmup, options.pattern)
+    runner.run(all_benchmarks())
+    if options.output:
+        runner.save(options.output, options.commit)
+        print "Report saved to %s" % options.output
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,163 @@
+'''
+Created on Oct 17, 2026
+
+Benchmarks of the ORM hot paths, run against the in-process fake server
+
+@author: Benjamin Dezile
+'''
+
+from orm.bench.harness import Benchmark
+from orm.core.base_object import BaseObject
+from orm.core.base_object_array import BaseObjectArray
+from orm.db.database import Database
+from orm.db.query import Query, DESCENDING
+from orm.test.fake_mongo import FakeConnection
+import orm.core.base_object
+
+DOC_SIZES = { 'small': 5, 'medium': 20, 'large': 100 }
+DOC_COUNTS = (100, 1000)
+FIELD_TYPES = ("str", "int", "list[int]")
+
+def _field_value(field_type, k):
+    ''' Return a sample value for a field of the given type '''
+    if field_type == "str":
+        return "value %d" % k
+    elif field_type == "int":
+        return k
+    return range(k % 10)
+
+def make_model_class(name, n_fields, relations=None):
+    ''' Create a model class with n_fields fields, the way build_model would '''
+    fields = tuple(["field%d" % i for i in range(n_fields)])
+    field_types = dict([(fields[i], FIELD_TYPES[i % len(FIELD_TYPES)]) for i in range(n_fields)])
+    if relations:
+        for rel in relations.values():
+            fields += (rel['local'],)
+            field_types[rel['local']] = "list[int]" if rel['multi'] else "int"
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new, True, False)
+        for field in fields:
+            setattr(self, field, None)
+
+    attrs = { '__init__': __init__, '_fields': fields, '_field_types': field_types, '_relations': relations }
+    for rel_name, rel in (relations or dict()).items():
+        if rel['multi']:
+            getter = lambda self, rel_name=rel_name, rel=rel: \
+                self._get_related_array(rel['class'], getattr(self, rel['local']), rel['foreign'], rel_name)
+        else:
+            getter = lambda self, rel_name=rel_name, rel=rel: \
+                self._get_related(rel['class'], getattr(self, rel['local']), rel['foreign'], rel_name)
+        attrs["get_%s" % rel_name] = getter
+    cls = type(name, (BaseObject,), attrs)
+    # Let relations resolve the class by name
+    setattr(orm.core.base_object, name, cls)
+    return cls
+
+def make_object(cls, k=0):
+    ''' Create a new object with all of its fields set '''
+    obj = cls(True)
+    for field in cls._fields:
+        setattr(obj, field, _field_value(cls._field_types[field], k))
+    return obj
+
+def init_database():
+    ''' Point the ORM at an empty fake server '''
+    FakeConnection.reset()
+    Database.connection_class = FakeConnection
+    Database.enable_query_logging(False)
+    Database.get_instance(db_name="bench")
+
+
+##  BENCHMARKS  ###############################
+
+def query_building_benchmarks():
+    ''' Building queries, without executing them '''
+    def build(_):
+        q = Query("bench").where(status="active").where_in("tag", [1, 2, 3]).where_gte(score=10)
+        q.select("a", "b", "c").sort("created", DESCENDING).limit(20)
+        return q
+    return [Benchmark("query/build", build)]
+
+def serialization_benchmarks():
+    ''' Converting objects to and from dictionaries '''
+    benchmarks = list()
+    for size_name, n_fields in sorted(DOC_SIZES.items()):
+        cls = make_model_class("BenchDoc%d" % n_fields, n_fields)
+        obj = make_object(cls)
+        doc = obj.to_dict()
+        benchmarks.append(Benchmark("to_dict/%s" % size_name, lambda _, obj=obj: obj.to_dict(), fields=n_fields))
+        benchmarks.append(Benchmark("from_dict/%s" % size_name, lambda _, cls=cls, doc=doc: cls.from_dict(doc), fields=n_fields))
+        objs = BaseObjectArray([make_object(cls, k) for k in range(DOC_COUNTS[0])])
+        benchmarks.append(Benchmark("to_json/%s/%d" % (size_name, len(objs)), lambda _, objs=objs: objs.to_json(),
+                                    ops_per_call=len(objs), fields=n_fields, count=len(objs)))
+    return benchmarks
+
+def write_benchmarks():
+    ''' Saving and updating single objects, and bulk inserts '''
+    benchmarks = list()
+    for size_name, n_fields in sorted(DOC_SIZES.items()):
+        cls = make_model_class("BenchWrite%d" % n_fields, n_fields)
+        benchmarks.append(Benchmark("save/insert/%s" % size_name, lambda obj: obj.save(),
+                                    setup=lambda cls=cls: make_object(cls), fields=n_fields))
+
+        def setup_update(cls=cls):
+            obj = make_object(cls)
+            obj.save()
+            obj = cls.find(obj.get_id())
+            obj.field1 = obj.field1 + 1
+            return obj
+        benchmarks.append(Benchmark("save/update/%s" % size_name, lambda obj: obj.save(),
+                                    setup=setup_update, fields=n_fields))
+
+    cls = make_model_class("BenchBulk", DOC_SIZES['medium'])
+    def setup_bulk(count):
+        # Start from an empty collection so that every call measures the same thing
+        Query(cls.__name__).delete()
+        return BaseObjectArray([make_object(cls, k) for k in range(count)])
+    for count in DOC_COUNTS:
+        benchmarks.append(Benchmark("bulk_insert/%d" % count, lambda objs: objs.save(),
+                                    setup=lambda count=count: setup_bulk(count), ops_per_call=count, count=count))
+    return benchmarks
+
+def finder_benchmarks():
+    ''' Finding objects by id and by parameters, and resolving relations '''
+    benchmarks = list()
+    cls = make_model_class("BenchFind", DOC_SIZES['medium'])
+    count = DOC_COUNTS[0]
+    objs = BaseObjectArray([make_object(cls, k) for k in range(count)])
+    objs.save()
+    obj_id = objs[count / 2].get_id()
+    benchmarks.append(Benchmark("find/by_id", lambda _: cls.find(obj_id)))
+    benchmarks.append(Benchmark("find_by/%d" % (count / 10), lambda _: cls.find_by(field1=5),
+                                ops_per_call=1, count=count / 10))
+    benchmarks.append(Benchmark("find_all/%d" % count, lambda _: cls.find_all(), count=count))
+    benchmarks.append(Benchmark("count", lambda _: cls.count(field1=5)))
+
+    author_cls = make_model_class("BenchAuthor", DOC_SIZES['small'])
+    authors = BaseObjectArray([make_object(author_cls, k) for k in range(10)])
+    authors.save()
+    relations = { 'author': { 'class': 'BenchAuthor', 'local': 'authorId', 'foreign': '_id', 'multi': False } }
+    post_cls = make_model_class("BenchPost", DOC_SIZES['small'], relations)
+    posts = BaseObjectArray()
+    for k in range(count):
+        post = make_object(post_cls, k)
+        post.authorId = authors[k % len(authors)].get_id()
+        posts.append(post)
+    posts.save()
+
+    def get_authors(prefetch):
+        # Loading the posts is timed too, as that is where prefetching does its queries
+        for post in post_cls.find_all(prefetch=prefetch):
+            post.get_author()
+    benchmarks.append(Benchmark("relations/getter/%d" % count, lambda _: get_authors(None),
+                                ops_per_call=count, count=count))
+    benchmarks.append(Benchmark("relations/prefetch/%d" % count, lambda _: get_authors(['author']),
+                                ops_per_call=count, count=count))
+    return benchmarks
+
+def all_benchmarks():
+    ''' Return all the benchmarks, with the database they need set up '''
+    init_database()
+    return query_building_benchmarks() + serialization_benchmarks() + write_benchmarks() + finder_benchmarks()
+
@@ -8,10 +8,18 @@ Created on Feb 20, 2012
 from time import time
 from types import InstanceType
 from __builtin__ import __import__
-from orm.db.query import Query
+from orm.db.query import Query, Page
+from orm.db.aggregation import Aggregation
+from orm.db.scan import PartitionedScan, DEFAULT_PARTITIONS, DEFAULT_CHUNK_SIZE
+from orm.db.async_query import run_async
+from orm.core.identity_map import get_identity_map
+from orm.core.result_set import ResultSet
+from orm.core.serializer import get_serializer, CLASS_KEY
+from orm.core import json_encoder
+from orm.core.change_tracking import diff_documents, merge_rules, get_changed_fields, get_rule_fields, copy_document, export_value, top_field
+from orm.core.change_tracking import SET, PUSH, INC, ADD_TO_SET, PULL, OVERWRITE
 from pyutils.utils.helpers import camel_to_py_case 
 import uuid
-import json
 import hashlib
 
 PRIMITIVE_TYPES = (bool, int, long, float, str)
@@ -19,6 +27,31 @@ ITERATIVE_TYPES = (list, tuple, set)
 INSTANCE = InstanceType
 ID_ALIAS = "_id"
 
+class PartialObjectError(ValueError):
+    ''' Raised when trying to persist fields that were not loaded '''
+    pass
+
+def _run_async(fn, *args, **kwargs):
+    ''' Run a data access method in the background, within the identity map of the caller '''
+    id_map = get_identity_map()
+    if id_map is None:
+        return run_async(fn, *args, **kwargs)
+    def run():
+        id_map.bind()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            id_map.unbind()
+    return run_async(run)
+
+def _get_embedded_copy(rel, obj):
+    ''' Return the copy of a related object embedded by a given relation '''
+    copy = { ID_ALIAS: obj.get_id() }
+    for k in [rel["foreign"]] + list(rel["embed"]):
+        if k != ID_ALIAS:
+            copy[k] = export_value(getattr(obj, k))
+    return copy
+
 def _get_class_from_name(cls_name):
     ''' Get the class for the given name '''
     g = globals()
@@ -36,9 +69,14 @@ def _get_class_from_name(cls_name):
 class Serializable(object):
     ''' Interface for serializable objects '''
     
+    __slots__ = ()              # Let generated classes do without a per-instance __dict__
     _serializable = True
     _has_sub_classes = False
-    CLASS_KEY = "_class"
+    _export_class_key = True    # Whether to_dict() exports the class name
+    _base_fields = None         # Fields defined by base classes
+    _fields = None              # Field names, set by generated classes
+    _field_types = None         # Field name -> declared type, set by generated classes
+    CLASS_KEY = CLASS_KEY
     
     def __init__(self):
         ''' Create a new instance '''
@@ -48,6 +86,10 @@ class Serializable(object):
     ##  INTERNAL METHODS  #######################
         
     def __getattr__(self, name):
+        if not name.startswith("_") and self._loaded_fields is not None:
+            # Partially loaded object, fetch the rest
+            self._load_missing_fields()
+            return getattr(self, name)
         return None
     
     def _is_serializable(self, obj):
@@ -95,12 +137,12 @@ class Serializable(object):
     
     ##  PUBLIC METHODS  #######################
 
-    def to_json(self):
-        ''' Return a JSON representation of this object '''
-        d = self.to_dict()
-        if d.has_key("id"):
-            d["id"] = str(d["id"])
-        return json.dumps(d, False, False) # False = not ensuring ascii
+    def to_json(self, fp=None):
+        ''' Return a JSON representation of this object, or write it to a given file-like object '''
+        s = json_encoder.dumps(self, False, True) # False = not ensuring ascii, True = id as a string
+        if fp is None:
+            return s
+        fp.write(s.encode("utf-8") if type(s) is unicode else s)
     
     def copy(self):
         ''' Return a copy of this object '''
@@ -111,75 +153,33 @@ class Serializable(object):
     
     def to_dict(self):
         ''' Export this object's properties to a dictionary '''
-        values = dict()
-        values[Serializable.CLASS_KEY] = self.__class__.__name__
-        for k in self.__dict__.keys():
-            if not k.startswith('_') and self.__dict__[k] is not None:
-                val = self.__dict__[k]
-                t = type(val)
-                if t in (list, tuple)  and len(val) > 0 and self._is_serializable(val[0]):
-                    # List of objects
-                    l = list()
-                    for item in val:
-                        l.append(item.to_dict())
-                    values[k] = l
-                elif self._is_serializable(val):
-                    # Serializable object
-                    values[k] = val.to_dict()
-                elif t is str:
-                    # String value
-                    values[k] = unicode(val)
-                else:
-                    # Other type of value
-                    values[k] = val
-        return values
+        return get_serializer(self.__class__, self._base_fields).to_dict(self)
     
     @classmethod
     def from_dict(cls, d, is_new=False):
         ''' Create a new instance from a dictionary of properties '''
-        if not cls._has_sub_classes:
-            # FIXME: Dynamically import subclasses when needed instead of hard-coding it
-            pass
-        inst = cls(is_new) if not hasattr(cls, "_embedded") else cls()
-        for k in d:
-            _name = k
-            _t = type(d[k])
-            if _name in (ID_ALIAS, "id"):
-                if not is_new:
-                    # Set the id only if not a new instance
-                    inst.__setattr__("id", int(d[k]) if _t in (str, unicode) else d[k])
-            elif _t is dict and d[k].has_key(Serializable.CLASS_KEY):
-                # Embedded object
-                cls_name = d[k][Serializable.CLASS_KEY]
-                clazz = eval("%s" % cls_name)
-                inst.__setattr__(_name, clazz.from_dict(d[k]))
-            elif _t is list and len(d[k]) > 0 and type(d[k][0]) is dict and d[k][0].has_key(Serializable.CLASS_KEY):
-                # List of objects
-                cls_name = d[k][0][Serializable.CLASS_KEY]
-                clazz = eval("%s" % cls_name)
-                l = list()
-                for item in d[k]:
-                    l.append(clazz.from_dict(item))
-                inst.__setattr__(_name, l)
-            elif _t is str:
-                # String value
-                inst.__setattr__(_name, unicode(d[k]))
-            else:     
-                # Other type of value
-                inst.__setattr__(_name, d[k])
-        if hasattr(inst, "_change_set") and inst._change_set is not None:
-            # Reset change map
-            inst._change_set.clear()
-        return inst
+        return get_serializer(cls, cls._base_fields).from_dict(d, is_new, _get_class_from_name)
     
 
 class BasePersistentObject(Serializable):
     ''' Base for persistent objects '''
     
+    __slots__ = ('id', 
+                 '_new', 
+                 '_loaded_fields',      # Names of the loaded fields when partially loaded
+                 '_snapshot',           # Copy of the document this object was loaded from or last saved as, 
+                                        # owned by this object as atomic operations update it in place
+                 '_pending_ops',        # Atomic operations to send on the next save: operator -> { path: argument }
+                 '__weakref__')
+    _export_class_key = False
+    _base_fields = ("id",)
+    
     def __init__(self, is_new=False):
         ''' Create a new instance '''
         self._new = is_new
-        self._change_set = set()
+        self._loaded_fields = None
+        self._snapshot = None
+        self._pending_ops = None
         self.id = None
         if is_new:
             self.id = self._generate_uid()
@@ -204,14 +204,111 @@ class BasePersistentObject(Serializable):
         ''' Return  a string representation of this object '''
         return "%s #%s" % (self.__class__.__name__, self.id)
     
-    def __setattr__(self, name, value):
-        object.__setattr__(self, name, value)
-        if not name.startswith("_") and not self._new:
-            self._notify_change(name)
+    def _set_snapshot(self, doc):
+        ''' Keep a copy of the document this object was persisted as '''
+        self._snapshot = copy_document(doc)
+        self._pending_ops = None
     
-    def _notify_change(self, field):
-        ''' Register a change of value for a given field '''
-        self._change_set.add(field)
+    def _get_container(self, path):
+        ''' Return the object or dictionary holding the value at a dotted path, and the key of the value '''
+        parts = path.split(".")
+        container = self
+        for part in parts[:-1]:
+            if hasattr(container, "_serializable"):
+                container = getattr(container, part)
+            elif type(container) is dict:
+                container = container.get(part)
+            else:
+                container = None
+            if container is None:
+                raise ValueError("%s has no value at %s" % (self, path))
+        return container, parts[-1]
+    
+    def _get_path_value(self, path):
+        ''' Return the value at a dotted path '''
+        container, key = self._get_container(path)
+        return container.get(key) if type(container) is dict else getattr(container, key)
+    
+    def _apply_op(self, op, path, value, arg):
+        ''' Set the value at a dotted path and record the operation persisting it on the next save '''
+        container, key = self._get_container(path)
+        if type(container) is dict:
+            container[key] = value
+        else:
+            setattr(container, key, value)
+        if self._new:
+            # Inserted as is
+            return
+        field = top_field(path)
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.get(field) is OVERWRITE:
+            # The whole field is written on save anyway
+            return
+        pending = self._pending_ops
+        if pending is None:
+            pending = self._pending_ops = dict()
+        for other_op, values in pending.iteritems():
+            for other_path in values:
+                if top_field(other_path) == field and (other_op, other_path) != (op, path):
+                    # Operations that cannot be combined, overwrite the field on save instead
+                    self._mark_changed(field)
+                    return
+        # Keep the snapshot in line with what the operation will persist
+        doc = snapshot
+        parts = path.split(".")
+        for part in parts[:-1]:
+            doc = doc.get(part) if type(doc) is dict else None
+        if type(doc) is not dict:
+            self._mark_changed(field)
+            return
+        doc[parts[-1]] = export_value(value)
+        values = pending.setdefault(op, dict())
+        if op == INC:
+            values[path] = values.get(path, 0) + arg
+        elif op == PULL:
+            values.setdefault(path, { "$in": list() })["$in"].extend(arg)
+        else:
+            values.setdefault(path, { "$each": list() })["$each"].extend(arg)
+    
+    def _mark_changed(self, field):
+        ''' Make the next save overwrite a given field as a whole '''
+        if self._pending_ops:
+            for values in self._pending_ops.itervalues():
+                for path in values.keys():
+                    if top_field(path) == field:
+                        del values[path]
+        if self._snapshot is not None:
+            self._snapshot[field] = OVERWRITE
+    
+    def _check_loaded(self, fields):
+        ''' Make sure none of the given fields is one that was not loaded '''
+        if self._loaded_fields is not None:
+            unloaded = [k for k in fields if k not in self._loaded_fields]
+            if unloaded:
+                raise PartialObjectError("Cannot overwrite fields of %s that were not loaded: %s" % (self, ", ".join(unloaded)))
+    
+    def get_changed_fields(self):
+        ''' Return the names of the fields that changed since this object was loaded or saved '''
+        if self._new:
+            return set()
+        return get_changed_fields(self._snapshot or dict(), self.to_dict())
+    
+    def has_changes(self):
+        ''' Return whether this object changed since it was loaded or saved '''
+        return len(self.get_changed_fields()) > 0
+    
+    def _get_update_rules(self, doc=None):
+        ''' Return the update rules needed to persist the changes and operations made on this object 
+        doc:    Current export of this object, if already at hand
+        '''
+        if doc is None:
+            doc = self.to_dict()
+        rules = diff_documents(self._snapshot or dict(), doc)
+        if self._pending_ops:
+            rules = merge_rules(rules, self._pending_ops, doc)
+        if rules and self._loaded_fields is not None:
+            self._check_loaded(get_rule_fields(rules))
+        return rules
     
     def _generate_uid(self):
         ''' Generate a random UID '''
@@ -235,28 +332,58 @@ class BasePersistentObject(Serializable):
             name = name[4:]
         return name
     
-    def to_dict(self):
-        ''' Export this object to a dictionary '''
-        d = Serializable.to_dict(self)
-        if d.has_key(Serializable.CLASS_KEY):
-            del d[Serializable.CLASS_KEY]
-        return d
+    @classmethod
+    def get_field_names(cls):
+        ''' Return the names of the fields of this class, base ones included '''
+        return get_serializer(cls, cls._base_fields).fields
     
 
 class BaseObject(BasePersistentObject):
     ''' Abstract base for all model objects '''
     
-    def __init__(self, is_new=False, timestampable=False, softdeletable=False):
-        ''' Create a new instance '''
+    __slots__ = ('created', 'updated', 'deleted', 
+                 '_prefetched',         # Relation name -> (reference value, related objects)
+                 '_is_timestampable',   # Class values below, unless overridden when created
+                 '_is_softdeletable')
+    _base_fields = ("id", "created", "updated", "deleted")
+    _relations = None      # Relation name -> { class, local, foreign, multi[, embed, embed_field] }, set by generated classes
+    _embedded_in = None    # (class name, relation name) pairs of the relations embedding copies of objects of this class
+    _timestampable = False
+    _softdeletable = False
+    _read_preference = None     # Read preference of the finds and counts on this class (see orm.db.replica_set)
+    _db_alias = None            # Alias of the database objects of this class are stored in, None for the default one
+    
+    def __init__(self, is_new=False, timestampable=None, softdeletable=None):
+        ''' Create a new instance 
+        Generated classes declare whether they are timestampable and softdeletable at 
+        the class level, the arguments override it for a given instance.
+        Instances have no __dict__ unless their class does not declare __slots__, 
+        so only subclasses without __slots__ accept undeclared attributes.
+        '''
         BasePersistentObject.__init__(self, is_new)
-        self._timestampable = timestampable
-        self._softdeletable = softdeletable
-        self._col_name = self.__class__.__name__
-        if is_new:
-            self.deleted = None
-            if self._timestampable:
-                self.created = int(time())
-                self.updated = int(time())
+        self._is_timestampable = self._timestampable if timestampable is None else timestampable
+        self._is_softdeletable = self._softdeletable if softdeletable is None else softdeletable
+        self._prefetched = None
+        self.deleted = None
+        if is_new and self._is_timestampable:
+            self.created = int(time())
+            self.updated = int(time())
+        else:
+            self.created = None
+            self.updated = None
+    
+    @property
+    def _col_name(self):
+        ''' Name of the collection objects of this class are stored in (set at the class level by generated classes) '''
+        return self.get_collection_name()
+    
+    @classmethod
+    def get_collection_name(cls):
+        ''' Return the name of the collection objects of this class are stored in '''
+        name = getattr(cls, '_col_name', None)
+        if isinstance(name, basestring):
+            return name
+        return cls.get_class_name()
     
     
     ## GETTERS and SETTERS  #####################
@@ -285,14 +412,86 @@ class BaseObject(BasePersistentObject):
         ''' Set the deletion timestamp '''
         self.deleted = t
     
-    def _get_related(self, related_cls_name, value, relation_name=ID_ALIAS):
+    def _get_prefetched(self, prefetch_key, value):
+        ''' Return (True, objects) if the given relation was prefetched for the given reference value '''
+        if prefetch_key is not None and self._prefetched:
+            entry = self._prefetched.get(prefetch_key)
+            if entry is not None and entry[0] == value:
+                return True, entry[1]
+        return False, None
+    
+    def _set_prefetched(self, prefetch_key, value, objs):
+        ''' Keep the objects a relation resolves to for a given reference value '''
+        if prefetch_key is None:
+            return
+        if self._prefetched is None:
+            self._prefetched = dict()
+        if type(value) is list:
+            # Do not let in-place changes to the references go unnoticed
+            value = list(value)
+        self._prefetched[prefetch_key] = (value, objs)
+    
+    def _get_embedding_relation(self, prefetch_key):
+        ''' Return the info of a given relation if it embeds copies of the related objects '''
+        if prefetch_key is None or not self._relations:
+            return None
+        rel = self._relations.get(prefetch_key)
+        return rel if rel is not None and rel.get("embed") else None
+    
+    def _get_embedded(self, related_cls_name, prefetch_key, value):
+        ''' Return (True, objects) if the copies embedded by a given relation are there for the given reference value 
+        The objects are partially loaded, with the embedded fields only.
+        '''
+        rel = self._get_embedding_relation(prefetch_key)
+        if rel is None:
+            return False, None
+        copies = getattr(self, rel["embed_field"])
+        if not copies:
+            return False, None
+        multi = rel.get("multi", False)
+        foreign = rel["foreign"]
+        if multi:
+            if [c.get(foreign) for c in copies] != list(value):
+                return False, None
+        elif copies.get(foreign) != value:
+            # The reference changed without the copy
+            return False, None
+        related_cls = _get_class_from_name(related_cls_name)
+        fields = list(rel["embed"]) + ([foreign] if foreign != ID_ALIAS else [])
+        if multi:
+            return True, [related_cls._hydrate(c, fields) for c in copies]
+        return True, related_cls._hydrate(copies, fields)
+    
+    def _set_embedded(self, prefetch_key, related_objs, multi=False):
+        ''' Embed copies of the given related objects if a given relation does so '''
+        rel = self._get_embedding_relation(prefetch_key)
+        if rel is None:
+            return
+        if not related_objs:
+            copies = None
+        elif multi:
+            copies = [_get_embedded_copy(rel, o) for o in related_objs]
+        else:
+            copies = _get_embedded_copy(rel, related_objs)
+        setattr(self, rel["embed_field"], copies)
+    
+    def _get_related(self, related_cls_name, value, relation_name=ID_ALIAS, prefetch_key=None, embedded=True):
         ''' Fetch a related object 
         related_cls_name:     Name of the class that is referenced
         value:                Reference value
         relation_name:        Foreign parameter that is referenced
+        prefetch_key:         Name of the relation, to use prefetched objects if any
+        embedded:             Whether to use the copy embedded by the relation if any (see build_model)
         '''
         if value is None:
             return None
+        found, obj = self._get_prefetched(prefetch_key, value)
+        if found:
+            return obj
+        if embedded:
+            found, obj = self._get_embedded(related_cls_name, prefetch_key, value)
+            if found:
+                return obj
         related_cls = _get_class_from_name(related_cls_name)
         if relation_name == ID_ALIAS:
             return related_cls.find(value)
@@ -301,31 +500,43 @@ class BaseObject(BasePersistentObject):
             params[relation_name] = value
             return related_cls.find_one_by(**params)
     
-    def _set_related(self, related_obj, relation_name, foreign_relation_name=ID_ALIAS):
+    def _set_related(self, related_obj, relation_name, foreign_relation_name=ID_ALIAS, prefetch_key=None):
         ''' Set a relation value 
         related_obj:              Related object instance
         relation_name:            Local parameter used for the relation
         foreign_relation_name:    Foreign parameter being referenced locally
+        prefetch_key:             Name of the relation, to keep the related object around
         '''
         if related_obj is not None:
             if foreign_relation_name == ID_ALIAS:
                 ref = related_obj.get_id()
             else:
-                getter = getattr(related_obj, "get_%s" % foreign_relation_name)
+                getter = getattr(related_obj, "get_%s" % camel_to_py_case(foreign_relation_name))
                 ref = getter()
         else:
             ref = None
-        setter = getattr(self, "set_%s" % relation_name)
+        setter = getattr(self, "set_%s" % camel_to_py_case(relation_name))
         setter(ref)
+        self._set_prefetched(prefetch_key, ref, related_obj)
+        self._set_embedded(prefetch_key, related_obj)
         
-    def _get_related_array(self, related_cls_name, values, relation_name=ID_ALIAS):
+    def _get_related_array(self, related_cls_name, values, relation_name=ID_ALIAS, prefetch_key=None, embedded=True):
         ''' Fetch an array of related objects 
         related_cls_name:     Name of the class that is referenced
         values:               Reference values
         relation_name:        Foreign parameter that is referenced
+        prefetch_key:         Name of the relation, to use prefetched objects if any
+        embedded:             Whether to use the copies embedded by the relation if any (see build_model)
         '''
         if not values:
             return None
+        found, objs = self._get_prefetched(prefetch_key, values)
+        if found:
+            return objs
+        if embedded:
+            found, objs = self._get_embedded(related_cls_name, prefetch_key, values)
+            if found:
+                return objs
         related_cls = _get_class_from_name(related_cls_name)
         q = Query(related_cls)
         q.where_in(relation_name, values)
@@ -333,31 +544,132 @@ class BaseObject(BasePersistentObject):
         if res and res.count() > 0:
             objs = list()
             for item in res:
-                objs.append(related_cls.from_dict(item))
+                objs.append(related_cls._hydrate(item))
             return objs
     
-    def _set_related_array(self, related_objs, relation_name, foreign_relation_name=ID_ALIAS):
+    def _set_related_array(self, related_objs, relation_name, foreign_relation_name=ID_ALIAS, prefetch_key=None):
         ''' Set a relation array 
         related_objs:             Related object instances
         relation_name:            Local parameter used for the relation
         foreign_relation_name:    Foreign parameter being referenced locally
+        prefetch_key:             Name of the relation, to keep the related objects around
         '''
         if related_objs:
             refs = list()
             if foreign_relation_name == ID_ALIAS:
                 getter_name = "get_id"
             else:
-                getter_name = "get_%s" % foreign_relation_name
+                getter_name = "get_%s" % camel_to_py_case(foreign_relation_name)
             for related_obj in related_objs:
                 getter = getattr(related_obj, getter_name)
                 refs.append(getter())
         else:
             refs = None
-        setter = getattr(self, "set_%s" % relation_name)
+        setter = getattr(self, "set_%s" % camel_to_py_case(relation_name))
         setter(refs)
+        self._set_prefetched(prefetch_key, refs, list(related_objs) if related_objs else None)
+        self._set_embedded(prefetch_key, related_objs, True)
         
     
+    ## ATOMIC OPERATIONS  #######################
+    # Applied to this object right away, and sent as $inc, $push, $addToSet or $pull 
+    # (batched into a single update) on the next save. Paths may be dotted (e.g. "stats.views").
+    
+    def incr(self, path, value=1):
+        ''' Increment the value at a given path '''
+        self._apply_op(INC, path, (self._get_path_value(path) or 0) + value, value)
+        return self
+    
+    def decr(self, path, value=1):
+        ''' Decrement the value at a given path '''
+        return self.incr(path, -value)
+    
+    def push(self, path, *values):
+        ''' Append values to the array at a given path '''
+        items = list(self._get_path_value(path) or ())
+        items.extend(values)
+        self._apply_op(PUSH, path, items, export_value(values))
+        return self
+    
+    def add_to_set(self, path, *values):
+        ''' Append values that are not already there to the array at a given path '''
+        items = list(self._get_path_value(path) or ())
+        for value in values:
+            if value not in items:
+                items.append(value)
+        self._apply_op(ADD_TO_SET, path, items, export_value(values))
+        return self
+    
+    def pull(self, path, *values):
+        ''' Remove all occurrences of the given values from the array at a given path '''
+        items = [item for item in (self._get_path_value(path) or ()) if item not in values]
+        self._apply_op(PULL, path, items, export_value(values))
+        return self
+    
     ## INTERNAL METHODS  ########################
+    
+    @classmethod
+    def _hydrate(cls, d, fields=None):
+        ''' Create an instance from a document, or return the live one from the active identity map 
+        d:         Document to create the instance from
+        fields:    Fields the document was restricted to, if any
+        '''
+        id_map = get_identity_map()
+        if id_map is not None:
+            obj_id = d.get(ID_ALIAS)
+            if type(obj_id) in (str, unicode):
+                obj_id = int(obj_id)
+            obj = id_map.get(cls, obj_id)
+            if obj is not None:
+                return obj
+        obj = cls.from_dict(d)
+        if fields:
+            obj._set_partial(fields)
+        if id_map is not None:
+            obj = id_map.add(obj)
+        return obj
+    
+    def _set_partial(self, fields):
+        ''' Mark this object as only having the given fields loaded '''
+        loaded = set(fields)
+        loaded.add("id")
+        for k, _ in get_serializer(self.__class__, self._base_fields).items(self):
+            if k not in loaded:
+                # Let attribute access fall back to __getattr__ to load the rest
+                delattr(self, k)
+        self._loaded_fields = loaded
+    
+    def _load_missing_fields(self):
+        ''' Fetch the fields that were not loaded '''
+        loaded = self._loaded_fields
+        doc = Query(self._col_name, alias=self._db_alias).where(_id=self.id).fetch_one()
+        if not doc:
+            raise Exception("%s does not exist any more" % self)
+        full = self.__class__.from_dict(doc)
+        serializer = get_serializer(self.__class__, self._base_fields)
+        for k, v in serializer.items(full):
+            if k not in loaded and not serializer.has_value(self, k):
+                setattr(self, k, v)
+        self._snapshot = full._snapshot
+        self._loaded_fields = None
+    
+    def is_partial(self):
+        ''' Return whether only some of the fields of this object were loaded '''
+        return self._loaded_fields is not None
+    
+    def _validate(self):
+        ''' Check this object before it gets persisted (raise ValueError when invalid) '''
+        return
+    
+    def _to_document(self, doc=None):
+        ''' Export this object to a document ready to be inserted 
+        doc:    Export of this object, if already at hand
+        '''
+        doc = dict(doc) if doc is not None else self.to_dict()
+        if doc.has_key("id"):
+            doc[ID_ALIAS] = doc["id"]
+            del doc["id"]
+        return doc
                     
     def __hash__(self):
         ''' Compute the MD5 hash value of this object '''
@@ -371,88 +683,345 @@ class BaseObject(BasePersistentObject):
     def refresh(self):
         ''' Sync this object with its persisted version '''
         if not self._new:
-            res = Query(self._col_name).where(_id=self.get_id()).execute()
+            res = Query(self._col_name, alias=self._db_alias).where(_id=self.get_id()).execute()
             if not res or not res.count():
                 raise Exception("%s does not exist any more" % self)
-            o = res[0]
-            for field in o:
-                setattr(self, field, o[field])      
+            self._sync(res[0])
+    
+    def _sync(self, doc):
+        ''' Overwrite the fields of this object with those of its persisted version '''
+        fresh = self.__class__.from_dict(doc)
+        for k, v in get_serializer(self.__class__, self._base_fields).items(fresh):
+            setattr(self, k, v)
+        self._snapshot = fresh._snapshot
+        self._pending_ops = None
+        self._loaded_fields = None
         
-    def save(self):
-        ''' Persist this object '''
+    def save(self, return_new=False):
+        ''' Persist this object (see update for return_new) '''
         if not self._new:
-            return self.update()
+            return self.update(return_new)
         else:
-            res = Query(self._col_name).insert(**self.to_dict()).execute()
+            doc = self.to_dict()
+            res = Query(self._col_name, alias=self._db_alias).insert(**doc).execute()
             self._new = False
+            self._set_snapshot(doc)
+            id_map = get_identity_map()
+            if id_map is not None:
+                id_map.add(self)
             return res
     
-    def update(self):
-        ''' Update the persisted version of this object or save it if not already persisted '''
-        values = dict()
-        for k in self._change_set:
-            val = self.__getattribute__(k)
-            if hasattr(val, '_serializable'):
-                val = val.to_dict()
-            values[str(k)] = val
-        return Query(self._col_name).where(_id=self.id).update(**values)
+    def update(self, return_new=False):
+        ''' Update the persisted version of this object in a single round trip 
+        return_new:    Whether to get the updated document back (using find_and_modify) and sync 
+                       this object with it, which accounts for concurrent changes to the same fields
+        '''
+        doc = self.to_dict()
+        rules = self._get_update_rules(doc)
+        if not rules:
+            return None
+        changed = get_rule_fields(rules) if self._embedded_in else None
+        q = Query(self._col_name, alias=self._db_alias).where(_id=self.id)
+        set_values = rules.pop(SET, dict())
+        q.update_rules.update(rules)
+        if return_new:
+            new_doc = q.find_and_modify(True, **set_values)
+            if new_doc is None:
+                raise Exception("%s does not exist any more" % self)
+            self._sync(new_doc)
+            res = new_doc
+        else:
+            res = q.update(**set_values)
+            self._set_snapshot(doc)
+        if changed:
+            self.update_embedded_copies(changed)
+        return res
     
     def delete(self):
         ''' Delete the persisted version of this object '''
         if self._new:
             # This object was never saved
             return
-        if self._softdeletable is True:
+        if self._is_softdeletable is True:
             self.set_deleted(int(time()))
             self.save()
         else:
-            return Query(self._col_name).where(_id=self.id).delete()
+            id_map = get_identity_map()
+            if id_map is not None:
+                id_map.remove(self)
+            res = Query(self._col_name, alias=self._db_alias).where(_id=self.id).delete()
+            if self._embedded_in:
+                self.remove_embedded_copies()
+            return res
+    
+    def _get_embedding_relations(self):
+        ''' Return the (class, relation info) pairs of the relations embedding copies of this object '''
+        relations = list()
+        for cls_name, name in self._embedded_in or ():
+            cls = _get_class_from_name(cls_name)
+            relations.append((cls, cls._relations[name]))
+        return relations
+    
+    def update_embedded_copies(self, fields=None):
+        ''' Refresh the copies of this object embedded in the objects referencing it (fan-out), 
+        return the number of objects updated. This is done on update, and only needs calling 
+        after writes that bypass this object or to fill in copies (e.g. when adding a relation).
+        fields:    Names of the fields that changed, to only write those (all of them by default, 
+                   which also fills in the missing copies of single relations)
+        '''
+        n = 0
+        for cls, rel in self._get_embedding_relations():
+            embed_field = rel["embed_field"]
+            multi = rel.get("multi", False)
+            copy = _get_embedded_copy(rel, self)
+            ref = copy[rel["foreign"]]
+            if fields is None:
+                if multi:
+                    q = Query(cls).where(**{ embed_field + "." + rel["foreign"]: ref })
+                    values = { embed_field + ".$": copy }
+                else:
+                    q = Query(cls).where(**{ rel["local"]: ref })
+                    values = { embed_field: copy }
+            else:
+                changed = [k for k in rel["embed"] if k in fields]
+                if not changed:
+                    continue
+                q = Query(cls).where(**{ embed_field + "." + rel["foreign"]: ref })
+                path = embed_field + (".$." if multi else ".")
+                values = dict([(path + k, copy[k]) for k in changed])
+            resp = q.update_all(**values)
+            n += resp.get('n', 0) if type(resp) is dict else 0
+        return n
+    
+    def remove_embedded_copies(self):
+        ''' Remove the copies of this object embedded in the objects referencing it, return the number of objects updated '''
+        n = 0
+        for cls, rel in self._get_embedding_relations():
+            embed_field = rel["embed_field"]
+            ref = self.get_id() if rel["foreign"] == ID_ALIAS else export_value(getattr(self, rel["foreign"]))
+            q = Query(cls).where(**{ embed_field + "." + rel["foreign"]: ref })
+            if rel.get("multi", False):
+                q.update_rules[PULL] = { embed_field: { rel["foreign"]: ref } }
+                resp = q.update_all()
+            else:
+                resp = q.update_all(**{ embed_field: None })
+            n += resp.get('n', 0) if type(resp) is dict else 0
+        return n
+    
+    @classmethod
+    def prefetch_related(cls, objs, *relation_names):
+        ''' Load the given relations of a list of objects with a single query per relation '''
+        if not objs:
+            return objs
+        relations = cls._relations or dict()
+        for name in relation_names:
+            rel = relations.get(name)
+            if rel is None:
+                raise ValueError("%s has no relation named %s" % (cls.__name__, name))
+            multi = rel.get("multi", False)
+            foreign = rel["foreign"]
+            # Collect the references across all objects
+            refs = list()
+            seen = set()
+            for obj in objs:
+                value = getattr(obj, rel["local"])
+                for ref in (value or () if multi else (value,)):
+                    if ref is not None and ref not in seen:
+                        seen.add(ref)
+                        refs.append(ref)
+            related = dict()
+            if refs:
+                related_cls = _get_class_from_name(rel["class"])
+                res = Query(related_cls).where_in(foreign, refs).execute()
+                for item in res:
+                    related[item[foreign]] = related_cls._hydrate(item)
+            # Attach the related objects
+            for obj in objs:
+                value = getattr(obj, rel["local"])
+                if value is None or (multi and not value):
+                    continue
+                if multi:
+                    found = [related[ref] for ref in value if related.has_key(ref)]
+                    obj._set_prefetched(name, value, found or None)
+                else:
+                    obj._set_prefetched(name, value, related.get(value))
+        return objs
     
     @classmethod
     def delete_all(cls):
         ''' Delete all objects of this class '''
         Query(cls).delete()
-    
+
+    @classmethod
+    def upsert_many(cls, objs, key, ordered=True, **options):
+        ''' Insert or update objects by natural key in batched upserts, return a BulkWriteResult
+        Each object is written over the document with the same values for the key fields, or inserted
+        if there is none, and gets the id of that document.
+        objs:       Objects of this class
+        key:        Name of the key field or tuple of names, e.g. ('source', 'external_id')
+        ordered:    Whether to stop at the first error
+        options:    max_batch_docs and max_batch_bytes (see BulkWriter)
+        '''
+        from orm.core.bulk_writer import BulkWriter
+        if isinstance(key, basestring):
+            key = (key,)
+        writer = BulkWriter(ordered, **options)
+        for o in objs:
+            writer.upsert(o, key)
+        return writer.execute()
+
     @classmethod
     def count(cls, **params):
         ''' Return the count of objects of this class '''
         return Query(cls).where(**params).count()
+    
+    @classmethod
+    def aggregate(cls, **params):
+        ''' Return an aggregation pipeline (see orm.db.aggregation) on the objects matching the given parameters 
+        Results that still have the shape of objects of this class are hydrated.
+        '''
+        return Aggregation(Query(cls).where(**params), cls)
+
+    @classmethod
+    def scan(cls, partitions=DEFAULT_PARTITIONS, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, hydrate=True, fields=None, **params):
+        ''' Return a partitioned scan (see orm.db.scan) of the objects matching the given parameters 
+        Iterate over it to get the objects as partitions are read in parallel, 
+        or call map() on it to process them chunk by chunk on worker threads or processes.
+        '''
+        return PartitionedScan(cls._make_query(fields).where(**params), partitions, workers, chunk_size,
+                               cls if hydrate else None, fields)
 
     @classmethod
-    def find_all(cls, hydrate=True):
-        ''' Get all the objects of this class '''
-        objs = Query(cls).execute()
+    def _make_query(cls, fields=None, raw=False):
+        ''' Create a query on this class, restricted to the given fields if any, returning raw documents if set '''
+        q = Query(cls)
+        if fields:
+            q.select(*[f for f in fields if f not in ("id", ID_ALIAS)])
+        if raw:
+            q.raw()
+        return q
+    
+    @classmethod
+    def find_all(cls, hydrate=True, prefetch=None, lazy=False, batch_size=None, fields=None, raw=False):
+        ''' Get all the objects of this class, along with the given relations if any 
+        With lazy set, return a ResultSet hydrating objects as they are iterated over.
+        With fields set, only load the given fields (the others are loaded on first access).
+        With raw set, return undecoded documents instead (see orm.db.raw_bson), 
+        streamed from a cursor already, so it cannot be combined with lazy.
+        '''
+        hydrate = hydrate and not raw
+        if lazy:
+            return ResultSet(cls._make_query(fields, raw), cls, hydrate, prefetch, batch_size)
+        objs = cls._make_query(fields, raw).execute()
         if hydrate and objs:
             hydrated_objs = list()
             for obj in objs:
-                hydrated_objs.append(cls.from_dict(obj))
+                hydrated_objs.append(cls._hydrate(obj, fields))
+            if prefetch:
+                cls.prefetch_related(hydrated_objs, *prefetch)
             return hydrated_objs
         else:
             return objs
         
     @classmethod
-    def find(cls, obj_id, hydrate=True):
-        ''' Find a given object '''
+    def find(cls, obj_id, hydrate=True, fields=None):
+        ''' Find a given object, only loading the given fields if any '''
         if type(obj_id) in [str, unicode]:
             obj_id = int(obj_id)
         if obj_id:
-            obj = Query(cls).where(_id=obj_id).fetch_one()
-            return (cls.from_dict(obj) if hydrate and obj else obj)
+            if hydrate:
+                id_map = get_identity_map()
+                if id_map is not None:
+                    obj = id_map.get(cls, obj_id)
+                    if obj is not None:
+                        return obj
+            obj = cls._make_query(fields).where(_id=obj_id).fetch_one()
+            return (cls._hydrate(obj, fields) if hydrate and obj else obj)
 
     @classmethod
-    def find_by(cls, hydrate=True, **params):
-        ''' Find objects based on a set of parameters '''
-        objs = Query(cls).where(**params).execute()
+    def find_by(cls, hydrate=True, prefetch=None, lazy=False, batch_size=None, fields=None, 
+                page_size=None, page_token=None, sort=None, raw=False, **params):
+        ''' Find objects based on a set of parameters, along with the given relations if any 
+        With lazy set, return a ResultSet hydrating objects as they are iterated over.
+        With fields set, only load the given fields (the others are loaded on first access).
+        With sort set, sort the results by the given field (a name or a (name, direction) pair).
+        With page_size set, return a Page of at most that many objects, following the one 
+        page_token was taken from (see Query.page_after), ties on the sort field broken by id.
+        With raw set, return undecoded documents instead (see orm.db.raw_bson), 
+        streamed from a cursor already, so it cannot be combined with lazy.
+        '''
+        hydrate = hydrate and not raw
+        q = cls._make_query(fields, raw).where(**params)
+        if sort:
+            q.sort(*(sort if type(sort) in (tuple, list) else (sort,)))
+        if page_size:
+            page = q.page_after(page_token, page_size)
+            if hydrate:
+                objs = [cls._hydrate(obj, fields) for obj in page]
+                if prefetch:
+                    cls.prefetch_related(objs, *prefetch)
+                page = Page(objs, page.next_token)
+            return page
+        if lazy:
+            return ResultSet(q, cls, hydrate, prefetch, batch_size)
+        objs = q.execute()
         if hydrate and objs:
             hydrated_objs = []
             for obj in objs:
-                hydrated_objs.append(cls.from_dict(obj))
+                hydrated_objs.append(cls._hydrate(obj, fields))
+            if prefetch:
+                cls.prefetch_related(hydrated_objs, *prefetch)
             return hydrated_objs
         return objs
     
     @classmethod
-    def find_one_by(cls, hydrate=True, **params):
-        ''' Find the first object that matches the given parameters '''
-        obj = Query(cls).where(**params).fetch_one()
-        return cls.from_dict(obj) if hydrate and obj else obj
-    
\ No newline at end of file
+    def find_one_by(cls, hydrate=True, fields=None, raw=False, **params):
+        ''' Find the first object that matches the given parameters, only loading the given fields if any '''
+        obj = cls._make_query(fields, raw).where(**params).fetch_one()
+        return cls._hydrate(obj, fields) if hydrate and not raw and obj else obj
+    
+    
+    
+    ## ASYNC DATA ACCESS METHODS  ###############
+    # Same as their blocking counterparts, but return a QueryFuture right away
+    
+    def refresh_async(self):
+        ''' Sync this object with its persisted version in the background '''
+        return _run_async(self.refresh)
+    
+    def save_async(self):
+        ''' Persist this object in the background '''
+        return _run_async(self.save)
+    
+    def update_async(self):
+        ''' Update the persisted version of this object in the background '''
+        return _run_async(self.update)
+    
+    def delete_async(self):
+        ''' Delete the persisted version of this object in the background '''
+        return _run_async(self.delete)
+    
+    @classmethod
+    def count_async(cls, **params):
+        ''' Count the objects of this class in the background '''
+        return _run_async(cls.count, **params)
+    
+    @classmethod
+    def find_all_async(cls, hydrate=True, prefetch=None, fields=None):
+        ''' Get all the objects of this class in the background '''
+        return _run_async(cls.find_all, hydrate, prefetch, fields=fields)
+    
+    @classmethod
+    def find_async(cls, obj_id, hydrate=True, fields=None):
+        ''' Find a given object in the background '''
+        return _run_async(cls.find, obj_id, hydrate, fields)
+    
+    @classmethod
+    def find_by_async(cls, hydrate=True, prefetch=None, fields=None, **params):
+        ''' Find objects based on a set of parameters in the background '''
+        return _run_async(cls.find_by, hydrate, prefetch, fields=fields, **params)
+    
+    @classmethod
+    def find_one_by_async(cls, hydrate=True, fields=None, **params):
+        ''' Find the first object that matches the given parameters in the background '''
+        return _run_async(cls.find_one_by, hydrate, fields, **params)
@@ -4,50 +4,63 @@ Created on Jun 16, 2012
 @author: Benjamin Dezile
 '''
 
-from orm.db.database import Database
-from orm.db.query import Query
-import json
+from orm.core.bulk_writer import BulkWriter, DEFAULT_MAX_BATCH_DOCS, DEFAULT_MAX_BATCH_BYTES
+from orm.core import json_encoder
+from orm.core.json_encoder import DEFAULT_CHUNK_SIZE
 
 class BaseObjectArray(list):
     ''' Array of BaseObjects '''
     
     def __init__(self, objs=None):
         ''' Create a new array of objects '''
+        list.__init__(self)
+        self._removed = list()
         if objs:
-            if not hasattr(objs[0], 'getClassName'):
+            if not hasattr(objs[0], 'get_class_name'):
                 raise Exception("Objects must extend BaseObject")
-            list.__init__(objs)
+            self.extend(objs)
     
-    def save(self):
-        ''' Save the list of object in bulk '''
-        if len(self) > 0:
-            cls = self.__getitem__(0).__class__
-            if not hasattr(cls, 'getClassName'):
-                raise Exception("Objects must extend BaseObject")
-            col = Database._get_collection(cls.getClassName())
-            objs = list()
-            for o in self:
-                doc = o.toDict()
-                doc['_id'] = o.getId()
-                del doc['id']
-                objs.append(doc)
-            col.insert(objs)
-            
-    def delete(self):
-        ''' Delete the persisted versions of this objects '''
-        if len(self) > 0:
-            cls = self.__getitem__(0).__class__
-            if not hasattr(cls, 'getClassName'):
-                raise Exception("Objects must extend BaseObject")
-            obj_ids = map(lambda x: x.getId())
-            q = Query(cls)
-            q.where_in("_id", obj_ids)
-            q.delete()
+    def discard(self, obj):
+        ''' Remove an object from this array and delete it on the next save '''
+        for i in range(len(self)):
+            if self[i] is obj:
+                del self[i]
+                self._removed.append(obj)
+                return
+        raise ValueError("%s is not in this array" % obj)
+    
+    def save(self, ordered=True, max_batch_docs=DEFAULT_MAX_BATCH_DOCS, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+        ''' Save the list of objects in bulk: new objects are inserted, changed ones are 
+        updated and discarded ones are deleted. Return a BulkWriteResult.
+        ordered:            Whether to stop at the first error
+        max_batch_docs:     Maximum number of objects written per round trip
+        max_batch_bytes:    Maximum BSON size written per round trip
+        '''
+        writer = BulkWriter(ordered, max_batch_docs, max_batch_bytes)
+        for o in self:
+            writer.add(o)
+        for o in self._removed:
+            writer.delete(o)
+        res = writer.execute()
+        if self._removed:
+            # Keep the deletions that did not go through for the next save
+            done = set([id(o) for o in res.processed])
+            self._removed = [o for o in self._removed if id(o) not in done and not o.is_new()]
+        return res
             
-    def to_json(self):
-        ''' Return a JSON representation of this array '''
-        l = list()
+    def delete(self, ordered=True, max_batch_docs=DEFAULT_MAX_BATCH_DOCS, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+        ''' Delete the persisted versions of these objects in bulk, return a BulkWriteResult '''
+        writer = BulkWriter(ordered, max_batch_docs, max_batch_bytes)
         for o in self:
-            l.append(o.to_dict())
-        return json.dumps(l)
-            
\ No newline at end of file
+            writer.delete(o)
+        return writer.execute()
+            
+    def iter_json(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        ''' Return a generator of chunks of the JSON representation of this array '''
+        return json_encoder.iter_json(self, chunk_size=chunk_size)
+            
+    def to_json(self, fp=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        ''' Return a JSON representation of this array, or write it to a given file-like object chunk by chunk '''
+        if fp is None:
+            return "".join(self.iter_json(chunk_size))
+        json_encoder.dump(self, fp, chunk_size=chunk_size)
@@ -4,13 +4,45 @@ Created on Feb 21, 2012
 Build all the base classes based on the configuration
 found in config/model.yml
 
+With --slots (or "slots" listed under "as" for a given class), the
+generated classes use __slots__ instead of a per-instance __dict__.
+Subclasses must then declare __slots__ as well (e.g. __slots__ = ())
+to keep their instances without __dict__.
+
+A "read_preference" entry (a mode, or a [mode, max_lag] pair) sets the
+replica set members the finds and counts of a class are routed to.
+"collection" and "db_alias" entries set the collection objects of a class
+are stored in (the class name by default) and the alias of its database
+(see Database.get_instance).
+
+An "embed" entry on a relation (a list of fields of the related class)
+keeps a copy of these fields of the related object(s) next to the
+reference, in a "<relation>_embed" field (or the one named by
+"embed_field"). The relational getter then returns partially loaded
+objects built from the copies without a query (get_<relation>(True)
+fetches them in full), and updates of the related objects refresh the
+copies of the objects referencing them (see BaseObject.update_embedded_copies):
+
+    author:
+        class: User
+        local: author_id
+        foreign: id
+        embed: [name, avatar]
+
+Indexes are built in the background, several collections at a time
+(see Database.build_indexes). Options:
+    --db name [--host host] [--port port]   Database to build indexes in
+    --dry-run                               Only print the indexes that would be built
+    --foreground                            Build indexes in the foreground (faster, but blocks the collections)
+    --parallel n                            Number of collections indexed at the same time
+
 @requires: py-utils (https://github.com/benjdezi/Python-Utils)
 @author: Benjamin Dezile
 '''
 
 from cStringIO import StringIO
 from pyutils.utils.helpers import camel_to_py_case
-from orm.db.database import Database
+from orm.db.database import Database, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_INDEX_BUILDS
 import os
 import datetime
 import traceback
@@ -22,8 +54,26 @@ def generate_htag(data):
     h = hash(data)
     return hex(h).strip('0x')
 
-def build_model_class(class_path, class_name, class_info, overwrite=False):
-    ''' Build the model class file for a given class '''
+def get_embedding_relations(model):
+    ''' Return the relations embedding copies of the objects of each class: class name -> [(class name, relation name)] '''
+    res = dict()
+    for cls_name in sorted(model.keys()):
+        relations = model.get(cls_name).get("relations", None) or dict()
+        for rel_name in sorted(relations.keys()):
+            rel_info = relations[rel_name]
+            if rel_info.get("embed"):
+                res.setdefault(rel_info["class"], list()).append((cls_name, rel_name))
+    return res
+
+def get_embed_field(relation_name, relation_info):
+    ''' Return the name of the field holding the copies embedded by a given relation '''
+    return relation_info.get("embed_field", "%s_embed" % relation_name)
+
+def build_model_class(class_path, class_name, class_info, overwrite=False, slots=False, embedded_in=None):
+    ''' Build the model class file for a given class 
+    slots:          Whether to generate a __slots__ based class (see module doc)
+    embedded_in:    (class name, relation name) pairs of the relations embedding copies of objects of this class
+    '''
     
     filename = "base_%s.py" % camel_to_py_case(class_name) 
     filepath = os.path.join(class_path, filename)
@@ -39,11 +89,23 @@ def build_model_class(class_path, class_name, class_info, overwrite=False):
     fp = None
     fields = class_info.get("fields")
     relations = class_info.get("relations", None)
+    if relations:
+        # Fields holding the copies embedded by relations
+        fields = dict(fields)
+        for rel_name in relations.keys():
+            rel_info = relations[rel_name]
+            if rel_info.get("embed"):
+                fields[get_embed_field(rel_name, rel_info)] = { "type": "list" if rel_info.get("multi", False) else "dict", 
+                                                                "required": False }
     field_names = fields.keys()
     field_as = class_info.get("as", dict())
     is_ts = field_as.has_key("timestampable")
     is_sd = field_as.has_key("softdeletable")
     is_emb = field_as.has_key("embedded")
+    use_slots = slots or field_as.has_key("slots")
+    read_pref = class_info.get("read_preference", None)
+    col_name = class_info.get("collection", class_name)
+    db_alias = class_info.get("db_alias", None)
     
     header = StringIO()
     buf = StringIO()
@@ -62,14 +124,37 @@ def build_model_class(class_path, class_name, class_info, overwrite=False):
     buf.write("    ''' Base implementation for " + class_name +" '''\n")
     buf.write("\n")
     
+    # Field declarations, used to compile the serializer
+    buf.write(_make_field_declarations_code(fields, field_names))
+    
+    # Relations
+    if relations and not is_emb:
+        buf.write(_make_relations_code(relations))
+    
+    # Class level constants
+    if is_emb:
+        buf.write("    _embedded = True\n")
+    else:
+        buf.write("    _col_name = '" + col_name + "'\n")
+        if db_alias:
+            buf.write("    _db_alias = '" + db_alias + "'\n")
+        buf.write("    _timestampable = " + str(is_ts) + "\n")
+        buf.write("    _softdeletable = " + str(is_sd) + "\n")
+        if embedded_in:
+            buf.write("    _embedded_in = (" + "".join(["('%s', '%s'), " % pair for pair in embedded_in]) + ")\n")
+        if read_pref:
+            buf.write("    _read_preference = " + repr(read_pref if type(read_pref) is str else tuple(read_pref)) + "\n")
+    if use_slots:
+        buf.write("    __slots__ = (" + "".join(["'%s', " % field_name for field_name in field_names]) + ")\n")
+    buf.write("\n")
+    
     # Constructor
     if is_emb:
-        buf.write("    _embedded = True\n\n")
         buf.write("    def __init__(self):\n")
         buf.write("        Serializable.__init__(self)\n")
     else:
         buf.write("    def __init__(self, is_new = False):\n")
-        buf.write("        BaseObject.__init__(self, is_new, " + ("True" if is_ts else "False") + ", " + ("True" if is_sd else "False") + ")\n")
+        buf.write("        BaseObject.__init__(self, is_new)\n")
     for field in field_names:
         default_val = fields[field].get("default", None)
         if type(default_val) == str:
@@ -103,13 +188,16 @@ def build_model_class(class_path, class_name, class_info, overwrite=False):
     if not is_emb:
         buf.write("\n")
         buf.write("    ##  MANAGEMENT METHODS  ######################\n\n")
-        buf.write("    def save(self):\n")
+        buf.write("    def _validate(self):\n")
         for field_name in field_names:
             field_info = fields[field_name]
             if field_info["required"] is True:
                 buf.write("        if self." + field_name + " is None:\n")
                 buf.write("            raise ValueError('" + class_name + "." + field_name + " is required')\n")
-        buf.write("        " + root_class + ".save(self)\n")
+        buf.write("        " + root_class + "._validate(self)\n\n")
+        buf.write("    def save(self, return_new=False):\n")
+        buf.write("        self._validate()\n")
+        buf.write("        return " + root_class + ".save(self, return_new)\n")
     
     buf.write("\n")
     
@@ -166,6 +254,33 @@ def _make_setter_code(field_name, field_info):
     code += "\n\n"
     return code
 
+def _make_field_declarations_code(fields, field_names):
+    ''' Generate the code declaring the fields and their types '''
+    code = "    _fields = (" + "".join(["'%s', " % field_name for field_name in field_names]) + ")\n"
+    code += "    _field_types = {\n"
+    for field_name in field_names:
+        field_type = fields[field_name].get("type", None)
+        code += "        '%s': %s,\n" % (field_name, "'%s'" % field_type if field_type else "None")
+    code += "    }\n\n"
+    return code
+
+def _make_relations_code(relations):
+    ''' Generate the code for the relation map used to prefetch related objects '''
+    code = "    _relations = {\n"
+    for relation_name in relations.keys():
+        relation_info = relations[relation_name]
+        foreign_rel_name = relation_info["foreign"]
+        if foreign_rel_name == "id":
+            foreign_rel_name = "_id"
+        embed = ""
+        if relation_info.get("embed"):
+            embed = ", 'embed': (%s), 'embed_field': '%s'" % ("".join(["'%s', " % f for f in relation_info["embed"]]), 
+                                                              get_embed_field(relation_name, relation_info))
+        code += "        '%s': { 'class': '%s', 'local': '%s', 'foreign': '%s', 'multi': %s%s },\n" % \
+            (relation_name, relation_info["class"], relation_info["local"], foreign_rel_name, bool(relation_info.get("multi", False)), embed)
+    code += "    }\n\n"
+    return code
+
 def _make_relational_getter_code(relation_name, relation_info):
     ''' Generate the code for a given relational getter '''
     rel_cls_name = relation_info["class"]
@@ -173,12 +288,18 @@ def _make_relational_getter_code(relation_name, relation_info):
     if foreign_rel_name == "id":
         foreign_rel_name = "_id"
     local_rel_name = relation_info["local"] 
-    code = "    def get_" + camel_to_py_case(relation_name) + "(self):\n"
+    if relation_info.get("embed"):
+        # Served from the embedded copies unless asked for in full
+        code = "    def get_" + camel_to_py_case(relation_name) + "(self, full=False):\n"
+        embedded = ", not full"
+    else:
+        code = "    def get_" + camel_to_py_case(relation_name) + "(self):\n"
+        embedded = ""
     code += "        ref = self.get_" + camel_to_py_case(local_rel_name) + "()\n"
     if relation_info.get("multi", False):
-        code += "        return self._get_related_array('%s', ref, '%s')" % (rel_cls_name, foreign_rel_name)
+        code += "        return self._get_related_array('%s', ref, '%s', '%s'%s)" % (rel_cls_name, foreign_rel_name, relation_name, embedded)
     else:
-        code += "        return self._get_related('%s', ref, '%s')" % (rel_cls_name, foreign_rel_name)
+        code += "        return self._get_related('%s', ref, '%s', '%s'%s)" % (rel_cls_name, foreign_rel_name, relation_name, embedded)
     code += "\n\n"
     return code
 
@@ -191,9 +312,9 @@ def _make_relational_setter_code(relation_name, relation_info):
     multi = relation_info.get("multi", False) 
     code = "    def set_" + camel_to_py_case(relation_name) + "(self, obj" + ("s" if multi else "") + "):\n"
     if multi:
-        code += "        return self._set_related_array(objs, '%s', '%s')" % (local_rel_name, foreign_rel_name)
+        code += "        return self._set_related_array(objs, '%s', '%s', '%s')" % (local_rel_name, foreign_rel_name, relation_name)
     else:
-        code += "        return self._set_related(obj, '%s', '%s')" % (local_rel_name, foreign_rel_name)
+        code += "        return self._set_related(obj, '%s', '%s', '%s')" % (local_rel_name, foreign_rel_name, relation_name)
     code += "\n\n"
     return code
 
@@ -210,6 +331,10 @@ if __name__ == "__main__":
     over_write = "--force" in sys.argv
     if over_write:
         print "WARNING: override enabled"
+    use_slots = "--slots" in sys.argv
+    dry_run = "--dry-run" in sys.argv
+    background = "--foreground" not in sys.argv
+    parallel = int(sys.argv[sys.argv.index('--parallel') + 1]) if "--parallel" in sys.argv else DEFAULT_INDEX_BUILDS
     
     # Build model from config
     start_time = time.time()
@@ -218,8 +343,9 @@ if __name__ == "__main__":
     print "Building model"
     
     filenames = dict()
+    embedding = get_embedding_relations(model)
     for cls_name in model.keys():
-        file_name = build_model_class(class_path, cls_name, model.get(cls_name), over_write)
+        file_name = build_model_class(class_path, cls_name, model.get(cls_name), over_write, use_slots, embedding.get(cls_name))
         filenames[file_name] = True
         
     # Clean old file
@@ -230,7 +356,11 @@ if __name__ == "__main__":
             print "Deleted %s" % filename
             
     # Ensure indexes
-    Database.build_indexes(model)
+    if "--db" in sys.argv:
+        Database.get_instance(db_name=sys.argv[sys.argv.index('--db') + 1],
+                              host=sys.argv[sys.argv.index('--host') + 1] if "--host" in sys.argv else DEFAULT_HOST,
+                              port=int(sys.argv[sys.argv.index('--port') + 1]) if "--port" in sys.argv else DEFAULT_PORT)
+    Database.build_indexes(model, background, dry_run, parallel)
         
     print "Built model in %.3f seconds" % (time.time() - start_time)
 
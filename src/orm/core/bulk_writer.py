@@ -0,0 +1,293 @@
+'''
+Created on Oct 17, 2026
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from time import time
+from bson import BSON
+from pymongo.errors import BulkWriteError
+from orm.db.query import Query, BULK_INSERT, BULK_UPDATE, BULK_UPSERT, BULK_DELETE
+from orm.core.base_object import ID_ALIAS
+from orm.core.change_tracking import get_rule_fields
+
+DEFAULT_MAX_BATCH_DOCS = 1000
+DEFAULT_MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+# Fields only written when an upsert inserts a new document
+INSERT_ONLY_FIELDS = (ID_ALIAS, "created")
+
+class BulkObjectError(object):
+    ''' Error that occurred while writing a given object '''
+
+    def __init__(self, obj, op, message, code=None):
+        self.obj = obj
+        self.op = op
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return "Could not %s %s: %s" % (self.op, self.obj, self.message)
+
+
+class BulkWriteResult(object):
+    ''' Outcome of a bulk write '''
+
+    def __init__(self):
+        self.n_inserted = 0
+        self.n_upserted = 0         # Documents inserted by upserts
+        self.n_matched = 0
+        self.n_modified = 0
+        self.n_deleted = 0
+        self.errors = list()        # BulkObjectError instances
+        self.processed = list()     # Objects that were written successfully
+        self.skipped = list()       # Objects that were not attempted because of an earlier error (ordered mode)
+
+    def ok(self):
+        ''' Return whether all objects were written '''
+        return not self.errors and not self.skipped
+
+    def _merge(self, resp):
+        ''' Merge a raw bulk response into this result '''
+        self.n_inserted += resp.get('nInserted', 0)
+        self.n_upserted += resp.get('nUpserted', 0)
+        self.n_matched += resp.get('nMatched', 0)
+        self.n_modified += resp.get('nModified', 0) or 0
+        self.n_deleted += resp.get('nRemoved', 0)
+
+    def __str__(self):
+        return "%d inserted, %d upserted, %d matched, %d modified, %d deleted, %d errors, %d skipped" % \
+            (self.n_inserted, self.n_upserted, self.n_matched, self.n_modified, self.n_deleted, len(self.errors), len(self.skipped))
+
+
+class BulkWriter(object):
+    ''' Groups writes of many objects into chunked bulk operations '''
+
+    def __init__(self, ordered=True, max_batch_docs=DEFAULT_MAX_BATCH_DOCS, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+        ''' Create a new writer
+        ordered:            Whether to stop at the first error (otherwise every operation is attempted)
+        max_batch_docs:     Maximum number of operations sent in one round trip
+        max_batch_bytes:    Maximum BSON size of the operations sent in one round trip
+        '''
+        self.ordered = ordered
+        self.max_batch_docs = max_batch_docs
+        self.max_batch_bytes = max_batch_bytes
+        self._ops = list()      # ((database alias, collection name), kind, object, operation, size, exported object)
+        self._errors = list()
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _queue(self, obj, kind, op, doc=None):
+        ''' Queue an operation for a given object, along with its export if any '''
+        size = len(BSON.encode(op[-1]))
+        self._ops.append(((obj._db_alias, obj._col_name), kind, obj, op, size, doc))
+
+    def _get_batches(self):
+        ''' Split the queued operations into batches of a single collection '''
+        batches = list()
+        if self.ordered:
+            # Consecutive operations on the same collection, to preserve ordering
+            groups = list()
+            for item in self._ops:
+                if not groups or groups[-1][0][0] != item[0]:
+                    groups.append(list())
+                groups[-1].append(item)
+        else:
+            by_col = dict()
+            groups = list()
+            for item in self._ops:
+                if not by_col.has_key(item[0]):
+                    by_col[item[0]] = list()
+                    groups.append(by_col[item[0]])
+                by_col[item[0]].append(item)
+        for group in groups:
+            batch = list()
+            batch_size = 0
+            for item in group:
+                if batch and (len(batch) >= self.max_batch_docs or batch_size + item[4] > self.max_batch_bytes):
+                    batches.append(batch)
+                    batch = list()
+                    batch_size = 0
+                batch.append(item)
+                batch_size += item[4]
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def _on_success(self, item, matched=False):
+        ''' Sync a given object with its persisted state, and the copies embedded in the objects referencing it 
+        matched:    Whether an upsert matched an existing document
+        '''
+        kind, obj, doc = item[1], item[2], item[5]
+        if kind == BULK_INSERT:
+            obj._new = False
+            obj._set_snapshot(doc)
+        elif kind == BULK_UPDATE:
+            obj._set_snapshot(doc)
+            if obj._embedded_in:
+                obj.update_embedded_copies(get_rule_fields(item[3][2]))
+        elif kind == BULK_UPSERT:
+            obj.set_id(doc["id"])
+            obj._new = False
+            obj._set_snapshot(doc)
+            if matched and obj._embedded_in:
+                obj.update_embedded_copies()
+        elif kind == BULK_DELETE and obj._embedded_in:
+            obj.remove_embedded_copies()
+
+    def _resolve_matched(self, items):
+        ''' Sync the exports of upserted objects that matched existing documents with these documents, 
+        whose ids and insert only fields were kept, in a single round trip 
+        '''
+        alias, col_name = items[0][0]
+        selectors = [item[3][1] for item in items]
+        keys = sorted(selectors[0].keys())
+        fields = set(keys)
+        for item in items:
+            fields.update(item[3][2].get('$setOnInsert', dict()).keys())
+        q = Query(col_name, alias=alias).where(**({ '$or': selectors } if len(selectors) > 1 else selectors[0]))
+        found = dict()
+        for d in q.select(*fields).cache(False).execute():
+            found[tuple([d.get(k) for k in keys])] = d
+        for item in items:
+            d = found.get(tuple([item[3][1][k] for k in keys]))
+            if d is None:
+                # Deleted in the meantime
+                continue
+            doc = item[5]
+            for k in item[3][2].get('$setOnInsert', dict()).keys():
+                if k == ID_ALIAS:
+                    doc["id"] = d[ID_ALIAS]
+                elif d.has_key(k):
+                    doc[k] = d[k]
+                    setattr(item[2], k, d[k])
+
+    def _run_batch(self, batch, res):
+        ''' Send a batch of operations, return whether it went through without errors '''
+        failed = dict()
+        try:
+            alias, col_name = batch[0][0]
+            resp = Query(col_name, alias=alias).bulk([item[3] for item in batch], self.ordered)
+        except BulkWriteError, e:
+            resp = e.details
+            for err in resp.get('writeErrors', list()):
+                failed[err['index']] = err
+            if not failed:
+                # Write concern error, nothing can be said about individual objects
+                for item in batch:
+                    res.errors.append(BulkObjectError(item[2], item[1], str(resp.get('writeConcernErrors'))))
+                return False
+        res._merge(resp)
+        last = min(failed.keys()) if failed and self.ordered else len(batch) - 1
+        upserted = set()
+        for u in resp.get('upserted', list()):
+            upserted.add(u['index'])
+            batch[u['index']][5]["id"] = u['_id']
+        matched = [batch[i] for i in range(last + 1) if batch[i][1] == BULK_UPSERT and i not in upserted and not failed.has_key(i)]
+        if matched:
+            self._resolve_matched(matched)
+        for i in range(len(batch)):
+            item = batch[i]
+            if failed.has_key(i):
+                err = failed[i]
+                res.errors.append(BulkObjectError(item[2], item[1], err.get('errmsg'), err.get('code')))
+            elif i > last:
+                res.skipped.append(item[2])
+            else:
+                self._on_success(item, i not in upserted)
+                res.processed.append(item[2])
+        return not failed
+
+
+    ##  PUBLIC METHODS  #######################
+
+    def insert(self, obj):
+        ''' Queue the insertion of a new object '''
+        try:
+            obj._validate()
+        except ValueError, e:
+            self._errors.append(BulkObjectError(obj, BULK_INSERT, str(e)))
+            return
+        doc = obj.to_dict()
+        self._queue(obj, BULK_INSERT, (BULK_INSERT, obj._to_document(doc)), doc)
+
+    def update(self, obj):
+        ''' Queue the update of the changed fields of an object '''
+        try:
+            doc = obj.to_dict()
+            rules = obj._get_update_rules(doc)
+            if not rules:
+                return
+            obj._validate()
+        except ValueError, e:
+            self._errors.append(BulkObjectError(obj, BULK_UPDATE, str(e)))
+            return
+        self._queue(obj, BULK_UPDATE, (BULK_UPDATE, { ID_ALIAS: obj.get_id() }, rules), doc)
+
+    def upsert(self, obj, key):
+        ''' Queue the upsert of an object keyed on some of its fields: the document with the same values 
+        for these fields gets the fields of the object, or the object is inserted if there is none. 
+        The object then gets the id of the document it was written to. 
+        key:    Names of the fields identifying the object (ideally covered by a unique index, 
+                otherwise concurrent upserts of the same key may insert duplicates)
+        '''
+        try:
+            doc = obj.to_dict()
+            selector = dict()
+            for k in key:
+                if doc.get(k) is None:
+                    raise ValueError("Missing value for key field %s" % k)
+                selector[k] = doc[k]
+            obj._validate()
+        except ValueError, e:
+            self._errors.append(BulkObjectError(obj, BULK_UPSERT, str(e)))
+            return
+        values = obj._to_document(doc)
+        on_insert = dict()
+        for k in INSERT_ONLY_FIELDS:
+            if values.get(k, None) is not None:
+                on_insert[k] = values[k]
+            values.pop(k, None)
+        rules = { '$set': values }
+        if on_insert:
+            rules['$setOnInsert'] = on_insert
+        self._queue(obj, BULK_UPSERT, (BULK_UPSERT, selector, rules), doc)
+
+    def delete(self, obj):
+        ''' Queue the deletion of an object '''
+        if obj.is_new():
+            # This object was never saved
+            return
+        if obj._is_softdeletable is True:
+            obj.set_deleted(int(time()))
+            self.update(obj)
+        else:
+            self._queue(obj, BULK_DELETE, (BULK_DELETE, { ID_ALIAS: obj.get_id() }))
+
+    def add(self, obj):
+        ''' Queue whatever write is needed to persist an object '''
+        if obj.is_new():
+            self.insert(obj)
+        else:
+            self.update(obj)
+
+    def execute(self):
+        ''' Send all queued operations and return a BulkWriteResult '''
+        res = BulkWriteResult()
+        res.errors.extend(self._errors)
+        if self.ordered and self._errors:
+            # Invalid objects break the ordering, do not write anything
+            res.skipped.extend([item[2] for item in self._ops])
+        else:
+            batches = self._get_batches()
+            for k in range(len(batches)):
+                if not self._run_batch(batches[k], res) and self.ordered:
+                    for batch in batches[k+1:]:
+                        res.skipped.extend([item[2] for item in batch])
+                    break
+        self._ops = list()
+        self._errors = list()
+        return res
+
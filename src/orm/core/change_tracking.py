@@ -0,0 +1,122 @@
+'''
+Created on Oct 17, 2026
+
+Change tracking by snapshot diffing: persisted objects keep the document
+they were loaded from (or last saved as), and updates are computed by
+comparing it with the current export of the object. Assignments cost
+nothing, and nested changes (embedded objects, lists) result in minimal
+$set, $unset and $push rules instead of whole documents being rewritten.
+
+@author: Benjamin Dezile
+'''
+
+from orm.core.serializer import CLASS_KEY, ID_ALIAS, copy_document
+
+SET = "$set"
+UNSET = "$unset"
+PUSH = "$push"
+INC = "$inc"
+ADD_TO_SET = "$addToSet"
+PULL = "$pull"
+
+# Snapshot value of fields to overwrite as a whole on the next save
+OVERWRITE = object()
+
+def top_field(path):
+    ''' Return the top level field of a dotted path '''
+    return path.split(".", 1)[0]
+
+def export_value(value):
+    ''' Return a value the way it appears in documents '''
+    if hasattr(value, "_serializable"):
+        return value.to_dict()
+    elif type(value) in (list, tuple):
+        return [export_value(v) for v in value]
+    return copy_document(value)
+
+def _diff_value(old, new, path, rules):
+    ''' Add the rules turning an old value into a new one at a given path '''
+    if new is None:
+        rules[UNSET][path] = 1
+        return
+    t = type(new)
+    if t is dict and type(old) is dict and old.get(CLASS_KEY) == new.get(CLASS_KEY):
+        # Same embedded object, or plain dictionary
+        _diff_fields(old, new, path + ".", rules)
+        return
+    if t is list and type(old) is list:
+        n = len(old)
+        if len(new) > n and new[:n] == old:
+            # Items were appended
+            rules[PUSH][path] = { "$each": new[n:] }
+            return
+        if len(new) == n:
+            # Items were changed in place
+            for i in range(n):
+                if old[i] != new[i]:
+                    _diff_value(old[i], new[i], "%s.%d" % (path, i), rules)
+            return
+    rules[SET][path] = new
+
+def _diff_fields(old, new, prefix, rules):
+    ''' Add the rules turning the fields of an old document into those of a new one '''
+    for k, v in new.iteritems():
+        old_v = old.get(k)
+        if old_v is None:
+            if v is not None:
+                rules[SET][prefix + k] = v
+        elif old_v != v:
+            _diff_value(old_v, v, prefix + k, rules)
+    for k in old:
+        if not new.has_key(k) and old[k] is not None:
+            rules[UNSET][prefix + k] = 1
+
+def get_changed_fields(old, new):
+    ''' Return the names of the top level fields that differ between two documents '''
+    changed = set()
+    for k, v in new.iteritems():
+        if k not in ("id", ID_ALIAS) and old.get(k) != v:
+            changed.add(k)
+    for k in old:
+        if k not in ("id", ID_ALIAS) and not new.has_key(k) and old[k] is not None:
+            changed.add(k)
+    return changed
+
+def get_rule_fields(rules):
+    ''' Return the names of the top level fields some update rules write to '''
+    fields = set()
+    for values in rules.itervalues():
+        fields.update([top_field(k) for k in values])
+    return fields
+
+def diff_documents(old, new):
+    ''' Return the update rules ($set, $unset and $push) turning an old document into a new one '''
+    rules = { SET: dict(), UNSET: dict(), PUSH: dict() }
+    old = dict([(k, v) for k, v in old.iteritems() if k not in ("id", ID_ALIAS)])
+    new = dict([(k, v) for k, v in new.iteritems() if k not in ("id", ID_ALIAS)])
+    _diff_fields(old, new, "", rules)
+    return dict([(op, values) for op, values in rules.iteritems() if values])
+
+def merge_rules(rules, pending, doc):
+    ''' Merge pending atomic operations into the rules computed by diff_documents 
+    Fields changed both directly and through operations are overwritten with their current value.
+    '''
+    changed = get_rule_fields(rules)
+    merged = dict([(op, dict(values)) for op, values in rules.iteritems()])
+    for op, values in pending.iteritems():
+        for path, arg in values.iteritems():
+            field = top_field(path)
+            if field not in changed:
+                merged.setdefault(op, dict())[path] = arg
+                continue
+            # Overwrite the whole field instead
+            for v in merged.itervalues():
+                for k in v.keys():
+                    if top_field(k) == field:
+                        del v[k]
+            if doc.get(field) is None:
+                merged.setdefault(UNSET, dict())[field] = 1
+            else:
+                merged.setdefault(SET, dict())[field] = doc[field]
+    return dict([(op, values) for op, values in merged.iteritems() if values])
+
@@ -0,0 +1,115 @@
+'''
+Created on Oct 17, 2026
+
+@author: Benjamin Dezile
+'''
+
+import threading
+import weakref
+
+_local = threading.local()
+
+def _get_stack():
+    ''' Return the stack of identity maps active in the current thread '''
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = list()
+    return stack
+
+def get_identity_map():
+    ''' Return the identity map active in the current thread, if any '''
+    stack = _get_stack()
+    return stack[-1] if stack else None
+
+
+class IdentityMap(object):
+    ''' Unit of work ensuring each (class, id) pair resolves to a single live instance
+
+    Use it as a context manager to scope it to a block of code:
+
+        with IdentityMap():
+            a = Post.find(1)
+            b = Post.find(1)    # No query, a is b
+
+    or bind it to the current thread until unbind() is called. A map can be
+    bound to several threads at once (e.g. by background finds), registering
+    instances is thread-safe.
+    '''
+
+    def __init__(self, weak=True):
+        ''' Create a new identity map
+        weak:    Only hold weak references, objects are dropped once nothing else uses them
+        '''
+        self.weak = weak
+        self._objs = weakref.WeakValueDictionary() if weak else dict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.bind()
+        return self
+
+    def __exit__(self, t, value, tb):
+        self.unbind()
+
+    def __len__(self):
+        return len(self._objs)
+
+    def __contains__(self, obj):
+        return self.get(obj.__class__, obj.get_id()) is obj
+
+
+    ##  PUBLIC METHODS  #######################
+
+    def bind(self):
+        ''' Make this map the active one for the current thread '''
+        _get_stack().append(self)
+        return self
+
+    def unbind(self):
+        ''' Deactivate this map for the current thread '''
+        stack = _get_stack()
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is self:
+                del stack[i]
+                return
+
+    def get(self, cls, obj_id):
+        ''' Return the live instance of the given class with the given id, if any '''
+        if obj_id is None:
+            return None
+        return self._objs.get((cls, obj_id))
+
+    def add(self, obj):
+        ''' Register an instance, return the one that was already registered if any '''
+        key = (obj.__class__, obj.get_id())
+        with self._lock:
+            existing = self._objs.get(key)
+            if existing is not None:
+                return existing
+            self._objs[key] = obj
+        return obj
+
+    def remove(self, obj):
+        ''' Unregister an instance '''
+        key = (obj.__class__, obj.get_id())
+        with self._lock:
+            if self._objs.get(key) is obj:
+                del self._objs[key]
+
+    def objects(self):
+        ''' Return all the live instances '''
+        return self._objs.values()
+
+    def flush(self, ordered=True):
+        ''' Persist the changes made to all the live instances in bulk, return a BulkWriteResult '''
+        from orm.core.bulk_writer import BulkWriter
+        writer = BulkWriter(ordered)
+        for obj in self.objects():
+            writer.add(obj)
+        return writer.execute()
+
+    def clear(self):
+        ''' Forget about all instances '''
+        with self._lock:
+            self._objs.clear()
+
@@ -0,0 +1,97 @@
+'''
+Created on Oct 17, 2026
+
+Streaming JSON export of model objects and raw documents. Each item is
+encoded in one shot by the C accelerated encoder, and items are written
+out in chunks as they come, so exporting a cursor or a large array never
+holds more than a chunk of JSON and a single document in memory:
+
+    json_encoder.dump(Venue.find_all(lazy=True), response)
+
+ObjectIds are exported as strings and dates in ISO 8601 format. Raw
+documents (see orm.db.raw_bson) are decoded in one go. simplejson
+is used when installed (pip install simplejson), and any other encoder
+can be plugged in with set_encoder().
+
+@author: Benjamin Dezile
+'''
+
+from orm.db.raw_bson import RawDocument
+from bson.objectid import ObjectId
+from datetime import datetime, date
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def default(value):
+    ''' Return a JSON encodable version of a value the encoder does not know about '''
+    if isinstance(value, ObjectId):
+        return str(value)
+    elif isinstance(value, (datetime, date)):
+        return value.isoformat()
+    elif isinstance(value, (set, frozenset)):
+        return list(value)
+    elif hasattr(value, "_serializable") or isinstance(value, RawDocument):
+        return value.to_dict()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+def _dumps(value, ensure_ascii=True):
+    ''' Encode a value with the json module '''
+    return json.dumps(value, ensure_ascii=ensure_ascii, default=default)
+
+_encoder = _dumps
+
+def set_encoder(dumps=None):
+    ''' Use another encoder, e.g. a faster one, None to go back to the json module
+    dumps:    Function taking a value and ensure_ascii and returning its JSON representation,
+              calling default() for the values it does not know about
+    '''
+    global _encoder
+    _encoder = dumps or _dumps
+
+def to_document(item, string_id=False):
+    ''' Return the dictionary to encode for a model object, or the item itself
+    string_id:    Whether to export the id of model objects as a string
+    '''
+    if not hasattr(item, "_serializable"):
+        return item
+    d = item.to_dict()
+    if string_id and d.has_key("id"):
+        d["id"] = str(d["id"])
+    return d
+
+def dumps(value, ensure_ascii=True, string_id=False):
+    ''' Return the JSON representation of a model object or any other value '''
+    return _encoder(to_document(value, string_id), ensure_ascii)
+
+def iter_json(items, ensure_ascii=True, string_id=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    ''' Return a generator of chunks of the JSON array of the given items
+    items:         Iterable of model objects or documents (list, cursor, ResultSet...)
+    chunk_size:    Approximate size of the chunks
+    '''
+    encoder = _encoder
+    parts = ["["]
+    size = 1
+    first = True
+    for item in items:
+        s = encoder(to_document(item, string_id), ensure_ascii)
+        if not first:
+            parts.append(", ")
+        parts.append(s)
+        first = False
+        size += len(s) + 2
+        if size >= chunk_size:
+            yield "".join(parts)
+            parts = list()
+            size = 0
+    parts.append("]")
+    yield "".join(parts)
+
+def dump(items, fp, ensure_ascii=True, string_id=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    ''' Write the JSON array of the given items to a file-like object, chunk by chunk '''
+    for chunk in iter_json(items, ensure_ascii, string_id, chunk_size):
+        fp.write(chunk.encode("utf-8") if type(chunk) is unicode else chunk)
@@ -0,0 +1,116 @@
+'''
+Created on Oct 17, 2026
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+DEFAULT_BATCH_SIZE = 100
+
+class ResultSet(object):
+    ''' Lazily hydrated results of a query
+
+    Documents are pulled from a server-side cursor and hydrated one at a time
+    as the set is iterated, so memory use does not depend on the number of results.
+    The count is only requested from the server when len() or count() is called.
+    '''
+
+    def __init__(self, query, cls, hydrate=True, prefetch=None, batch_size=None):
+        ''' Create a new result set
+        query:         Query to execute
+        cls:           Class to hydrate documents into
+        hydrate:       Whether to hydrate documents or return them as they are
+        prefetch:      Relations to prefetch for each batch of hydrated objects
+        batch_size:    Number of documents fetched per round trip
+        '''
+        if query.raw_mode:
+            # Raw documents are streamed as they are, see Query.raw
+            raise ValueError("Raw results cannot be lazy, iterate over the query instead")
+        self.query = query
+        self.cls = cls
+        self.hydrate = hydrate
+        self.prefetch = prefetch
+        if batch_size:
+            query.batch_size(batch_size)
+        self._count = None
+        self._start = 0                     # Window over the query results
+        self._stop = query.lim or None
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _get_cursor(self):
+        ''' Return a fresh cursor over the results, holding a pooled connection until exhausted '''
+        cursor = self.query._find()
+        if self._start or self._stop is not None:
+            cursor = cursor[self._start:self._stop]
+        return cursor
+
+    def _hydrate(self, doc):
+        ''' Turn a document into an object if needed '''
+        return self.cls._hydrate(doc, self.query.selected_fields) if self.hydrate else doc
+
+    def _iter_batches(self, cursor):
+        ''' Iterate over batches of hydrated objects so relations can be prefetched per batch '''
+        size = self.query.batch_n or DEFAULT_BATCH_SIZE
+        batch = list()
+        for doc in cursor:
+            batch.append(self._hydrate(doc))
+            if len(batch) >= size:
+                self.cls.prefetch_related(batch, *self.prefetch)
+                for obj in batch:
+                    yield obj
+                batch = list()
+        if batch:
+            self.cls.prefetch_related(batch, *self.prefetch)
+            for obj in batch:
+                yield obj
+
+
+    ##  PUBLIC METHODS  #######################
+
+    def __iter__(self):
+        cursor = self._get_cursor()
+        if self.hydrate and self.prefetch:
+            return self._iter_batches(cursor)
+        return (self._hydrate(doc) for doc in cursor)
+
+    def __len__(self):
+        return self.count()
+
+    def __nonzero__(self):
+        if self._count is not None:
+            return self._count > 0
+        for _ in self._get_cursor().limit(1):
+            return True
+        return False
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            if index.step is not None or (index.start or 0) < 0 or (index.stop is not None and index.stop < 0):
+                raise IndexError("Only positive slices without step are supported")
+            rs = ResultSet(self.query, self.cls, self.hydrate, self.prefetch)
+            rs._start = self._start + (index.start or 0)
+            rs._stop = self._start + index.stop if index.stop is not None else self._stop
+            if self._stop is not None and (rs._stop is None or rs._stop > self._stop):
+                rs._stop = self._stop
+            rs._start = min(rs._start, rs._stop) if rs._stop is not None else rs._start
+            return rs
+        if index < 0:
+            index += self.count()
+            if index < 0:
+                raise IndexError("Result index out of range")
+        if self._stop is not None and self._start + index >= self._stop:
+            raise IndexError("Result index out of range")
+        return self._hydrate(self._get_cursor()[index])
+
+    def count(self):
+        ''' Return the number of results, taking limits and slices into account '''
+        if self._count is None:
+            self._count = self._get_cursor().count(True)
+        return self._count
+
+    def to_list(self):
+        ''' Load all the results into a list '''
+        return list(self)
+
@@ -0,0 +1,249 @@
+'''
+Created on Oct 17, 2026
+
+Per-class serializers, compiled once from the field types declared
+by generated classes (see build_model.py) instead of probing every
+value of every object.
+
+@author: Benjamin Dezile
+'''
+
+CLASS_KEY = "_class"
+ID_ALIAS = "_id"
+
+# Field kinds
+SKIP = 0            # Private attribute, never exported
+PLAIN = 1           # Exported as is
+STRING = 2          # String, exported as unicode
+OBJECT = 3          # Embedded serializable object
+OBJECT_LIST = 4     # List of embedded serializable objects
+UNKNOWN = 5         # Undeclared type, probed value by value
+
+PLAIN_TYPES = ("int", "long", "float", "bool", "dict", "list")
+MUTABLE_TYPES = (list, dict)
+
+def copy_document(value):
+    ''' Return a copy of a document, sharing nothing mutable with it '''
+    t = type(value)
+    if t is dict:
+        return dict([(k, copy_document(v)) for k, v in value.iteritems()])
+    elif t is list:
+        return [copy_document(v) for v in value]
+    return value
+
+def _get_slots(cls):
+    ''' Return the (name, descriptor) of the public slots of a class and its bases '''
+    slots = list()
+    for c in cls.__mro__:
+        names = c.__dict__.get("__slots__", ())
+        if isinstance(names, basestring):
+            names = (names,)
+        for name in names:
+            if not name.startswith("_"):
+                slots.append((name, c.__dict__[name]))
+    return slots
+
+def _parse_type(type_name):
+    ''' Return the (kind, embedded class name) for a declared field type '''
+    if not type_name:
+        return UNKNOWN, None
+    sub_type = None
+    a = type_name.find("[")
+    if a > 0:
+        sub_type = type_name[a+1:type_name.find("]", a)]
+        type_name = type_name[:a]
+    if type_name == "str":
+        return STRING, None
+    if type_name == "list":
+        if sub_type and sub_type[0].isupper():
+            return OBJECT_LIST, sub_type
+        return PLAIN, None
+    if type_name in PLAIN_TYPES:
+        return PLAIN, None
+    return OBJECT, type_name
+
+
+class Serializer(object):
+    ''' Converts the instances of a given class to and from dictionaries '''
+
+    def __init__(self, cls, base_fields=None):
+        ''' Compile the serializer of a given class
+        cls:            Class to serialize
+        base_fields:    Fields inherited from the base classes, which hold plain values
+        '''
+        self.cls = cls
+        self.class_name = cls.__name__
+        self.export_class = cls._export_class_key
+        self.embedded = hasattr(cls, "_embedded")
+        self.track_changes = hasattr(cls, "_snapshot")
+        self.has_dict = cls.__dictoffset__ != 0     # Whether instances have a __dict__, or only slots
+        self.kinds = dict()             # Field name -> kind
+        self.class_names = dict()       # Field name -> embedded class name
+        self.fields = list()            # Declared fields, in order
+        for name in (base_fields or ()):
+            self.kinds[name] = PLAIN
+            self.fields.append(name)
+        field_types = cls._field_types or dict()
+        for name in (cls._fields or field_types.keys()):
+            kind, class_name = _parse_type(field_types.get(name))
+            self.kinds[name] = kind
+            self.fields.append(name)
+            if class_name:
+                self.class_names[name] = class_name
+        self.slots = [(name, self.kinds.get(name, UNKNOWN), descr) for name, descr in _get_slots(cls)]
+        self.descriptors = dict([(name, descr) for name, _, descr in self.slots])
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _get_kind(self, name):
+        ''' Return the kind of an attribute that was not declared '''
+        kind = SKIP if name.startswith("_") else UNKNOWN
+        self.kinds[name] = kind
+        return kind
+
+    def _export(self, kind, val):
+        ''' Export a field value of the given kind '''
+        if kind == PLAIN:
+            return val
+        elif kind == STRING:
+            return unicode(val) if type(val) is str else val
+        elif kind == OBJECT:
+            return val.to_dict() if hasattr(val, "_serializable") else val
+        elif kind == OBJECT_LIST:
+            return [item.to_dict() if hasattr(item, "_serializable") else item for item in val]
+        # Undeclared type
+        t = type(val)
+        if t in (list, tuple) and len(val) > 0 and hasattr(val[0], "_serializable"):
+            return [item.to_dict() for item in val]
+        elif hasattr(val, "_serializable"):
+            return val.to_dict()
+        elif t is str:
+            return unicode(val)
+        return val
+
+    def _import(self, kind, val, get_class):
+        ''' Import a field value of the given kind '''
+        t = type(val)
+        if kind == PLAIN or val is None:
+            return val
+        elif kind == STRING:
+            return unicode(val) if t is str else val
+        elif t is dict and (kind == OBJECT or val.has_key(CLASS_KEY)):
+            return get_class(val.get(CLASS_KEY)).from_dict(val)
+        elif t is list and len(val) > 0 and type(val[0]) is dict and (kind == OBJECT_LIST or val[0].has_key(CLASS_KEY)):
+            clazz = get_class(val[0].get(CLASS_KEY))
+            return [clazz.from_dict(item) for item in val]
+        elif t is str:
+            return unicode(val)
+        return val
+
+
+    ##  PUBLIC METHODS  #######################
+
+    def items(self, obj):
+        ''' Return the (name, value) pairs of the public attributes set on an instance '''
+        items = list()
+        for name, _, descr in self.slots:
+            try:
+                items.append((name, descr.__get__(obj)))
+            except AttributeError:
+                # Not set (e.g. not loaded)
+                pass
+        if self.has_dict:
+            items.extend([(k, v) for k, v in obj.__dict__.iteritems() if not k.startswith("_")])
+        return items
+
+    def has_value(self, obj, name):
+        ''' Return whether a given attribute is set on an instance '''
+        descr = self.descriptors.get(name)
+        if descr is not None:
+            try:
+                descr.__get__(obj)
+                return True
+            except AttributeError:
+                return False
+        return self.has_dict and obj.__dict__.has_key(name)
+
+    def to_dict(self, obj):
+        ''' Export an instance to a dictionary '''
+        values = dict()
+        if self.export_class:
+            values[CLASS_KEY] = self.class_name
+        for name, kind, descr in self.slots:
+            try:
+                val = descr.__get__(obj)
+            except AttributeError:
+                continue
+            if val is not None:
+                values[name] = self._export(kind, val)
+        if self.has_dict:
+            kinds = self.kinds
+            for k, val in obj.__dict__.iteritems():
+                kind = kinds.get(k)
+                if kind is None:
+                    kind = self._get_kind(k)
+                if kind != SKIP and val is not None:
+                    values[k] = self._export(kind, val)
+        return values
+
+    def from_dict(self, d, is_new, resolve_class):
+        ''' Create an instance from a dictionary
+        d:               Dictionary of properties
+        is_new:          Whether the instance is new (in which case the id is not copied)
+        resolve_class:   Function returning the class for a given name
+        '''
+        cls = self.cls
+        inst = cls() if self.embedded else cls(is_new)
+        attrs = inst.__dict__ if self.has_dict else None
+        descriptors = self.descriptors
+        kinds = self.kinds
+        class_names = self.class_names
+        dropped = None
+        for k, val in d.iteritems():
+            if k == ID_ALIAS or k == "id":
+                if not is_new:
+                    # Set the id only if not a new instance
+                    inst.id = int(val) if type(val) in (str, unicode) else val
+                continue
+            kind = kinds.get(k)
+            if kind is None:
+                kind = self._get_kind(k)
+            if kind == PLAIN:
+                v = val if type(val) not in MUTABLE_TYPES else copy_document(val)
+            elif kind != SKIP:
+                get_class = lambda name, k=k: resolve_class(name or class_names[k])
+                v = self._import(kind, val, get_class)
+                if v is val and type(val) in MUTABLE_TYPES:
+                    v = copy_document(val)
+            else:
+                # Private keys are never loaded, so they are never exported either
+                dropped = dropped or list()
+                dropped.append(k)
+                continue
+            descr = descriptors.get(k)
+            if descr is not None:
+                descr.__set__(inst, v)
+            elif attrs is not None:
+                attrs[k] = v
+            else:
+                # Undeclared field with nowhere to go
+                dropped = dropped or list()
+                dropped.append(k)
+        if self.track_changes and not is_new:
+            # The document is what changes are computed against (see change_tracking.py)
+            if dropped:
+                # Do not have them unset on the next update
+                d = dict([(k, v) for k, v in d.iteritems() if k not in dropped])
+            inst._snapshot = copy_document(d)
+        return inst
+
+
+def get_serializer(cls, base_fields=None):
+    ''' Return the serializer of a given class, compiling it on first use '''
+    serializer = cls.__dict__.get("_serializer")
+    if serializer is None:
+        serializer = Serializer(cls, base_fields)
+        cls._serializer = serializer
+    return serializer
+
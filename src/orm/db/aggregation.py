@@ -0,0 +1,176 @@
+'''
+Created on Oct 17, 2026
+
+Aggregation pipelines, built stage by stage from a query whose
+conditions, sort and limit become the first stages:
+
+    q = Query("shows").where_gte(created=t)
+    for doc in q.aggregate().group("city", n=("sum", 1), best=("max", "score")).sort("n").limit(10).execute():
+        ...
+
+Results are streamed from a server-side cursor. Aggregations made by
+model classes (see BaseObject.aggregate) hydrate the documents that
+still have the shape of the class, and leave the others as they are.
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from orm.db.query import QueryMonitor, OP_AGGREGATE, DESCENDING
+from bson.son import SON
+
+ACCUMULATORS = ("sum", "avg", "min", "max", "first", "last", "push", "addToSet")
+
+
+def field_ref(field):
+    ''' Return the expression referring to a given field '''
+    if isinstance(field, basestring) and not field.startswith("$"):
+        return "$" + field
+    return field
+
+def get_accumulator(value):
+    ''' Return the $group expression of an accumulator, given as an (operator, field) pair or as is '''
+    if type(value) is dict:
+        return value
+    op, field = value
+    op = op.lstrip("$")
+    if op not in ACCUMULATORS:
+        raise ValueError("Unknown accumulator: %s" % op)
+    return { "$" + op: field_ref(field) }
+
+
+class Aggregation(object):
+    ''' Aggregation pipeline on the collection of a query '''
+
+    def __init__(self, query, model_class=None):
+        ''' Create a new aggregation
+        query:          Query whose collection is aggregated, and whose conditions, sort and limit come first
+        model_class:    Class to hydrate results into, when they have its shape
+        '''
+        self.query = query
+        self.model_class = model_class
+        self.pipeline = list()
+        self.disk_use = False
+        self.batch_n = None
+        self.grouped = False
+        if query.conditions:
+            self.pipeline.append({ '$match': query.conditions })
+        if query.order_field:
+            self.sort(query.order_field, query.order_dir)
+        if query.lim:
+            self.limit(query.lim)
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _has_model_shape(self, doc):
+        ''' Return whether a result is a (possibly partial) document of the model class '''
+        if self.grouped or not doc.has_key("_id"):
+            return False
+        fields = self.model_class.get_field_names()
+        return all([k == "_id" or k in fields for k in doc])
+
+    def _hydrate(self, doc):
+        ''' Return the instance a result describes, or the result itself if it does not have the shape of one '''
+        if not self._has_model_shape(doc):
+            return doc
+        missing = [f for f in self.model_class.get_field_names() if f != "id" and not doc.has_key(f)]
+        return self.model_class._hydrate(doc, [k for k in doc if k != "_id"] if missing else None)
+
+
+    ##  PUBLIC METHODS  #########################
+
+    def match(self, query=None, **params):
+        ''' Keep the documents matching the conditions of a query (to use the where_* helpers) or the given ones '''
+        self.pipeline.append({ '$match': query.conditions if query is not None else params })
+        return self
+
+    def group(self, by=None, **accumulators):
+        ''' Group documents by the given field(s), None for a single group
+        accumulators:    Output field -> (operator, field) pair, e.g. total=("sum", "price") or n=("sum", 1)
+        '''
+        if type(by) in (list, tuple):
+            key = dict([(f.replace(".", "_"), field_ref(f)) for f in by])
+        else:
+            key = field_ref(by)
+        stage = { '_id': key }
+        for name, value in accumulators.iteritems():
+            stage[name] = get_accumulator(value)
+        self.pipeline.append({ '$group': stage })
+        self.grouped = True
+        return self
+
+    def project(self, *fields, **expressions):
+        ''' Reshape documents, keeping the given fields and computing the given ones
+        expressions:    Output field -> field name (prefixed with $) or expression
+        '''
+        stage = dict([(f, 1) for f in fields])
+        stage.update(expressions)
+        self.pipeline.append({ '$project': stage })
+        return self
+
+    def unwind(self, field, keep_empty=False):
+        ''' Output a document per item of a given array field
+        keep_empty:    Whether to keep documents whose array is missing or empty (as is)
+        '''
+        if keep_empty:
+            self.pipeline.append({ '$unwind': { 'path': field_ref(field), 'preserveNullAndEmptyArrays': True } })
+        else:
+            self.pipeline.append({ '$unwind': field_ref(field) })
+        return self
+
+    def sort(self, field, direction=None):
+        ''' Sort documents according to the given field and direction, or list of (field, direction) pairs '''
+        if type(field) in (list, tuple):
+            keys = field
+        else:
+            keys = [(field, direction if direction is not None else DESCENDING)]
+        self.pipeline.append({ '$sort': SON(keys) })
+        return self
+
+    def skip(self, n):
+        ''' Skip the first n documents '''
+        self.pipeline.append({ '$skip': n })
+        return self
+
+    def limit(self, n):
+        ''' Keep the first n documents '''
+        self.pipeline.append({ '$limit': n })
+        return self
+
+    def lookup(self, collection, local_field, foreign_field, as_field):
+        ''' Join the documents of another collection whose foreign field equals the local one, as an array
+        collection:    Collection name or model class
+        '''
+        if hasattr(collection, 'get_collection_name'):
+            collection = collection.get_collection_name()
+        self.pipeline.append({ '$lookup': { 'from': collection, 'localField': local_field,
+                                            'foreignField': foreign_field, 'as': as_field } })
+        return self
+
+    def allow_disk_use(self, is_enabled=True):
+        ''' Let stages that run out of memory write temporary files on the server '''
+        self.disk_use = is_enabled
+        return self
+
+    def batch_size(self, n):
+        ''' Specify the number of results fetched from the server per round trip '''
+        self.batch_n = n
+        return self
+
+    def get_pipeline(self):
+        ''' Return the pipeline as sent to the server '''
+        return list(self.pipeline)
+
+    def execute(self):
+        ''' Run this aggregation and return an iterator over its results '''
+        with QueryMonitor(self.query, "Aggregate %d stages from" % len(self.pipeline), OP_AGGREGATE):
+            col = self.query._get_collection(True)
+            options = { 'cursor': { 'batchSize': self.batch_n } if self.batch_n else dict() }
+            if self.disk_use:
+                options['allowDiskUse'] = True
+            options.update(self.query._get_read_options())
+            res = self.query._lease(col.aggregate(self.pipeline, **options))
+            if self.model_class is not None:
+                return (self._hydrate(doc) for doc in res)
+            return res
@@ -0,0 +1,234 @@
+'''
+Created on Oct 17, 2026
+
+Non-blocking query execution: blocking calls run on a pool of worker
+threads and return QueryFuture instances right away.
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from orm.db.query import Query
+from orm.db.query_cache import CachedResult
+from Queue import Queue
+import threading
+import sys
+import os
+
+DEFAULT_WORKERS = 8
+
+class QueryFuture(object):
+    ''' Result of an operation running in the background
+
+    Done callbacks run on the worker thread that completed the operation (or
+    right away on the calling thread if it already completed), so they must be
+    thread-safe. They also run outside of the identity map of the thread that
+    started the operation: bind it explicitly to resolve objects through it.
+    '''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = list()
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _finish(self, result=None, exc_info=None):
+        ''' Store the outcome of the operation and notify whoever is waiting for it '''
+        with self._cond:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = list()
+            self._cond.notifyAll()
+        for fn in callbacks:
+            self._run_callback(fn)
+
+    def _run_callback(self, fn):
+        ''' Call a done callback, ignoring its errors '''
+        try:
+            fn(self)
+        except Exception, e:
+            print "Future callback failed: %s" % e
+
+    def _wait(self, timeout):
+        ''' Wait for the operation to complete '''
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise RuntimeError("Operation did not complete within %s seconds" % timeout)
+
+
+    ##  PUBLIC METHODS  #######################
+
+    def done(self):
+        ''' Return whether the operation completed '''
+        return self._done
+
+    def result(self, timeout=None):
+        ''' Wait for the operation to complete and return its result, or raise its error '''
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        ''' Wait for the operation to complete and return its error, if any '''
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, fn):
+        ''' Call fn(future) once the operation completes, possibly from a worker thread '''
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        self._run_callback(fn)
+
+
+class QueryExecutor(object):
+    ''' Pool of worker threads running blocking operations '''
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self._queue = Queue()
+        self._threads = list()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _start(self):
+        ''' Start the worker threads if needed '''
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads do not survive a fork
+                self._pid = os.getpid()
+                self._queue = Queue()
+                self._threads = list()
+            if not self._threads:
+                for _ in range(self.workers):
+                    t = threading.Thread(target=self._work)
+                    t.daemon = True
+                    t.start()
+                    self._threads.append(t)
+
+    def _work(self):
+        ''' Run operations until told to stop '''
+        queue = self._queue
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            try:
+                future._finish(fn(*args, **kwargs))
+            except Exception:
+                future._finish(exc_info=sys.exc_info())
+
+    def submit(self, fn, *args, **kwargs):
+        ''' Run fn(*args, **kwargs) in the background and return a QueryFuture '''
+        self._start()
+        future = QueryFuture()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        ''' Stop the worker threads once the pending operations are done '''
+        with self._lock:
+            threads = self._threads
+            self._threads = list()
+            for _ in threads:
+                self._queue.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    ''' Return the shared executor '''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = QueryExecutor()
+    return _executor
+
+def set_executor(executor):
+    ''' Replace the shared executor (e.g. to change the number of workers) '''
+    global _executor
+    old = _executor
+    _executor = executor
+    if old is not None and old is not executor:
+        old.shutdown(False)
+
+def run_async(fn, *args, **kwargs):
+    ''' Run fn(*args, **kwargs) with the shared executor and return a QueryFuture '''
+    return get_executor().submit(fn, *args, **kwargs)
+
+
+class AsyncQuery(Query):
+    ''' Query whose execution methods return QueryFuture instances instead of blocking
+    A given query must not run more than one operation at a time.
+    '''
+
+    def _execute(self):
+        ''' Execute this query and load the results '''
+        res = Query.execute(self)
+        if self.insert_values or type(res) in (list, CachedResult):
+            return res
+        return CachedResult(res)
+
+    def _fetch_one(self):
+        ''' Return the first result of this query, if any '''
+        res = Query.execute(self)
+        for item in res:
+            return item
+        return None
+
+    def _each(self, callback):
+        ''' Call callback with each result, return the number of results '''
+        n = 0
+        for item in Query.execute(self):
+            callback(item)
+            n += 1
+        return n
+
+    def execute(self):
+        ''' Execute this query, the future resolves to the inserted id or the list of results '''
+        return run_async(self._execute)
+
+    def fetch_one(self):
+        ''' Execute a get query, the future resolves to the first result if any '''
+        return run_async(self._fetch_one)
+
+    def each(self, callback):
+        ''' Stream the results to callback as they arrive, the future resolves to the number of results '''
+        return run_async(self._each, callback)
+
+    def count(self):
+        ''' Execute a count query '''
+        return run_async(Query.count, self)
+
+    def update(self, **params):
+        ''' Execute an update with the given values '''
+        return run_async(Query.update, self, **params)
+
+    def update_all(self, **params):
+        ''' Execute an update with the given values on all the matching documents '''
+        return run_async(Query.update_all, self, **params)
+
+    def delete(self):
+        ''' Execute a delete query '''
+        return run_async(Query.delete, self)
+
+    def bulk(self, operations, ordered=True):
+        ''' Execute a list of write operations in a single round trip '''
+        return run_async(Query.bulk, self, operations, ordered)
+
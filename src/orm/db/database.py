@@ -1,53 +1,199 @@
 '''
 Created on Feb 22, 2012
 
+Databases are registered under an alias (see Database.get_instance), so
+that a process can use several of them at once, e.g. to keep some
+collections on a dedicated cluster or one database per tenant. Model
+classes live in the database registered under their _db_alias, the
+default one if they do not set it.
+
 @requires: pyMongo (pip install pymongo)
 @author: Benjamin Dezile
 '''
 
+from __future__ import with_statement
+
+from orm.db.pool import ConnectionPool, DEFAULT_MIN_SIZE, DEFAULT_MAX_SIZE, DEFAULT_IDLE_TIMEOUT
+from orm.db.query_cache import QueryCache, DEFAULT_MAX_ENTRIES, DEFAULT_TTL, DEFAULT_MAX_BYTES
+from orm.db.replica_set import ReplicaSet, ReadPreference, parse_hosts, DEFAULT_REFRESH_INTERVAL
+from orm.db.indexes import get_model_indexes, plan_indexes, REPLACE, SKIP
+from time import time
 import pymongo as Mongo
+import threading
 
 DEFAULT_PORT = 27017
 DEFAULT_HOST = "localhost"
+DEFAULT_ALIAS = "default"
+DEFAULT_INDEX_BUILDS = 4
 
 class DBInitError(Exception):
     ''' Raised when trying to use the DB wrapper without proper initialization '''
     pass
 
+class DatabaseAlias(object):
+    ''' Connection to a database, as registered under a given alias '''
+    
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.read_preference = config['read_preference']
+        self.connection = None
+        self.pool = None
+        self.replica_set = None
+        self.db = None
+    
+    def _new_connection(self, address=None):
+        ''' Open a new authenticated connection to the database server (or to a given replica set member) '''
+        host, port = address or (self.config['host'], self.config['port'])
+        conn = Database.connection_class(host, port)
+        db_user = self.config.get('user')
+        db_pwd = self.config.get('pwd')
+        if db_user and db_pwd:
+            conn[self.config['db_name']].authenticate(db_user, db_pwd)
+        return conn
+    
+    def _new_pool(self, address=None):
+        ''' Create a connection pool to the database server (or to a given replica set member) '''
+        return ConnectionPool(lambda: self._new_connection(address),
+                              self.config['min_pool_size'],
+                              self.config['max_pool_size'],
+                              self.config['pool_idle_timeout'])
+    
+    def _init_connection(self):
+        ''' Establish connection to the database server '''
+        if self.config['hosts']:
+            return self._init_replica_set()
+        host = self.config['host']
+        port = self.config['port']
+        self.connection = self._new_connection()
+        self.pool = self._new_pool()
+        self.pool.fill()
+        print "Connected to MongoDB @ %s:%s" % (host, port)
+        return self.connection
+    
+    def _init_replica_set(self):
+        ''' Discover the members of the replica set and connect to its primary '''
+        self.replica_set = ReplicaSet(self.config['hosts'], self._new_pool, self.config['replica_set'],
+                                      self.config['refresh_interval'])
+        primary = self.replica_set.select()
+        self.pool = primary.pool
+        self.pool.fill()
+        self.connection = self._new_connection(primary.address)
+        print "Connected to MongoDB replica set %s @ %s:%s" % (self.config['replica_set'] or "",
+                                                                primary.address[0], primary.address[1])
+        return self.connection
+    
+    def connect(self):
+        ''' Connect to the server and get a database object '''
+        db_name = self.config['db_name']
+        conn = self._init_connection()
+        self.db = conn[db_name]
+        print "Using database %s" % db_name
+        return self.db
+    
+    def get_pool(self, read_preference=None):
+        ''' Return the pool to borrow connections from, according to a read preference (None for writes) '''
+        if self.replica_set:
+            return self.replica_set.select(read_preference).pool
+        if not self.pool:
+            raise DBInitError()
+        return self.pool
+    
+    def close(self):
+        ''' Close all connections, borrowed ones when they are returned '''
+        if self.replica_set:
+            self.replica_set.close()
+        elif self.pool:
+            self.pool.close()
+        if self.connection:
+            self.connection.close()
+
 class Database:
     ''' MongoDB wrapper for database access '''
     
     query_logging = True
-    config = None
-    connection = None
-    db = None
+    query_cache = None
+    connection_class = Mongo.Connection
+    aliases = dict()
+    _lock = threading.Lock()
     
     @classmethod
-    def get_instance(cls, **params):
+    def get_instance(cls, alias=DEFAULT_ALIAS, **params):
         ''' Get a connection to a database instance 
-        Possible parameters:
+        Given parameters, (re)connect the database registered under the given
+        alias, leaving the others untouched. Possible parameters:
         host:      Server address
         port:      Server port
         model:     Data model config map
         db_name:   Database name
         user:      User name
         pwd:       Password
+        min_pool_size:       Number of pooled connections kept open
+        max_pool_size:       Maximum number of pooled connections
+        pool_idle_timeout:   Time (in seconds) after which an idle pooled connection is closed
+        hosts:               Replica set seed list ("host1:port1,host2:port2" or list of addresses)
+        replica_set:         Replica set name
+        read_preference:     Default read preference (mode name or ReadPreference)
+        refresh_interval:    Time (in seconds) between two checks of the replica set members
         '''
         if params:
             host = params.get('host', DEFAULT_HOST)
             port = params.get('port', DEFAULT_PORT)
-            db_name = params.get('db_name')
-            user = params.get('user', None)
-            pwd = params.get('pwd', None)
-            cls.config = { 'host': host, 'port': port }
-            if cls.connection:
-                # Close existing connection
-                cls.connection.close()
-            return cls._init_db(db_name, user, pwd)
-        elif cls.db:
-            return cls.db
-        else:
+            hosts = params.get('hosts', None)
+            config = { 'host': host, 'port': port,
+                       'db_name': params.get('db_name'),
+                       'user': params.get('user', None),
+                       'pwd': params.get('pwd', None),
+                       'hosts': parse_hosts(hosts, port) if hosts else None,
+                       'replica_set': params.get('replica_set', None),
+                       'read_preference': ReadPreference.get(params.get('read_preference', None)),
+                       'refresh_interval': params.get('refresh_interval', DEFAULT_REFRESH_INTERVAL),
+                       'min_pool_size': params.get('min_pool_size', DEFAULT_MIN_SIZE),
+                       'max_pool_size': params.get('max_pool_size', DEFAULT_MAX_SIZE),
+                       'pool_idle_timeout': params.get('pool_idle_timeout', DEFAULT_IDLE_TIMEOUT) }
+            entry = DatabaseAlias(alias, config)
+            db = entry.connect()
+            with cls._lock:
+                old = cls.aliases.get(alias)
+                cls.aliases = dict(cls.aliases, **{ alias: entry })
+            if old:
+                old.close()
+            return db
+        entry = cls.aliases.get(alias)
+        if entry:
+            return entry.db
+        elif alias == DEFAULT_ALIAS:
             raise DBInitError("Getting database instance with no parameters and no previous instance found")
+        else:
+            raise DBInitError("No database registered under %s" % alias)
+    
+    @classmethod
+    def remove_instance(cls, alias=DEFAULT_ALIAS):
+        ''' Close and unregister the database registered under a given alias '''
+        with cls._lock:
+            old = cls.aliases.get(alias)
+            cls.aliases = dict([(k, v) for k, v in cls.aliases.iteritems() if k != alias])
+        if old:
+            old.close()
+    
+    @classmethod
+    def reconnect(cls):
+        ''' Open new connections to all registered databases, e.g. in a forked process 
+        The connections of the parent process are left alone, as they are still in use there.
+        '''
+        with cls._lock:
+            entries = cls.aliases.values()
+        aliases = dict()
+        for entry in entries:
+            aliases[entry.name] = DatabaseAlias(entry.name, entry.config)
+            aliases[entry.name].connect()
+        with cls._lock:
+            cls.aliases = aliases
+    
+    @classmethod
+    def get_aliases(cls):
+        ''' Return the aliases databases are registered under '''
+        return cls.aliases.keys()
     
     @classmethod
     def enable_query_logging(cls, is_enabled=True):
@@ -55,83 +201,152 @@ class Database:
         cls.query_logging = is_enabled
     
     @classmethod
-    def _init_connection(cls):
-        ''' Establish connection to the database server '''
-        host = cls.config['host']
-        port = cls.config['port']
-        cls.connection = Mongo.Connection(host, port)
-        print "Connected to MongoDB @ %s:%s" % (host, port)
-        return cls.connection
+    def enable_query_cache(cls, is_enabled=True, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        ''' Enable or disable caching of query results 
+        max_entries:    Maximum number of cached results
+        ttl:            Time (in seconds) a result stays valid, None for no expiration
+        max_bytes:      Maximum estimated size of all cached results
+        '''
+        if is_enabled:
+            cls.query_cache = QueryCache(max_entries, ttl, max_bytes)
+        else:
+            cls.query_cache = None
     
-    @classmethod    
-    def _init_db(cls, db_name, db_user, db_pwd):
-        ''' Connect to the server and get a database object '''
-        conn = cls._init_connection()
-        cls.db = conn[db_name]
-        if db_user and db_pwd:
-            cls.db.authenticate(db_user, db_pwd)
-        print "Using database %s" % db_name
-        return cls.db
+    @classmethod
+    def _get_alias(cls, alias=None):
+        ''' Return the database registered under a given alias (None for the default one) '''
+        entry = cls.aliases.get(alias or DEFAULT_ALIAS)
+        if entry is None:
+            raise DBInitError("No database registered under %s" % (alias or DEFAULT_ALIAS))
+        return entry
     
     @classmethod
-    def _get_db(cls):
+    def _get_db(cls, alias=None):
         ''' Return the current database object '''
-        if not cls.db:
-            raise DBInitError()
-        return cls.db
+        return cls._get_alias(alias).db
     
     @classmethod
-    def _get_connection(cls):
+    def _get_connection(cls, alias=None):
         ''' Return the current connection object '''
-        if not cls.connection:
-            raise DBInitError()
-        return cls.connection
+        return cls._get_alias(alias).connection
+    
+    @classmethod
+    def _get_read_preference(cls, alias=None):
+        ''' Return the default read preference of a database '''
+        return cls._get_alias(alias).read_preference
     
     @classmethod
-    def _get_collection(cls, name):
+    def _get_pool(cls, read_preference=None, alias=None):
+        ''' Return the pool to borrow connections from, according to a read preference (None for writes) '''
+        return cls._get_alias(alias).get_pool(read_preference)
+    
+    @classmethod
+    def _acquire_connection(cls, read_preference=None, alias=None):
+        ''' Borrow a connection from the pool '''
+        return cls._get_pool(read_preference, alias).acquire()
+    
+    @classmethod
+    def _release_connection(cls, conn, pool=None, alias=None):
+        ''' Return a borrowed connection to the pool it came from '''
+        pool = pool or cls._get_alias(alias).pool
+        pool.release(conn)
+    
+    @classmethod
+    def _discard_connection(cls, conn, pool=None, alias=None):
+        ''' Close a borrowed connection that should not be reused '''
+        entry = cls._get_alias(alias)
+        (pool or entry.pool).discard(conn)
+        if entry.replica_set:
+            # The member may be down, or not the primary any more
+            entry.replica_set.request_refresh()
+    
+    @classmethod
+    def _get_db_name(cls, alias=None):
+        ''' Return the name of the current database '''
+        return cls._get_alias(alias).config['db_name']
+    
+    @classmethod
+    def _get_collection(cls, name, alias=None):
         ''' Return the collection for the given name '''
-        db = cls._get_db()
+        db = cls._get_db(alias)
         return db[name]
-        
+    
+    @classmethod
+    def _build_collection_indexes(cls, actions, background, report):
+        ''' Build the indexes of a single collection, one after the other '''
+        col = cls._get_collection(actions[0].spec.collection, actions[0].spec.alias)
+        for action in actions:
+            start = time()
+            if action.action == REPLACE:
+                col.drop_index(action.existing)
+            col.create_index(action.spec.keys, **action.spec.get_options(background))
+            report(action, time() - start)
+    
     @classmethod
-    def build_indexes(cls, model_config):
-        ''' Build indexes '''
+    def build_indexes(cls, model_config, background=True, dry_run=False, parallel=DEFAULT_INDEX_BUILDS, progress=None):
+        ''' Build the indexes that do not exist yet (see orm.db.indexes for the model config syntax) 
+        background:    Whether to build indexes without blocking the collections (slower)
+        dry_run:       Only print what would be done
+        parallel:      Number of collections indexed at the same time
+        progress:      Function called with (n_done, n_total, action, duration) after each build, prints by default
+        Return the list of IndexAction planned
+        '''
+        from orm.db.async_query import QueryExecutor
         print "Building indexes"
         
-        for class_name in model_config.keys():
-            
-            fields = model_config[class_name]["fields"]
-            for field_name in fields.keys():
-                
-                index = fields[field_name].get("index", None)
-                if index:
-                    
-                    col = cls._get_collection(class_name)
-                    index_type = Mongo.ASCENDING
-                    if index == -1:
-                        index_type = Mongo.DESCENDING
-                    elif index == "2d":
-                        index_type = Mongo.GEO2D
-                    
-                    col.ensure_index([(field_name, index_type)])
-                    print "Ensured index %s for %s.%s" % (index_type, class_name, field_name)
+        plan = plan_indexes(get_model_indexes(model_config), 
+                            lambda alias, name: cls._get_collection(name, alias).index_information())
+        todo = [action for action in plan if action.action != SKIP]
+        print "%d indexes to build, %d up to date%s" % (len(todo), len(plan) - len(todo), " (dry run)" if dry_run else "")
+        for action in plan:
+            print "  %s" % action
+        if dry_run or not todo:
+            return plan
+        
+        # Collections are indexed in parallel, indexes of a given collection in sequence
+        groups = dict()
+        for action in todo:
+            groups.setdefault((action.spec.alias, action.spec.collection), list()).append(action)
+        lock = threading.Lock()
+        done = [0]
+        def report(action, duration):
+            with lock:
+                done[0] += 1
+                n = done[0]
+            if progress:
+                progress(n, len(todo), action, duration)
+            else:
+                print "[%d/%d] %s in %.2f s" % (n, len(todo), action, duration)
         
+        executor = QueryExecutor(min(parallel, len(groups)))
+        try:
+            futures = [executor.submit(cls._build_collection_indexes, groups[k], background, report) for k in sorted(groups.keys())]
+            errors = [f.exception() for f in futures]
+        finally:
+            executor.shutdown(False)
+        for e in errors:
+            if e is not None:
+                raise e
+        return plan
+    
     @classmethod
-    def info(cls):
+    def info(cls, alias=None):
         ''' Return database info '''
-        return cls._get_connection().server_info()    
-        
+        return cls._get_connection(alias).server_info()
+    
     @classmethod
-    def stats(cls):
+    def stats(cls, alias=None):
         ''' Return database stats '''
-        db = cls._get_db()
+        db = cls._get_db(alias)
         return db.eval("db.stats()")
-        
+    
     @classmethod
-    def drop(cls):
+    def drop(cls, alias=None):
         ''' Drop the entire database '''
-        db = cls._get_db()
+        db = cls._get_db(alias)
         db_name = db.name
-        cls._get_connection().drop_database(db_name)
+        cls._get_connection(alias).drop_database(db_name)
+        if cls.query_cache is not None:
+            cls.query_cache.clear()
         print "Dropped database %s" % db_name
         
@@ -0,0 +1,258 @@
+'''
+Created on Oct 17, 2026
+
+Index advisor: records the shape of the queries sent to the server
+(filtered fields, sort and projection), explains the most expensive
+ones and suggests the compound indexes they need, in model config
+syntax (see orm.db.indexes) so that build_indexes can apply them.
+
+    advisor = instrumentation.add_listener(IndexAdvisor())
+    ...
+    print advisor.report(model_config)
+
+Suggested keys follow the equality, sort, range rule: fields matched
+exactly first, then the sort field, then fields matched by range.
+
+@author: Benjamin Dezile
+'''
+
+from __future__ import with_statement
+
+from orm.db.instrumentation import QueryListener
+from orm.db.indexes import IndexSpec, get_class_names, format_key, ASCENDING, DESCENDING
+from orm.db.database import Database
+from orm.db.query import Query, OP_FIND, OP_COUNT, OP_UPDATE, OP_DELETE
+import threading
+
+DEFAULT_MAX_SHAPES = 1000
+DEFAULT_TOP = 20
+
+# Operators that can be served by walking a single index entry
+EQUALITY_OPS = ("$in", "$all")
+
+# Operations whose conditions are worth indexing
+INDEXED_OPS = (OP_FIND, OP_COUNT, OP_UPDATE, OP_DELETE)
+
+
+def get_filter_fields(conditions):
+    ''' Return the fields matched exactly and the fields matched by range in a query, sorted '''
+    equality = set()
+    ranges = set()
+    for k, v in (conditions or dict()).iteritems():
+        if k == "$and":
+            for c in v:
+                e, r = get_filter_fields(c)
+                equality.update(e)
+                ranges.update(r)
+        elif k.startswith("$"):
+            # $or and $nor clauses are served by one index each, not suggested here
+            continue
+        elif type(v) is dict and v and all([str(op).startswith("$") for op in v]):
+            if all([op in EQUALITY_OPS for op in v]):
+                equality.add(k)
+            else:
+                ranges.add(k)
+        else:
+            equality.add(k)
+    return sorted(equality), sorted(ranges - equality)
+
+def _has_stage(plan, is_stage):
+    ''' Return whether an explain() plan, or any of its stages, satisfies a given test '''
+    if type(plan) is list:
+        return any([_has_stage(p, is_stage) for p in plan])
+    if type(plan) is not dict:
+        return False
+    if plan.has_key('queryPlanner'):
+        return _has_stage(plan['queryPlanner'].get('winningPlan'), is_stage)
+    if is_stage(plan):
+        return True
+    for k in ('inputStage', 'inputStages', 'clauses', 'shards'):
+        if plan.has_key(k) and _has_stage(plan[k], is_stage):
+            return True
+    return False
+
+def is_collection_scan(plan):
+    ''' Return whether an explain() plan scans the whole collection '''
+    return _has_stage(plan, lambda p: p.get('stage') == 'COLLSCAN' or str(p.get('cursor', '')).startswith('BasicCursor'))
+
+def is_in_memory_sort(plan):
+    ''' Return whether an explain() plan sorts the results in memory instead of reading them in order from an index '''
+    return _has_stage(plan, lambda p: p.get('stage') == 'SORT' or p.get('scanAndOrder') is True)
+
+def get_scan_counts(plan):
+    ''' Return the number of documents examined and returned according to an explain() plan, if known '''
+    if type(plan) is not dict:
+        return None, None
+    stats = plan.get('executionStats')
+    if stats is not None:
+        return stats.get('totalDocsExamined'), stats.get('nReturned')
+    return plan.get('nscannedObjects', plan.get('nscanned')), plan.get('n')
+
+
+class QueryShapeStats(object):
+    ''' Queries of a given shape, as recorded by the advisor '''
+
+    def __init__(self, alias, collection, equality, ranges, sort, fields):
+        self.alias = alias
+        self.collection = collection
+        self.equality = equality            # Fields matched exactly
+        self.ranges = ranges                # Fields matched by range
+        self.sort = sort                    # (field, direction) or None
+        self.fields = fields                # Selected fields, None for all
+        self.count = 0
+        self.total_ms = 0.0
+        self.shape = None
+        self.conditions = None              # Conditions of the last query, to explain
+
+    def get_index_keys(self):
+        ''' Return the keys of the index these queries need, None if they need none '''
+        if "_id" in self.equality:
+            # Served by the primary key
+            return None
+        keys = [(f, ASCENDING) for f in self.equality]
+        if self.sort is not None and self.sort[0] not in self.equality:
+            keys.append(self.sort)
+        keys += [(f, ASCENDING) for f in self.ranges if self.sort is None or f != self.sort[0]]
+        return keys or None
+
+    def __repr__(self):
+        return "<QueryShapeStats %s %s%s x%d>" % (self.collection, self.shape,
+                                                 " sort %s" % format_key(*self.sort) if self.sort else "", self.count)
+
+
+class IndexSuggestion(object):
+    ''' Index suggested for a query shape '''
+
+    def __init__(self, shape, index, covered, collection_scan, plan, in_memory_sort=None):
+        self.shape = shape                      # QueryShapeStats the index is suggested for
+        self.index = index                      # Suggested IndexSpec
+        self.covered = covered                  # Whether an existing index already serves the queries
+        self.collection_scan = collection_scan  # Whether the queries scan the whole collection (None if not explained)
+        self.plan = plan
+        self.in_memory_sort = in_memory_sort    # Whether the queries are sorted in memory (None if not explained)
+
+    def is_needed(self):
+        ''' Return whether this index should be created '''
+        return not self.covered or self.collection_scan is True or self.in_memory_sort is True
+
+    def __repr__(self):
+        return "<IndexSuggestion %r%s%s%s>" % (self.index, " covered" if self.covered else "",
+                                               " collection scan" if self.collection_scan else "",
+                                               " in-memory sort" if self.in_memory_sort else "")
+
+
+class IndexAdvisor(QueryListener):
+    ''' Records the shapes of queries to suggest the indexes they need '''
+
+    def __init__(self, max_shapes=DEFAULT_MAX_SHAPES):
+        ''' Create a new advisor
+        max_shapes:    Maximum number of query shapes recorded
+        '''
+        self.max_shapes = max_shapes
+        self.lock = threading.Lock()
+        self.shapes = dict()
+
+    def succeeded(self, event):
+        if event.op not in INDEXED_OPS or event.distinct:
+            return
+        equality, ranges = get_filter_fields(event.conditions)
+        sort = None
+        if event.sort:
+            sort = (event.sort, event.sort_dir if event.sort_dir is not None else DESCENDING)
+        fields = tuple(sorted(event.fields)) if event.fields else None
+        key = (event.alias, event.collection, tuple(equality), tuple(ranges), sort, fields)
+        with self.lock:
+            stats = self.shapes.get(key)
+            if stats is None:
+                if len(self.shapes) >= self.max_shapes:
+                    return
+                stats = QueryShapeStats(event.alias, event.collection, equality, ranges, sort, fields)
+                self.shapes[key] = stats
+            stats.count += 1
+            stats.total_ms += event.duration_ms
+            stats.conditions = event.conditions
+        if stats.shape is None:
+            stats.shape = event.shape
+
+    def get_shapes(self):
+        ''' Return the recorded query shapes, most expensive in total first 
+        Finds are timed until their results are fetched (all of them when materialized, 
+        the first batch when streamed from a cursor), see instrumentation.
+        '''
+        with self.lock:
+            shapes = self.shapes.values()
+        return sorted(shapes, key=lambda s: (s.total_ms, s.count), reverse=True)
+
+    def _explain(self, shape):
+        ''' Return the explain() plan of the last query of a given shape '''
+        q = Query(shape.collection, alias=shape.alias)
+        q.conditions = shape.conditions
+        if shape.sort:
+            q.sort(*shape.sort)
+        return q._explain()
+
+    def _get_existing_keys(self, shape):
+        ''' Return the keys of the indexes of the collection of a given shape '''
+        col = Database._get_collection(shape.collection, shape.alias)
+        return [info['key'] for info in col.index_information().itervalues()]
+
+    def analyze(self, top=DEFAULT_TOP, explain=True):
+        ''' Return index suggestions for the most expensive query shapes
+        top:        Number of query shapes to look at
+        explain:    Whether to explain the queries, to flag collection scans
+        '''
+        suggestions = list()
+        for shape in self.get_shapes()[:top]:
+            keys = shape.get_index_keys()
+            if keys is None:
+                continue
+            index = IndexSpec(shape.collection, keys, alias=shape.alias)
+            covered = any([index.is_prefix_of(k) for k in self._get_existing_keys(shape)])
+            plan = None
+            collection_scan = None
+            in_memory_sort = None
+            if explain and shape.conditions is not None:
+                try:
+                    plan = self._explain(shape)
+                    collection_scan = is_collection_scan(plan)
+                    in_memory_sort = is_in_memory_sort(plan) if shape.sort else False
+                except Exception, e:
+                    plan = { 'error': str(e) }
+            suggestions.append(IndexSuggestion(shape, index, covered, collection_scan, plan, in_memory_sort))
+        return suggestions
+
+    def report(self, model_config=None, top=DEFAULT_TOP, explain=True):
+        ''' Return the indexes to create, in model config syntax
+        model_config:    Model config, to name classes stored in a collection of their own
+        '''
+        class_names = get_class_names(model_config) if model_config else dict()
+        by_class = dict()
+        for s in self.analyze(top, explain):
+            if s.is_needed():
+                class_name = class_names.get(s.index.collection, s.index.collection)
+                indexes = by_class.setdefault(class_name, list())
+                if s.index not in [i.index for i in indexes]:
+                    indexes.append(s)
+        lines = list()
+        for class_name in sorted(by_class.keys()):
+            lines.append("%s:" % class_name)
+            lines.append("    indexes:")
+            for s in by_class[class_name]:
+                shape = s.shape
+                notes = ["%d queries" % shape.count, "%.2f ms avg" % (shape.total_ms / shape.count)]
+                if s.collection_scan:
+                    notes.append("collection scan")
+                    examined, returned = get_scan_counts(s.plan)
+                    if examined is not None:
+                        notes.append("%s examined for %s returned" % (examined, returned))
+                if s.in_memory_sort:
+                    notes.append("in-memory sort")
+                lines.append("        # %s%s: %s" % (shape.shape, " sort %s" % format_key(*shape.sort) if shape.sort else "",
+                                                    ", ".join(notes)))
+                lines.append("        - fields: [%s]" % ", ".join([str(format_key(f, d)) for f, d in s.index.keys]))
+        return "\n".join(lines)
+
+    def reset(self):
+        ''' Forget all recorded query shapes '''
+        with self.lock:
+            self.shapes.clear()
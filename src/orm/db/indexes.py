@@ -0,0 +1,233 @@
+'''
+Created on Oct 17, 2026
+
+Index specifications, as declared in the model config. Single field
+indexes are set on the fields themselves, compound ones (and those
+with options) are listed under "indexes":
+
+    Venue:
+        fields:
+            name: { type: str, required: true, index: 1 }
+        indexes:
+            - fields: [city, -created]      # "-" for descending, { loc: 2d } for geo
+              unique: true
+              sparse: true
+            - fields: [expires]
+              ttl: 3600                     # Remove documents 1h after their expires date
+
+Indexes are built by comparing them with those of the collections
+(see plan_indexes): identical indexes are skipped, and indexes whose
+keys or options changed are dropped and built again.
+
+@author: Benjamin Dezile
+'''
+
+ASCENDING = 1
+DESCENDING = -1
+GEO2D = "2d"
+
+OPTIONS = ("unique", "sparse", "ttl", "name")
+
+CREATE = "create"
+REPLACE = "replace"
+SKIP = "skip"
+
+
+class IndexSpec(object):
+    ''' Index of a collection '''
+
+    def __init__(self, collection, keys, unique=False, sparse=False, ttl=None, name=None, alias=None):
+        ''' Create a new index specification
+        collection:    Name of the collection to index
+        keys:          List of (field, direction) pairs
+        unique:        Whether to reject documents with the same values
+        sparse:        Whether to leave documents without the fields out
+        ttl:           Time (in seconds) after which documents expire, based on the date in the (single) field
+        name:          Index name, generated from the keys if not set
+        alias:         Alias of the database the collection is in
+        '''
+        if not keys:
+            raise ValueError("Index on %s has no fields" % collection)
+        if ttl is not None and len(keys) > 1:
+            raise ValueError("TTL index on %s should have a single field" % collection)
+        self.collection = collection
+        self.keys = [(str(f), d) for f, d in keys]
+        self.unique = unique
+        self.sparse = sparse
+        self.ttl = ttl
+        self.name = name
+        self.alias = alias
+
+    def get_name(self):
+        ''' Return the name of this index '''
+        return self.name or "_".join(["%s_%s" % (f, d) for f, d in self.keys])
+
+    def get_options(self, background=False):
+        ''' Return the options of this index, as given to ensure_index 
+        background:    Whether to build the index without blocking the collection
+        '''
+        options = { 'name': self.get_name() }
+        if self.unique:
+            options['unique'] = True
+        if self.sparse:
+            options['sparse'] = True
+        if self.ttl is not None:
+            options['expireAfterSeconds'] = self.ttl
+        if background:
+            options['background'] = True
+        return options
+
+    def matches(self, info):
+        ''' Return whether an existing index (as described by index_information) is identical to this one '''
+        return [(f, d) for f, d in info['key']] == self.keys and \
+               bool(info.get('unique')) == self.unique and \
+               bool(info.get('sparse')) == self.sparse and \
+               info.get('expireAfterSeconds') == self.ttl
+
+    def is_prefix_of(self, keys):
+        ''' Return whether an index on the given keys can serve the queries this one serves '''
+        n = len(self.keys)
+        if len(keys) < n:
+            return False
+        keys = [(f, d) for f, d in keys[:n]]
+        if keys == self.keys:
+            return True
+        # Indexes can be walked backward
+        return all([type(d) is int for f, d in self.keys]) and \
+               keys == [(f, -d) for f, d in self.keys]
+
+    def to_config(self):
+        ''' Return this index in model config syntax '''
+        config = { 'fields': [format_key(f, d) for f, d in self.keys] }
+        if self.unique:
+            config['unique'] = True
+        if self.sparse:
+            config['sparse'] = True
+        if self.ttl is not None:
+            config['ttl'] = self.ttl
+        if self.name:
+            config['name'] = self.name
+        return config
+
+    def __eq__(self, other):
+        return isinstance(other, IndexSpec) and \
+               (self.alias, self.collection, self.keys, self.get_options()) == \
+               (other.alias, other.collection, other.keys, other.get_options())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "<IndexSpec %s %s>" % (self.collection, ", ".join([format_key(f, d) for f, d in self.keys]))
+
+
+def parse_key(item):
+    ''' Return the (field, direction) pair of a key in model config syntax ("field", "-field" or { field: direction }) '''
+    if type(item) is dict:
+        if len(item) != 1:
+            raise ValueError("Invalid index key: %s" % item)
+        field, direction = item.items()[0]
+    elif type(item) in (list, tuple):
+        field, direction = item
+    elif item.startswith("-"):
+        field, direction = item[1:], DESCENDING
+    else:
+        field, direction = item, ASCENDING
+    if direction not in (ASCENDING, DESCENDING, GEO2D):
+        raise ValueError("Invalid index direction for %s: %s" % (field, direction))
+    return (field.strip(), direction)
+
+def format_key(field, direction):
+    ''' Return a key in model config syntax '''
+    if direction == ASCENDING:
+        return field
+    elif direction == DESCENDING:
+        return "-" + field
+    return { field: direction }
+
+def parse_index(collection, spec, alias=None):
+    ''' Return the index described by an entry of the "indexes" list of a class '''
+    fields = spec.get("fields")
+    if isinstance(fields, basestring):
+        fields = fields.split(",")
+    unknown = [k for k in spec if k != "fields" and k not in OPTIONS]
+    if unknown:
+        raise ValueError("Unknown index options on %s: %s" % (collection, ", ".join(unknown)))
+    return IndexSpec(collection, [parse_key(f) for f in fields or list()],
+                     spec.get("unique", False), spec.get("sparse", False),
+                     spec.get("ttl"), spec.get("name"), alias)
+
+
+class IndexAction(object):
+    ''' What to do to get an index built '''
+
+    def __init__(self, spec, action, existing=None):
+        self.spec = spec
+        self.action = action            # CREATE, REPLACE or SKIP
+        self.existing = existing        # Name of the index to drop first, or of the identical index
+
+    def __repr__(self):
+        desc = "%s index %s on %s" % (self.action.capitalize(), self.spec.get_name(), self.spec.collection)
+        if self.action == REPLACE:
+            desc += " (replacing %s)" % self.existing
+        elif self.action == SKIP:
+            desc += " (exists as %s)" % self.existing
+        return desc
+
+
+def plan_indexes(specs, get_index_information):
+    ''' Return what to do to build the given indexes, as a list of IndexAction 
+    get_index_information:    Function returning the index_information() of a collection given its alias and name
+    '''
+    existing = dict()
+    plan = list()
+    for spec in specs:
+        key = (spec.alias, spec.collection)
+        if not existing.has_key(key):
+            existing[key] = get_index_information(spec.alias, spec.collection)
+        indexes = existing[key]
+        name = spec.get_name()
+        same = [n for n, info in sorted(indexes.items()) if spec.matches(info)]
+        same_keys = [n for n, info in sorted(indexes.items()) if [(f, d) for f, d in info['key']] == spec.keys]
+        if same:
+            plan.append(IndexAction(spec, SKIP, same[0]))
+            continue
+        if same_keys:
+            # Options changed (indexes on the same keys cannot coexist)
+            plan.append(IndexAction(spec, REPLACE, same_keys[0]))
+            del indexes[same_keys[0]]
+        elif indexes.has_key(name):
+            # Same name, different keys
+            plan.append(IndexAction(spec, REPLACE, name))
+        else:
+            plan.append(IndexAction(spec, CREATE))
+        indexes[name] = { 'key': spec.keys, 'unique': spec.unique, 'sparse': spec.sparse }
+        if spec.ttl is not None:
+            indexes[name]['expireAfterSeconds'] = spec.ttl
+    return plan
+
+def get_model_indexes(model_config):
+    ''' Return the indexes declared in a model config, single field ones first '''
+    indexes = list()
+    for class_name in sorted(model_config.keys()):
+        class_info = model_config[class_name]
+        if class_info.get("as", dict()).has_key("embedded"):
+            continue
+        col_name = class_info.get("collection", class_name)
+        alias = class_info.get("db_alias")
+        fields = class_info.get("fields", dict())
+        for field_name in sorted(fields.keys()):
+            index = fields[field_name].get("index", None)
+            if index:
+                direction = DESCENDING if index == -1 else GEO2D if index == GEO2D else ASCENDING
+                indexes.append(IndexSpec(col_name, [(field_name, direction)], alias=alias))
+        for spec in class_info.get("indexes", list()):
+            indexes.append(parse_index(col_name, spec, alias))
+    return indexes
+
+def get_class_names(model_config):
+    ''' Return the class name of each collection of a model config '''
+    names = dict()
+    for class_name, class_info in model_config.iteritems():
+        names[class_info.get("collection", class_name)] = class_name
+    return names
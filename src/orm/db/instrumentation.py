@@ -0,0 +1,321 @@
+'''
+Created on Oct 17, 2026
+
+Query instrumentation: listeners notified when queries start, succeed
+or fail, and an in-process aggregator of per query shape statistics.
+
+Queries are sampled (see set_sample_rate) to keep the overhead low in
+production. Queries slower than the threshold set by set_slow_query_threshold
+are always reported, along with their explain() plan. Finds returning a
+cursor are timed until their first batch of results arrives.
+
+@author: Benjamin Dezile
+'''
+
+from __future__ import with_statement
+
+from orm.db.database import Database
+from orm.db.query_cache import estimate_size
+from collections import deque
+from random import random
+from time import time
+import threading
+import sys
+import os
+
+DEFAULT_MAX_SAMPLES = 1000
+DEFAULT_MAX_SLOW_QUERIES = 100
+
+# Frames from these directories are skipped when looking for the caller of a query
+INTERNAL_DIRS = tuple([os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), d) + os.sep
+                       for d in ("db", "core")])
+
+_listeners = list()
+_sample_rate = 1.0
+_slow_query_ms = None
+_explain_slow_queries = True
+
+
+def query_shape(conditions):
+    ''' Return the shape of a query: its conditions with the values left out '''
+    if type(conditions) is dict:
+        items = list()
+        for k in sorted(conditions.keys()):
+            v = conditions[k]
+            if k in ("$and", "$or", "$nor") and type(v) is list:
+                items.append("%s: [%s]" % (k, ", ".join([query_shape(c) for c in v])))
+            elif type(v) is dict and v and str(v.keys()[0]).startswith("$"):
+                items.append("%s: %s" % (k, query_shape(v)))
+            else:
+                items.append("%s: ?" % k)
+        return "{%s}" % ", ".join(items)
+    return "?"
+
+def _get_caller():
+    ''' Return the location of the code that issued the current query '''
+    f = sys._getframe(2)
+    while f is not None:
+        filename = f.f_code.co_filename
+        if not os.path.abspath(filename).startswith(INTERNAL_DIRS):
+            return "%s:%d in %s" % (filename, f.f_lineno, f.f_code.co_name)
+        f = f.f_back
+    return None
+
+def _percentile(sorted_values, p):
+    ''' Return the p-th percentile of a sorted list of values '''
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(sorted_values) - 1)
+    return sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f)
+
+
+class QueryEvent(object):
+    ''' Describes a query, passed to listeners '''
+
+    def __init__(self, op, query_inst, name, sampled):
+        self.op = op                                # Operation (find, count, insert, update, delete, bulk, aggregate)
+        self.name = name                            # Human readable description
+        self.alias = query_inst.alias               # Alias of the database, None for the default one
+        self.collection = query_inst.col_name
+        self.conditions = query_inst.conditions
+        self.fields = query_inst.selected_fields
+        self.distinct = query_inst.distinct_field
+        self.sort = query_inst.order_field
+        self.sort_dir = query_inst.order_dir
+        self.limit = query_inst.lim
+        self.sampled = sampled                      # False for slow queries reported outside of the sample
+        self.caller = _get_caller() if sampled else None
+        self.start_time = time()
+        self.duration_ms = None
+        self.n_docs = None                          # Number of documents returned or written, if known
+        self.n_bytes = None                         # Estimated size of the documents, if known
+        self.error = None
+        self.slow = False
+        self.plan = None                            # explain() plan of slow queries
+        self._shape = None
+
+    def get_shape(self):
+        ''' Return the shape of this query '''
+        if self._shape is None:
+            self._shape = query_shape(self.conditions)
+        return self._shape
+
+    shape = property(get_shape)
+
+    def get_key(self):
+        ''' Return the key under which this query is aggregated '''
+        return (self.op, self.collection, self.shape)
+
+    def __repr__(self):
+        return "<QueryEvent %s %s %s %s>" % (self.op, self.collection, self.shape,
+                                             "%.2f ms" % self.duration_ms if self.duration_ms is not None else "")
+
+
+class QueryListener(object):
+    ''' Base class for query listeners '''
+
+    def is_active(self):
+        ''' Whether this listener currently wants to be notified '''
+        return True
+
+    def started(self, event):
+        ''' Called before a sampled query runs '''
+        pass
+
+    def succeeded(self, event):
+        ''' Called after a sampled or slow query completed '''
+        pass
+
+    def failed(self, event):
+        ''' Called after a sampled or slow query raised an error '''
+        pass
+
+
+class QueryLogger(QueryListener):
+    ''' Prints queries to stdout when query logging is enabled (see Database.enable_query_logging) '''
+
+    def is_active(self):
+        return Database.query_logging is True
+
+    def succeeded(self, event):
+        extra = list()
+        if event.distinct:
+            extra.append("distinct %s" % event.distinct)
+        if event.sort:
+            extra.append("sort by %s" % event.sort)
+        if event.limit:
+            extra.append("lim=%d" % event.limit)
+        print "Query: %s %s%s in %.2f ms" % (event.name, "(%s) " % ", ".join(extra) if extra else "", event.collection, event.duration_ms)
+        if event.slow:
+            print "Slow query: %s %s from %s" % (event.shape, event.plan, event.caller)
+
+    failed = succeeded
+
+
+class QueryStats(QueryListener):
+    ''' Aggregates sampled queries per shape into latency histograms '''
+
+    def __init__(self, max_samples=DEFAULT_MAX_SAMPLES, max_slow_queries=DEFAULT_MAX_SLOW_QUERIES):
+        ''' Create a new aggregator
+        max_samples:        Maximum number of latencies kept per query shape
+        max_slow_queries:   Number of most recent slow queries kept
+        '''
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.shapes = dict()
+        self.slow_queries = deque(maxlen=max_slow_queries)
+
+    def _record(self, event):
+        ''' Add an event to the statistics '''
+        with self.lock:
+            if event.slow:
+                self.slow_queries.append(event)
+            if not event.sampled:
+                # Keep the histograms unbiased
+                return
+            key = event.get_key()
+            stats = self.shapes.get(key)
+            if stats is None:
+                stats = { 'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'docs': 0, 'bytes': 0, 'samples': list() }
+                self.shapes[key] = stats
+            stats['count'] += 1
+            stats['total_ms'] += event.duration_ms
+            stats['max_ms'] = max(stats['max_ms'], event.duration_ms)
+            if event.error is not None:
+                stats['errors'] += 1
+            if event.n_docs:
+                stats['docs'] += event.n_docs
+            if event.n_bytes:
+                stats['bytes'] += event.n_bytes
+            samples = stats['samples']
+            if len(samples) < self.max_samples:
+                samples.append(event.duration_ms)
+            else:
+                # Reservoir sampling
+                k = int(random() * stats['count'])
+                if k < self.max_samples:
+                    samples[k] = event.duration_ms
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def report(self):
+        ''' Return the statistics of each query shape, slowest in total first '''
+        with self.lock:
+            items = [(key, dict(stats), sorted(stats['samples'])) for key, stats in self.shapes.iteritems()]
+        rows = list()
+        for (op, collection, shape), stats, samples in items:
+            rows.append({ 'op': op,
+                          'collection': collection,
+                          'shape': shape,
+                          'count': stats['count'],
+                          'errors': stats['errors'],
+                          'docs': stats['docs'],
+                          'bytes': stats['bytes'],
+                          'total_ms': stats['total_ms'],
+                          'mean_ms': stats['total_ms'] / stats['count'],
+                          'p50_ms': _percentile(samples, 50),
+                          'p95_ms': _percentile(samples, 95),
+                          'p99_ms': _percentile(samples, 99),
+                          'max_ms': stats['max_ms'] })
+        rows.sort(key=lambda r: r['total_ms'], reverse=True)
+        return rows
+
+    def get_slow_queries(self):
+        ''' Return the most recent slow queries '''
+        with self.lock:
+            return list(self.slow_queries)
+
+    def reset(self):
+        ''' Clear all statistics '''
+        with self.lock:
+            self.shapes.clear()
+            self.slow_queries.clear()
+
+
+##  PUBLIC METHODS  #######################
+
+def add_listener(listener):
+    ''' Register a listener notified of queries '''
+    global _listeners
+    if listener not in _listeners:
+        _listeners = _listeners + [listener]
+    return listener
+
+def remove_listener(listener):
+    ''' Unregister a listener '''
+    global _listeners
+    _listeners = [l for l in _listeners if l is not listener]
+
+def get_listeners():
+    ''' Return the registered listeners '''
+    return list(_listeners)
+
+def set_sample_rate(rate):
+    ''' Set the fraction of queries (between 0 and 1) reported to listeners '''
+    global _sample_rate
+    if rate < 0 or rate > 1:
+        raise ValueError("Sample rate should be between 0 and 1: %s" % rate)
+    _sample_rate = rate
+
+def set_slow_query_threshold(ms, explain=True):
+    ''' Report queries taking longer than a given time (in ms, None to disable), sampled or not
+    explain:    Whether to attach the explain() plan of slow finds and counts
+    '''
+    global _slow_query_ms, _explain_slow_queries
+    _slow_query_ms = ms
+    _explain_slow_queries = explain
+
+def start_event(op, query_inst, name):
+    ''' Notify listeners that a query is about to run, return the event (None if nobody listens) '''
+    listeners = [l for l in _listeners if l.is_active()]
+    if not listeners:
+        return None
+    sampled = _sample_rate >= 1 or random() < _sample_rate
+    if not sampled and _slow_query_ms is None:
+        return None
+    event = QueryEvent(op, query_inst, name, sampled)
+    event.listeners = listeners
+    if sampled:
+        for l in listeners:
+            l.started(event)
+    return event
+
+def end_event(event, error=None, n_docs=None, data=None, explain=None):
+    ''' Notify listeners that a query completed
+    event:      Event returned by start_event
+    error:      Error raised by the query, if any
+    n_docs:     Number of documents returned or written
+    data:       Documents returned or written, measured for sampled queries
+    explain:    Function returning the explain() plan of the query, if it has one
+    '''
+    event.duration_ms = (time() - event.start_time) * 1000
+    event.error = error
+    event.n_docs = n_docs
+    if data is not None and event.sampled:
+        event.n_bytes = estimate_size(data)
+    if _slow_query_ms is not None and event.duration_ms >= _slow_query_ms:
+        event.slow = True
+        if event.caller is None:
+            event.caller = _get_caller()
+        if explain is not None and _explain_slow_queries and error is None:
+            try:
+                event.plan = explain()
+            except Exception, e:
+                event.plan = { 'error': str(e) }
+    elif not event.sampled:
+        return
+    for l in event.listeners:
+        if error is None:
+            l.succeeded(event)
+        else:
+            l.failed(event)
+
+
+add_listener(QueryLogger())
+
@@ -0,0 +1,229 @@
+'''
+Created on Oct 17, 2026
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from time import time
+import threading
+import os
+
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 300      # Seconds before an idle connection is evicted
+DEFAULT_CHECK_INTERVAL = 30     # Seconds of idleness after which a connection is checked before reuse
+
+class PoolTimeoutError(Exception):
+    ''' Raised when no connection could be borrowed from the pool in time '''
+    pass
+
+class PoolClosedError(Exception):
+    ''' Raised when borrowing from a pool that was closed '''
+    pass
+
+class ConnectionPool(object):
+    ''' Thread-safe and fork-safe pool of database connections '''
+
+    def __init__(self, factory, min_size=DEFAULT_MIN_SIZE, max_size=DEFAULT_MAX_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, check_interval=DEFAULT_CHECK_INTERVAL):
+        ''' Create a new pool
+        factory:          Callable returning a new connection
+        min_size:         Number of connections to keep around, even when idle
+        max_size:         Maximum number of connections open at once
+        idle_timeout:     Time (in seconds) after which an idle connection is evicted
+        check_interval:   Idle time (in seconds) after which a connection is checked before being reused
+        '''
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Invalid pool size: min=%s, max=%s" % (min_size, max_size))
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._reset()
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _reset(self):
+        ''' Reset the pool state (used on creation and after a fork) '''
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = list()         # (connection, last used time), most recently used last
+        self._in_use = 0
+        self._closed = False
+
+    def _check_fork(self):
+        ''' Drop all connections inherited from a parent process '''
+        if self._pid != os.getpid():
+            # Sockets are shared with the parent, so leave them alone and start over
+            self._reset()
+
+    def _open(self):
+        ''' Open a new connection '''
+        return self.factory()
+
+    def _close_conn(self, conn):
+        ''' Close a given connection, ignoring errors '''
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        ''' Return whether the given connection is still usable '''
+        try:
+            conn.admin.command("ping")
+            return True
+        except Exception:
+            return False
+
+    def _pop_idle(self):
+        ''' Take the most recently used idle connection, if any (must hold the lock) '''
+        if self._idle:
+            return self._idle.pop()
+        return None, None
+
+    def _evict_idle(self, now):
+        ''' Evict connections idle for too long, keeping at least min_size around (must hold the lock) '''
+        evicted = list()
+        if self.idle_timeout is None:
+            return evicted
+        while self._idle and len(self._idle) + self._in_use > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            evicted.append(conn)
+        return evicted
+
+
+    ##  PUBLIC METHODS  #######################
+
+    def acquire(self, timeout=None):
+        ''' Borrow a connection from the pool, waiting up to timeout seconds when all are in use '''
+        deadline = time() + timeout if timeout is not None else None
+        while True:
+            self._cond.acquire()
+            try:
+                self._check_fork()
+                if self._closed:
+                    raise PoolClosedError("Connection pool is closed")
+                conn, last_used = self._pop_idle()
+                if conn is None:
+                    if self._in_use >= self.max_size:
+                        # Wait for a connection to be released
+                        wait = deadline - time() if deadline is not None else None
+                        if wait is not None and wait <= 0:
+                            raise PoolTimeoutError("No connection available after %s seconds" % timeout)
+                        self._cond.wait(wait)
+                        continue
+                self._in_use += 1
+            finally:
+                self._cond.release()
+
+            # Open or check the connection outside of the lock
+            try:
+                if conn is None:
+                    return self._open()
+                if self.check_interval is not None and time() - last_used >= self.check_interval \
+                        and not self._is_healthy(conn):
+                    self._close_conn(conn)
+                    return self._open()
+                return conn
+            except:
+                self._discard()
+                raise
+
+    def release(self, conn):
+        ''' Return a borrowed connection to the pool '''
+        evicted = list()
+        self._cond.acquire()
+        try:
+            if self._pid != os.getpid():
+                # Borrowed before a fork, do not let it into this process' pool
+                return
+            self._in_use = max(0, self._in_use - 1)
+            if self._closed:
+                evicted.append(conn)
+            else:
+                now = time()
+                self._idle.append((conn, now))
+                evicted = self._evict_idle(now)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        for c in evicted:
+            self._close_conn(c)
+
+    def discard(self, conn):
+        ''' Close a borrowed connection instead of returning it to the pool (e.g. after a network error) '''
+        self._close_conn(conn)
+        self._discard()
+
+    def _discard(self):
+        ''' Account for a borrowed connection that will not be returned '''
+        self._cond.acquire()
+        try:
+            self._in_use = max(0, self._in_use - 1)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def fill(self):
+        ''' Open connections until the pool holds at least min_size of them '''
+        while True:
+            self._cond.acquire()
+            try:
+                self._check_fork()
+                if self._closed or len(self._idle) + self._in_use >= self.min_size:
+                    return
+                self._in_use += 1
+            finally:
+                self._cond.release()
+            try:
+                conn = self._open()
+            except:
+                self._discard()
+                raise
+            self.release(conn)
+
+    def evict_idle(self):
+        ''' Close connections that have been idle for too long '''
+        self._cond.acquire()
+        try:
+            self._check_fork()
+            evicted = self._evict_idle(time())
+        finally:
+            self._cond.release()
+        for c in evicted:
+            self._close_conn(c)
+        return len(evicted)
+
+    def close(self):
+        ''' Close all idle connections, borrowed ones get closed when released '''
+        self._cond.acquire()
+        try:
+            self._check_fork()
+            self._closed = True
+            idle = self._idle
+            self._idle = list()
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        for conn, _ in idle:
+            self._close_conn(conn)
+
+    def size(self):
+        ''' Return the number of connections currently open '''
+        return len(self._idle) + self._in_use
+
+    def available(self):
+        ''' Return the number of idle connections '''
+        return len(self._idle)
+
+    def in_use(self):
+        ''' Return the number of borrowed connections '''
+        return self._in_use
+
@@ -8,55 +8,263 @@ Created on Mar 10, 2012
 from __future__ import with_statement
 
 from orm.db.database import Database
-from time import time
+from orm.db.query_cache import CachedResult, freeze, MISS
+from orm.db.replica_set import ReadPreference, PRIMARY
+from orm.db.raw_bson import RawCursor, RawDocument
+from orm.db import instrumentation
+from bson import BSON
 import pymongo
-
-# TODO: Add query caching
+import pymongo.errors
+import base64
 
 class QueryMonitor(object):
-    ''' Decorator that logs queries '''
+    ''' Context manager reporting queries to the instrumentation listeners '''
     
-    def __init__(self, query_inst, query_name):
-        self.start_time = 0
+    def __init__(self, query_inst, query_name, op):
         self.inst = query_inst
         self.name = query_name
+        self.op = op
+        self.event = None
+        self.n_docs = None
+        self.data = None
         
     def __enter__(self):
-        if Database.query_logging is True:
-            self.start_time = time()
+        self.event = instrumentation.start_event(self.op, self.inst, self.name)
+        return self
+    
+    def done(self, n_docs, data=None):
+        ''' Record the number of documents returned or written, and the documents themselves if at hand '''
+        self.n_docs = n_docs
+        self.data = data
+    
+    def defer(self, cursor):
+        ''' Let a cursor report the query once its first results arrive, instead of when leaving the block 
+        Cursors are lazy, so the query has not been sent to the server yet.
+        '''
+        cursor.event = self.event
+        cursor.explain = self.inst._explain
+        self.event = None
         
     def __exit__(self, t, value, tb):
-        if Database.query_logging is True:
-            if t is not None:
-                pass # Exception occurred
-            self.inst._clean()
-            dt = (time() - self.start_time) * 1000
-            extra = list()
-            if self.inst.distinct_field:
-                extra.append("distinct %s" % self.inst.distinct_field)
-            if self.inst.order_field:
-                extra.append("sort by %s" % self.inst.order_field)
-            if self.inst.lim:
-                extra.append("lim=%d" % self.inst.lim)
-            print "Query: %s %s%s in %.2f ms" % (self.name, "(%s) " % ", ".join(extra) if extra else "", self.inst.col_name, dt)
+        try:
+            if self.event is not None:
+                explain = self.inst._explain if self.op in (OP_FIND, OP_COUNT) else None
+                instrumentation.end_event(self.event, value, self.n_docs, self.data, explain)
+        finally:
+            self.inst._clean(value)
+
+
+class PooledCursor(object):
+    ''' Cursor keeping the connection it reads from borrowed until it is exhausted, closed or garbage collected 
+    Queries whose report is deferred to the cursor (see QueryMonitor.defer) are reported 
+    once the first round trip is over, or when the cursor is closed if it never made one.
+    '''
+
+    def __init__(self, cursor, conn, pool, alias=None):
+        self.cursor = cursor
+        self.conn = conn
+        self.pool = pool
+        self.alias = alias
+        self.event = None
+        self.explain = None
+
+    def _report(self, error=None):
+        ''' Report the query to the instrumentation listeners, once '''
+        event, self.event = self.event, None
+        if event is not None:
+            instrumentation.end_event(event, error, explain=self.explain)
+        self.explain = None
+
+    def _first(self, fn, *args):
+        ''' Call a function making a round trip, reporting the query after the first one '''
+        if self.event is None:
+            return fn(*args)
+        try:
+            res = fn(*args)
+        except StopIteration:
+            self._report()
+            raise
+        except Exception, e:
+            self._report(e)
+            raise
+        self._report()
+        return res
+
+    def _release(self, error=None):
+        ''' Return the connection to the pool, once '''
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            if isinstance(error, pymongo.errors.AutoReconnect):
+                Database._discard_connection(conn, self.pool, self.alias)
+            else:
+                Database._release_connection(conn, self.pool, self.alias)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self._first(self.cursor.next)
+        except StopIteration:
+            self._release()
+            raise
+        except Exception, e:
+            self._release(e)
+            raise
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            # Slices only set the skip and limit of the cursor
+            self.cursor = self.cursor[index]
+            return self
+        return self._first(self.cursor.__getitem__, index)
+
+    def count(self, *args, **kwargs):
+        return self._first(lambda: self.cursor.count(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def sort(self, *args, **kwargs):
+        self.cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, n):
+        self.cursor.skip(n)
+        return self
+
+    def limit(self, n):
+        self.cursor.limit(n)
+        return self
+
+    def batch_size(self, n):
+        self.cursor.batch_size(n)
+        return self
+
+    def close(self):
+        ''' Close the cursor and return its connection to the pool '''
+        try:
+            self.cursor.close()
+        finally:
+            self._report()
+            self._release()
+
+    def __del__(self):
+        self._report()
+        self._release()
 
 
 ASCENDING = pymongo.ASCENDING
 DESCENDING = pymongo.DESCENDING
 
+OP_FIND = "find"
+OP_COUNT = "count"
+OP_INSERT = "insert"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+OP_BULK = "bulk"
+OP_AGGREGATE = "aggregate"
+
+BULK_INSERT = "insert"
+BULK_UPDATE = "update"
+BULK_UPSERT = "upsert"
+BULK_DELETE = "delete"
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class Page(list):
+    ''' Results of a paginated query (see Query.page_after) '''
+    
+    def __init__(self, items=None, next_token=None):
+        list.__init__(self, items or list())
+        self.next_token = next_token        # Token to pass to get the next page, None for the last page
+        
+    def has_next(self):
+        ''' Return whether there are more results after this page '''
+        return self.next_token is not None
+
+
+def get_path_value(doc, path):
+    ''' Return the value at a dotted path in a document, None if missing '''
+    for part in path.split("."):
+        if not isinstance(doc, (dict, RawDocument)):
+            return None
+        doc = doc.get(part)
+    return doc
+
+def _remove_path(doc, path):
+    ''' Remove the value at a dotted path from a document, along with the embedded documents it leaves empty '''
+    parts = path.split(".", 1)
+    if not isinstance(doc, dict) or not doc.has_key(parts[0]):
+        return
+    if len(parts) > 1:
+        _remove_path(doc[parts[0]], parts[1])
+        if doc[parts[0]]:
+            return
+    del doc[parts[0]]
+
+def make_page_token(field, direction, doc):
+    ''' Return the opaque token pointing right after a given document 
+    field:        Sort field of the query, possibly dotted (None when sorting by id only)
+    direction:    Sort direction
+    '''
+    state = { 's': field, 'd': direction, 'i': doc['_id'] }
+    if field:
+        state['v'] = get_path_value(doc, field)
+    return base64.urlsafe_b64encode(BSON.encode(state))
+
+def parse_page_token(token, field, direction):
+    ''' Return the (sort value, id) a token points after, checking it was made for the same sort '''
+    try:
+        state = BSON(base64.urlsafe_b64decode(str(token))).decode()
+    except Exception, e:
+        raise ValueError("Invalid page token: %s" % e)
+    if state.get('s') != field or state.get('d') != direction:
+        raise ValueError("Page token was made for a different sort: %s" % (state.get('s'),))
+    return state.get('v'), state['i']
+
+def get_keyset_conditions(field, direction, value, obj_id):
+    ''' Return the conditions matching documents sorted after a given (sort value, id) pair 
+    Null values sort first, and are never matched by range operators.
+    '''
+    op = "$gt" if direction == ASCENDING else "$lt"
+    if not field:
+        return { '_id': { op: obj_id } }
+    if value is None:
+        if direction == ASCENDING:
+            return { '$or': [{ field: { '$ne': None } }, { field: None, '_id': { op: obj_id } }] }
+        return { field: None, '_id': { op: obj_id } }
+    clauses = [{ field: { op: value } }, { field: value, '_id': { op: obj_id } }]
+    if direction == DESCENDING:
+        clauses.append({ field: None })
+    return { '$or': clauses }
+
 
 class Query:
     ''' MongoDB query wrapper '''
     
-    def __init__(self, collection, db_inst=None):
+    def __init__(self, collection, db_inst=None, alias=None):
+        ''' Create a new query 
+        collection:    Collection name, or model class (whose collection, database alias and read preference are used)
+        db_inst:       Database object to use instead of a pooled connection
+        alias:         Alias of the database the collection is in (see Database.get_instance)
+        '''
         self.reset()
         self.db = db_inst
+        self.alias = alias
+        self.conn = None
+        self.pool = None
+        self.read_pref = None
+        self.use_cache = True
         self.has_ext_conn = (db_inst is not None)
         t = type(collection)
         if t is str:
             self.col_name = collection
-        elif hasattr(collection, 'get_class_name'):
-            self.col_name = collection.get_class_name()
+        elif hasattr(collection, 'get_collection_name'):
+            self.col_name = collection.get_collection_name()
+            self.alias = alias or getattr(collection, '_db_alias', None)
+            self.read_pref = ReadPreference.get(getattr(collection, '_read_preference', None))
         else:
             raise Exception("Collection should be a string or a class extending BaseObject: %s" % t)
         
@@ -166,6 +374,27 @@ class Query:
         self.update_rules['$inc'][field] = value
         return self
     
+    def push(self, field, *values):
+        ''' Append values to a given array field '''
+        if not self.update_rules.has_key('$push'):
+            self.update_rules['$push'] = dict()
+        self.update_rules['$push'][field] = { '$each': list(values) }
+        return self
+    
+    def add_to_set(self, field, *values):
+        ''' Append values that are not already in a given array field '''
+        if not self.update_rules.has_key('$addToSet'):
+            self.update_rules['$addToSet'] = dict()
+        self.update_rules['$addToSet'][field] = { '$each': list(values) }
+        return self
+    
+    def pull(self, field, *values):
+        ''' Remove all occurrences of the given values from a given array field '''
+        if not self.update_rules.has_key('$pull'):
+            self.update_rules['$pull'] = dict()
+        self.update_rules['$pull'][field] = { '$in': list(values) }
+        return self
+    
     def decr(self, field):
         ''' Decrement a given field '''
         self.incr(field, -1)
@@ -176,84 +405,362 @@ class Query:
         self.lim = n
         return self
     
+    def batch_size(self, n):
+        ''' Specify the number of results fetched from the server per round trip '''
+        self.batch_n = n
+        return self
+    
+    def no_timeout(self):
+        ''' Keep the server-side cursor open until exhausted, even if idle for a while '''
+        self.cursor_timeout = False
+        return self
+    
     def sort(self, field, direction=None):
         ''' Sort the results according to the given field and direction '''
         self.order_field = field
         self.order_dir = direction
         return self
     
-    def _get_db_inst(self):
-        ''' Return the database instance '''
+    def sort_by_id(self, is_enabled=True):
+        ''' Break sort ties by id, in the sort direction '''
+        self.id_tiebreak = is_enabled
+        return self
+    
+    def raw(self, is_enabled=True):
+        ''' Return results as undecoded RawDocuments (see orm.db.raw_bson) '''
+        self.raw_mode = is_enabled
+        return self
+    
+    def cache(self, is_enabled=True):
+        ''' Allow or prevent serving this query from the result cache '''
+        self.use_cache = is_enabled
+        return self
+    
+    def read_preference(self, mode, max_lag=None):
+        ''' Specify which replica set members finds and counts can be served by 
+        mode:       Read preference mode (see orm.db.replica_set)
+        max_lag:    Maximum replication lag (in seconds) of the secondaries to read from
+        '''
+        self.read_pref = ReadPreference(mode, max_lag)
+        return self
+    
+    def _get_read_preference(self):
+        ''' Return the read preference of this query, or the default one '''
+        return self.read_pref or Database._get_read_preference(self.alias)
+    
+    def _get_read_options(self):
+        ''' Return the options letting reads be served by a secondary, if the read preference allows it 
+        Otherwise secondaries reject them (with "not master and slaveOk=false").
+        '''
+        read_pref = self._get_read_preference()
+        if read_pref is not None and read_pref.mode != PRIMARY:
+            return { 'read_preference': pymongo.ReadPreference.SECONDARY_PREFERRED }
+        return dict()
+    
+    def _get_db_inst(self, read=False):
+        ''' Return the database instance, borrowing a pooled connection if needed 
+        read:    Whether the connection is only used for reading (otherwise it goes to the primary)
+        '''
         if not self.db:
-            self.db = Database.get_instance()
+            self.pool = Database._get_pool(self._get_read_preference() if read else None, self.alias)
+            self.conn = self.pool.acquire()
+            self.db = self.conn[Database._get_db_name(self.alias)]
         return self.db
     
-    def _get_collection(self):
+    def _get_collection(self, read=False):
         ''' Return the corresponding collection for this class '''
-        db = self._get_db_inst()
+        db = self._get_db_inst(read)
         return db[self.col_name]
     
-    def _clean(self):
-        ''' Clean up '''
-        if not self.has_ext_conn:
-            self.db.connection.close()
+    def _clean(self, error=None):
+        ''' Return the borrowed connection to the pool, unless a cursor took it over (see _lease) '''
+        if not self.has_ext_conn and self.conn is not None:
+            if isinstance(error, pymongo.errors.AutoReconnect):
+                # Do not hand a broken connection over to someone else
+                Database._discard_connection(self.conn, self.pool, self.alias)
+            else:
+                Database._release_connection(self.conn, self.pool, self.alias)
+            self.conn = None
+            self.pool = None
+            self.db = None
+    
+    def _lease(self, cursor):
+        ''' Hand the borrowed connection over to a cursor, which returns it to the pool once done reading 
+        This way connections read by live cursors count against the pool size, 
+        and are never closed by the pool while still in use.
+        '''
+        cursor = PooledCursor(cursor, self.conn, self.pool, self.alias)
+        if self.conn is not None:
+            self.conn = None
+            self.pool = None
+            self.db = None
+        return cursor
+    
+    def _get_cache(self):
+        ''' Return the result cache if this query can use it '''
+        if self.use_cache and not self.has_ext_conn:
+            return Database.query_cache
+        return None
+    
+    def _get_cache_key(self, kind):
+        ''' Return the key identifying the shape of this query in the result cache '''
+        return (kind, self.alias, Database._get_db_name(self.alias), self.col_name, freeze(self.conditions), 
+                tuple(sorted(self.selected_fields)) if self.selected_fields else None, 
+                self.order_field, self.order_dir, self.id_tiebreak, self.lim, self.distinct_field, self.raw_mode)
+    
+    def _invalidate_cache(self):
+        ''' Drop the cached results of the collection this query writes to '''
+        if Database.query_cache is not None:
+            Database.query_cache.invalidate(self.col_name)
     
     def execute(self):
         ''' Execute this query '''
         if self.insert_values:
-            with QueryMonitor(self, "Insert %d fields into" % len(self.insert_values)):
-                if self.insert_values.has_key("id"):
-                    self.insert_values["_id"] = self.insert_values["id"]
-                    del self.insert_values["id"]
-                col = self._get_collection()
-                return col.insert(self.insert_values)
-        else:
-            with QueryMonitor(self, "Get %sfrom" % ("%d fields " % len(self.selected_fields) if self.selected_fields else "")):
-                col = self._get_collection()
-                params = dict(map(lambda x: (x, 1), self.selected_fields)) if self.selected_fields else None                    
-                res = col.find(self.conditions, params)
+            try:
+                with QueryMonitor(self, "Insert %d fields into" % len(self.insert_values), OP_INSERT) as m:
+                    if self.insert_values.has_key("id"):
+                        self.insert_values["_id"] = self.insert_values["id"]
+                        del self.insert_values["id"]
+                    col = self._get_collection()
+                    obj_id = col.insert(self.insert_values)
+                    m.done(1, self.insert_values)
+                    return obj_id
+            finally:
+                self._invalidate_cache()
+        cache = self._get_cache()
+        if cache is not None and not self.raw_mode:
+            # Raw documents are meant to be streamed, they are not kept in the cache
+            key = self._get_cache_key("find")
+            res = cache.get(key)
+            if res is MISS:
+                generation = cache.generation(self.col_name)
+                res = self._find(True)
+                cache.set(key, self.col_name, res, generation)
+            return CachedResult(res)
+        return self._find()
+    
+    def _find(self, materialize=False):
+        ''' Execute this query as a find 
+        materialize:    Whether to fetch all the results into a list instead of returning a cursor
+        '''
+        with QueryMonitor(self, "Get %sfrom" % ("%d fields " % len(self.selected_fields) if self.selected_fields else ""), OP_FIND) as m:
+            col = self._get_collection(True)
+            params = dict(map(lambda x: (x, 1), self.selected_fields)) if self.selected_fields else None                    
+            if self.raw_mode:
+                if self.distinct_field:
+                    raise ValueError("Distinct queries cannot return raw documents")
+                res = RawCursor(col, self.conditions, params, self._get_sort_keys(), self.lim or 0, self.batch_n or 0,
+                                bool(self._get_read_options()))
+            else:
+                options = self._get_read_options()
+                if not self.cursor_timeout:
+                    options['timeout'] = False
+                res = col.find(self.conditions, params, **options)
+                if self.batch_n:
+                    res = res.batch_size(self.batch_n)
                 if self.distinct_field:
                     res = res.distinct(self.distinct_field)
-                if self.order_field:
-                    res = res.sort(self.order_field, 
-                                   self.order_dir if self.order_dir is not None else DESCENDING)
+                sort_keys = self._get_sort_keys()
+                if sort_keys:
+                    res = res.sort(sort_keys)
                 if self.lim:
                     res = res.limit(self.lim)
-                return res
+            if materialize:
+                res = list(res)
+                m.done(len(res), res)
+            elif not self.distinct_field:
+                res = self._lease(res)
+                m.defer(res)
+            return res
+    
+    def _get_sort_keys(self):
+        ''' Return the (field, direction) pairs to sort the results by, None if unsorted '''
+        if self.order_field:
+            direction = self.order_dir if self.order_dir is not None else DESCENDING
+            if self.id_tiebreak and self.order_field != "_id":
+                return [(self.order_field, direction), ("_id", direction)]
+            return [(self.order_field, direction)]
+        elif self.id_tiebreak:
+            return [("_id", ASCENDING)]
+        return None
+    
+    def _explain(self):
+        ''' Return the plan of this query, as chosen by the server '''
+        try:
+            cursor = self._get_collection(True).find(self.conditions, **self._get_read_options())
+            sort_keys = self._get_sort_keys()
+            if sort_keys:
+                # Whether the sort is read from an index or done in memory is part of the plan
+                cursor = cursor.sort(sort_keys)
+            return cursor.explain()
+        finally:
+            self._clean()
     
     def fetch_one(self):
-        ''' Execute a get query limited to the first result only '''
-        results = self.execute()
-        if results and results.count():
-            return results[0]
+        ''' Execute a get query limited to the first result only, in a single round trip '''
+        for doc in self.limit(1).execute():
+            return doc
+        return None
+    
+    def page_after(self, token=None, size=DEFAULT_PAGE_SIZE):
+        ''' Return the page of results following a given token, as a Page 
+        Pages are delimited by the sort value and id of their last document 
+        rather than skipped over, so that getting a page costs the same 
+        wherever it is, and that no result is missed or seen twice when 
+        documents are added or removed in between. Ties on the sort field 
+        are broken by id; results are sorted by id if no sort is set.
+        token:    Token of the previous page (see Page.next_token), None for the first page
+        size:     Maximum number of results in the page
+        '''
+        field = self.order_field if self.order_field != "_id" else None
+        direction = ASCENDING
+        if self.order_field:
+            direction = self.order_dir if self.order_dir is not None else DESCENDING
+        q = self.copy().sort_by_id().limit(size + 1)
+        if token:
+            value, obj_id = parse_page_token(token, field, direction)
+            after = get_keyset_conditions(field, direction, value, obj_id)
+            q.conditions = { '$and': [self.conditions, after] } if self.conditions else after
+        extra_field = field and self.selected_fields and \
+            not any([field == f or field.startswith(f + ".") for f in self.selected_fields])
+        if extra_field:
+            # The sort value is needed to make the token
+            q.select(*(tuple(self.selected_fields) + (field,)))
+        docs = list(q.execute())
+        next_token = None
+        if len(docs) > size:
+            docs = docs[:size]
+            next_token = make_page_token(field, direction, docs[-1])
+        if extra_field:
+            for k, doc in enumerate(docs):
+                if isinstance(doc, RawDocument):
+                    docs[k] = doc.without(field)
+                else:
+                    _remove_path(doc, field)
+        return Page(docs, next_token)
+    
+    def aggregate(self):
+        ''' Return an aggregation pipeline (see orm.db.aggregation) starting with the conditions, sort and limit of this query '''
+        from orm.db.aggregation import Aggregation
+        return Aggregation(self)
+    
+    def scan(self, **options):
+        ''' Return a partitioned scan of the results of this query (see orm.db.scan.PartitionedScan for the options) '''
+        from orm.db.scan import PartitionedScan
+        return PartitionedScan(self, **options)
     
     def count(self):
         ''' Execute a count query on the associated collection '''
-        with QueryMonitor(self, "Count from"):
-            col = self._get_collection()
-            if self.conditions:
-                n = col.find(self.conditions).count()
+        cache = self._get_cache()
+        if cache is not None:
+            key = self._get_cache_key("count")
+            n = cache.get(key)
+            if n is MISS:
+                generation = cache.generation(self.col_name)
+                n = self._count()
+                cache.set(key, self.col_name, n, generation)
+            return n
+        return self._count()
+    
+    def _count(self):
+        ''' Execute this query as a count '''
+        with QueryMonitor(self, "Count from", OP_COUNT):
+            col = self._get_collection(True)
+            options = self._get_read_options()
+            if self.conditions or options:
+                n = col.find(self.conditions, **options).count()
             else:
                 n = col.count() 
             return n
     
     def update(self, **params):
         ''' Execute an update with the given values '''
-        with QueryMonitor(self, "Update %d fields from" % len(params)):
+        return self._update(params)
+    
+    def update_all(self, **params):
+        ''' Execute an update with the given values on all the matching documents (instead of the first one) '''
+        return self._update(params, True)
+    
+    def _update(self, params, multi=False):
+        ''' Execute an update with the given values on the first or all of the matching documents '''
+        if params:
+            self.update_rules['$set'] = params
+        if not self.update_rules:
+            # An empty update document would replace the whole document
+            raise ValueError("Nothing to update")
+        try:
+            with QueryMonitor(self, "Update %d fields from" % len(params), OP_UPDATE) as m:
+                resp = self._get_collection().update(self.conditions, self.update_rules, multi=multi)
+                m.done(resp.get('n') if type(resp) is dict else None, params)
+                return resp
+        finally:
+            self._invalidate_cache()
+    
+    def find_and_modify(self, new=True, **params):
+        ''' Execute an update with the given values and return the first matching document 
+        new:    Whether to return the document as it is after the update (otherwise before)
+        '''
+        if params:
             self.update_rules['$set'] = params
-            return self._get_collection().update(self.conditions, self.update_rules)
+        if not self.update_rules:
+            raise ValueError("Nothing to update")
+        try:
+            with QueryMonitor(self, "Find and modify %d fields from" % len(params), OP_UPDATE) as m:
+                fields = dict(map(lambda x: (x, 1), self.selected_fields)) if self.selected_fields else None
+                doc = self._get_collection().find_and_modify(self.conditions, self.update_rules, new=new, fields=fields)
+                m.done(1 if doc else 0, doc)
+                return doc
+        finally:
+            self._invalidate_cache()
     
     def delete(self):
         ''' Execute a delete query '''
-        with QueryMonitor(self, "Delete from"):
-            resp = self._get_collection().remove(self.conditions, True)
-            if resp.get('err', None):
-                raise Exception(resp)
-            return resp['n']
+        try:
+            with QueryMonitor(self, "Delete from", OP_DELETE) as m:
+                resp = self._get_collection().remove(self.conditions, True)
+                if resp.get('err', None):
+                    raise Exception(resp)
+                m.done(resp['n'])
+                return resp['n']
+        finally:
+            self._invalidate_cache()
+    
+    def bulk(self, operations, ordered=True):
+        ''' Execute a list of write operations in a single round trip 
+        operations:    List of ('insert', doc), ('update', selector, rules), 
+                       ('upsert', selector, rules) or ('delete', selector) tuples
+        ordered:       Whether to stop at the first error (otherwise all operations are attempted)
+        '''
+        try:
+            with QueryMonitor(self, "Bulk write %d operations into" % len(operations), OP_BULK) as m:
+                col = self._get_collection()
+                if ordered:
+                    bulk_op = col.initialize_ordered_bulk_op()
+                else:
+                    bulk_op = col.initialize_unordered_bulk_op()
+                for op in operations:
+                    kind = op[0]
+                    if kind == BULK_INSERT:
+                        bulk_op.insert(op[1])
+                    elif kind == BULK_UPDATE:
+                        bulk_op.find(op[1]).update_one(op[2])
+                    elif kind == BULK_UPSERT:
+                        bulk_op.find(op[1]).upsert().update_one(op[2])
+                    elif kind == BULK_DELETE:
+                        bulk_op.find(op[1]).remove_one()
+                    else:
+                        raise ValueError("Unknown bulk operation: %s" % kind)
+                resp = bulk_op.execute()
+                m.done(resp.get('nInserted', 0) + resp.get('nUpserted', 0) + resp.get('nModified', 0) + resp.get('nRemoved', 0))
+                return resp
+        finally:
+            self._invalidate_cache()
     
     def copy(self):
         ''' Return a copy of this query '''
-        q = Query(self.col_name, self.db)
+        q = Query(self.col_name, self.db, self.alias)
+        q.use_cache = self.use_cache
+        q.read_pref = self.read_pref
         if self.insert_values:
             q.insert(**self.insert_values)
         if self.selected_fields:
@@ -264,8 +771,16 @@ class Query:
             q.limit(self.lim)
         if self.order_field:
             q.sort(self.order_field, self.order_dir)
+        if self.id_tiebreak:
+            q.sort_by_id()
+        if self.raw_mode:
+            q.raw()
         if self.distinct_field:
             q.distinct(self.distinct_field)
+        if self.batch_n:
+            q.batch_size(self.batch_n)
+        if not self.cursor_timeout:
+            q.no_timeout()
         return q
     
     def reset(self):
@@ -276,6 +791,10 @@ class Query:
         self.lim = None
         self.order_field = None
         self.order_dir = None
+        self.id_tiebreak = False
+        self.raw_mode = False
         self.insert_values = None
         self.distinct_field = None
+        self.batch_n = None
+        self.cursor_timeout = True
         return self
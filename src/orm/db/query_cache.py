@@ -0,0 +1,158 @@
+'''
+Created on Oct 17, 2026
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from time import time
+from collections import OrderedDict
+from bson import BSON
+from orm.db.raw_bson import RawDocument
+import threading
+import copy
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 60                        # Seconds
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+MISS = object()
+
+def freeze(value):
+    ''' Turn a query parameter into a hashable and order independent value '''
+    t = type(value)
+    if t is dict:
+        return tuple(sorted([(k, freeze(v)) for k, v in value.iteritems()]))
+    elif t in (list, tuple):
+        return (t.__name__,) + tuple([freeze(v) for v in value])
+    elif t is set:
+        return frozenset([freeze(v) for v in value])
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+def estimate_size(value):
+    ''' Estimate the memory footprint of a cached value '''
+    if type(value) is list:
+        size = 0
+        for item in value:
+            if type(item) is dict:
+                size += len(BSON.encode(item))
+            elif isinstance(item, RawDocument):
+                size += len(item.raw)
+            else:
+                size += len(BSON.encode({ 'v': item }))
+        return size
+    return len(BSON.encode({ 'v': value }))
+
+
+class CachedResult(list):
+    ''' Materialized query results, behaving like a cursor for the common cases '''
+
+    def count(self, with_limit_and_skip=False):
+        ''' Return the number of results '''
+        return len(self)
+
+
+class QueryCache(object):
+    ''' Thread-safe LRU cache of query results with TTL and memory bound '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        ''' Create a new cache
+        max_entries:    Maximum number of cached results
+        ttl:            Time (in seconds) a result stays valid, None for no expiration
+        max_bytes:      Maximum estimated size of all cached results
+        '''
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()       # key -> (expiration time, size, collection, value), least recently used first
+        self._by_col = dict()               # collection -> set of keys
+        self._generations = dict()          # collection -> number of invalidations
+        self._epoch = 0                     # Number of times the whole cache was cleared
+        self._size = 0
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _remove(self, key):
+        ''' Remove an entry (must hold the lock) '''
+        _, size, col, _ = self._entries.pop(key)
+        self._size -= size
+        keys = self._by_col.get(col)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_col[col]
+
+
+    ##  PUBLIC METHODS  #######################
+
+    def generation(self, col):
+        ''' Return the current generation of a collection, to be passed back to set() '''
+        return (self._epoch, self._generations.get(col, 0))
+
+    def get(self, key):
+        ''' Return a copy of the cached value for the given key, or MISS '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS
+            if entry[0] is not None and entry[0] < time():
+                self._remove(key)
+                self.misses += 1
+                return MISS
+            # Mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            value = entry[3]
+        return copy.deepcopy(value)
+
+    def set(self, key, col, value, generation):
+        ''' Cache a value, unless the collection was written to since the given generation '''
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        value = copy.deepcopy(value)
+        expires = time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if (self._epoch, self._generations.get(col, 0)) != generation:
+                # Written to while the query was running, the value may be stale
+                return
+            if self._entries.has_key(key):
+                self._remove(key)
+            self._entries[key] = (expires, size, col, value)
+            self._by_col.setdefault(col, set()).add(key)
+            self._size += size
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, col):
+        ''' Drop all cached results for a given collection '''
+        with self._lock:
+            self._generations[col] = self._generations.get(col, 0) + 1
+            for key in list(self._by_col.get(col, ())):
+                self._remove(key)
+
+    def clear(self):
+        ''' Drop all cached results '''
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._by_col.clear()
+            self._size = 0
+
+    def size(self):
+        ''' Return the estimated size of all cached results '''
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
@@ -0,0 +1,262 @@
+'''
+Created on Oct 17, 2026
+
+Raw BSON passthrough: documents are fetched from the server as they
+are sent over the wire, without being decoded into dictionaries. Only
+the fields that are read get decoded, and documents can be forwarded
+as they are:
+
+    for doc in Query("venues").raw().where(city="Paris").execute():
+        out.write(doc.raw)
+
+Queries are sent with the pyMongo message helpers, over the same
+connection (and thus the same replica set member) a cursor would use.
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from bson import BSON
+from bson.son import SON
+from pymongo import message
+from pymongo.errors import OperationFailure, CursorNotFound, AutoReconnect
+import struct
+
+# Query flags
+SLAVE_OK = 4
+
+# Size of the values of fixed size BSON types
+FIXED_SIZES = { '\x01': 8, '\x06': 0, '\x07': 12, '\x08': 1, '\x09': 8, '\x0A': 0,
+                '\x10': 4, '\x11': 8, '\x12': 8, '\x13': 16, '\xFF': 0, '\x7F': 0 }
+
+# Types whose value starts with its size (without the 4 bytes of the size itself for strings)
+STRING_TYPES = ('\x02', '\x0D', '\x0E')
+DOCUMENT_TYPES = ('\x03', '\x04', '\x0F')
+
+
+def _skip_cstring(data, pos):
+    ''' Return the position right after the null terminated string at a given position '''
+    return data.index('\x00', pos) + 1
+
+def _value_end(data, kind, pos):
+    ''' Return the position right after the value of a given type starting at a given position '''
+    size = FIXED_SIZES.get(kind)
+    if size is not None:
+        return pos + size
+    if kind in STRING_TYPES:
+        return pos + 4 + struct.unpack("<i", data[pos:pos + 4])[0]
+    if kind in DOCUMENT_TYPES:
+        return pos + struct.unpack("<i", data[pos:pos + 4])[0]
+    if kind == '\x05':
+        # Binary: size, subtype, data
+        return pos + 5 + struct.unpack("<i", data[pos:pos + 4])[0]
+    if kind == '\x0B':
+        # Regex: pattern and options
+        return _skip_cstring(data, _skip_cstring(data, pos))
+    if kind == '\x0C':
+        # DBPointer: string and ObjectId
+        return pos + 4 + struct.unpack("<i", data[pos:pos + 4])[0] + 12
+    raise ValueError("Unknown BSON type: %r" % kind)
+
+def split_documents(data, pos=0):
+    ''' Return the RawDocuments of a buffer made of BSON documents put end to end '''
+    docs = list()
+    end = len(data)
+    while pos < end:
+        size = struct.unpack("<i", data[pos:pos + 4])[0]
+        docs.append(RawDocument(data[pos:pos + size]))
+        pos += size
+    return docs
+
+def write_bson(docs, fp):
+    ''' Write documents to a file-like object as BSON (the mongodump format), raw ones as they are '''
+    for doc in docs:
+        fp.write(doc.raw if isinstance(doc, RawDocument) else BSON.encode(doc))
+
+
+class RawDocument(object):
+    ''' Undecoded BSON document, whose fields are decoded as they are read '''
+
+    __slots__ = ('raw', '_offsets', '_values')
+
+    def __init__(self, data):
+        self.raw = data                 # BSON bytes
+        self._offsets = None            # Field name -> (start, end) of its element
+        self._values = dict()           # Decoded field values
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _get_offsets(self):
+        ''' Return where the element of each field is, walking the document on first use '''
+        if self._offsets is None:
+            data = self.raw
+            offsets = SON()
+            pos = 4
+            end = len(data) - 1
+            while pos < end:
+                kind = data[pos]
+                name_end = data.index('\x00', pos + 1)
+                value_end = _value_end(data, kind, name_end + 1)
+                offsets[data[pos + 1:name_end].decode("utf-8")] = (pos, value_end)
+                pos = value_end
+            self._offsets = offsets
+        return self._offsets
+
+    def _decode(self, name):
+        ''' Decode the value of a given field '''
+        start, end = self._get_offsets()[name]
+        element = self.raw[start:end]
+        return BSON(struct.pack("<i", len(element) + 5) + element + '\x00').decode()[name]
+
+
+    ##  PUBLIC METHODS  #########################
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            value = self._values[name] = self._decode(name)
+            return value
+
+    def get(self, name, default=None):
+        return self[name] if self.has_key(name) else default
+
+    def has_key(self, name):
+        return name in self._get_offsets()
+
+    __contains__ = has_key
+
+    def keys(self):
+        return self._get_offsets().keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._get_offsets())
+
+    def iteritems(self):
+        for name in self.keys():
+            yield name, self[name]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def without(self, path):
+        ''' Return a copy of this document without the value at a dotted path, 
+        nor the embedded documents it leaves empty '''
+        name, _, rest = path.partition(".")
+        offsets = self._get_offsets()
+        if name not in offsets:
+            return self
+        start, end = offsets[name]
+        element = ''
+        if rest:
+            if self.raw[start] != '\x03':
+                return self
+            value_start = self.raw.index('\x00', start + 1) + 1
+            embedded = RawDocument(self.raw[value_start:end])
+            left = embedded.without(rest)
+            if left is embedded:
+                return self
+            if len(left):
+                element = self.raw[start:value_start] + left.raw
+        body = self.raw[4:start] + element + self.raw[end:]
+        return RawDocument(struct.pack("<i", len(body) + 4) + body)
+
+    def to_dict(self):
+        ''' Decode the whole document '''
+        return BSON(self.raw).decode()
+
+    def __eq__(self, other):
+        return isinstance(other, RawDocument) and self.raw == other.raw
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "<RawDocument %d bytes>" % len(self.raw)
+
+
+class RawCursor(object):
+    ''' Cursor returning the documents of a query as RawDocuments '''
+
+    def __init__(self, collection, spec=None, fields=None, sort=None, limit=0, batch_size=0, slave_ok=False):
+        ''' Create a new cursor
+        sort:        List of (field, direction) pairs
+        slave_ok:    Whether the query can be served by a secondary
+        '''
+        self.collection = collection
+        self.connection = collection.database.connection
+        self.ns = "%s.%s" % (collection.database.name, collection.name)
+        if sort:
+            spec = SON([("$query", spec or dict()), ("$orderby", SON(sort))])
+        self.spec = spec or dict()
+        self.fields = fields
+        self.limit = limit
+        self.batch_n = batch_size
+        self.options = SLAVE_OK if slave_ok else 0
+        self.cursor_id = None
+        self.n_returned = 0
+        self.batch = list()
+        self.pos = 0                    # Position of the next document in the batch
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _get_batch_size(self):
+        ''' Return the number of documents to ask for in the next batch '''
+        if self.limit:
+            left = self.limit - self.n_returned
+            return min(left, self.batch_n) if self.batch_n else left
+        return self.batch_n
+
+    def _send(self, msg):
+        ''' Send a query or get more message, and keep the documents returned '''
+        _, (response, _, _) = self.connection._send_message_with_response(msg)
+        flags, cursor_id, _, n = struct.unpack("<iqii", response[:20])
+        if flags & 1:
+            raise CursorNotFound("cursor id '%s' not valid at server" % self.cursor_id)
+        elif flags & 2:
+            error = BSON(response[20:]).decode()
+            if error["$err"].startswith("not master"):
+                raise AutoReconnect(error["$err"])
+            raise OperationFailure("database error: %s" % error["$err"], error.get("code"), error)
+        self.cursor_id = cursor_id
+        self.batch = split_documents(response, 20)
+        self.pos = 0
+        self.n_returned += len(self.batch)
+        if self.limit and self.n_returned >= self.limit:
+            self.close()
+
+    def _refresh(self):
+        ''' Fetch the next batch of documents, return whether there was any '''
+        if self.cursor_id is None:
+            self._send(message.query(self.options, self.ns, 0, self._get_batch_size(), self.spec, self.fields))
+        elif self.cursor_id:
+            self._send(message.get_more(self.ns, self._get_batch_size(), self.cursor_id))
+        else:
+            return False
+        return len(self.batch) > 0
+
+
+    ##  PUBLIC METHODS  #########################
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.pos >= len(self.batch) and not self._refresh():
+            raise StopIteration()
+        self.pos += 1
+        return self.batch[self.pos - 1]
+
+    def close(self):
+        ''' Let the server free the cursor before it is exhausted '''
+        if self.cursor_id:
+            self.connection.kill_cursors([self.cursor_id])
+        self.cursor_id = 0
+
+    def __del__(self):
+        self.close()
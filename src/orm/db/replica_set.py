@@ -0,0 +1,282 @@
+'''
+Created on Oct 17, 2026
+
+Replica set topology and read preferences. Each member of the set gets
+its own connection pool; writes always go to the primary while reads
+are routed according to a read preference:
+
+    primary              Only read from the primary (default)
+    primaryPreferred     Read from the primary, from a secondary if there is none
+    secondary            Only read from secondaries
+    secondaryPreferred   Read from secondaries, from the primary if there is none
+    nearest              Read from the member with the lowest latency
+
+Members lagging behind the primary by more than the maximum lag of a
+read preference (in seconds) are not read from.
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from __future__ import with_statement
+
+from time import time
+import threading
+import random
+
+PRIMARY = "primary"
+PRIMARY_PREFERRED = "primaryPreferred"
+SECONDARY = "secondary"
+SECONDARY_PREFERRED = "secondaryPreferred"
+NEAREST = "nearest"
+
+MODES = (PRIMARY, PRIMARY_PREFERRED, SECONDARY, SECONDARY_PREFERRED, NEAREST)
+
+DEFAULT_REFRESH_INTERVAL = 10       # Seconds between two checks of the members
+DEFAULT_LATENCY_WINDOW = 15         # Members this much slower (in ms) than the nearest one are still used
+RTT_WEIGHT = 0.2                    # Weight of the last round trip time in the moving average
+
+
+class ReplicaSetError(Exception):
+    ''' Raised when no member of the replica set can serve a request '''
+    pass
+
+
+class ReadPreference(object):
+    ''' Where to read from in a replica set '''
+
+    def __init__(self, mode=PRIMARY, max_lag=None):
+        ''' Create a new read preference
+        mode:       One of the read preference modes
+        max_lag:    Maximum replication lag (in seconds) of the secondaries to read from, None for any
+        '''
+        if mode not in MODES:
+            raise ValueError("Unknown read preference: %s" % mode)
+        if mode == PRIMARY and max_lag is not None:
+            raise ValueError("A maximum lag cannot be used with the primary read preference")
+        self.mode = mode
+        self.max_lag = max_lag
+
+    @classmethod
+    def get(cls, value):
+        ''' Return a read preference from a mode name, a (mode, max_lag) pair or a read preference (None stays None) '''
+        if value is None or isinstance(value, ReadPreference):
+            return value
+        if type(value) in (tuple, list):
+            return ReadPreference(*value)
+        return ReadPreference(value)
+
+    def __eq__(self, other):
+        return isinstance(other, ReadPreference) and (self.mode, self.max_lag) == (other.mode, other.max_lag)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        if self.max_lag is not None:
+            return "<ReadPreference %s max_lag=%s>" % (self.mode, self.max_lag)
+        return "<ReadPreference %s>" % self.mode
+
+
+def parse_hosts(hosts, default_port):
+    ''' Return a list of (host, port) from a "host1:port1,host2:port2" seed list or a list of addresses '''
+    if isinstance(hosts, basestring):
+        hosts = [h for h in hosts.split(",") if h.strip()]
+    addresses = list()
+    for h in hosts:
+        if type(h) is tuple:
+            address = (h[0], int(h[1]))
+        elif ":" in h:
+            host, port = h.strip().rsplit(":", 1)
+            address = (host, int(port))
+        else:
+            address = (h.strip(), default_port)
+        if address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+class Member(object):
+    ''' Member of a replica set, as last seen '''
+
+    def __init__(self, address, pool):
+        self.address = address
+        self.pool = pool
+        self.is_up = False
+        self.is_primary = False
+        self.is_secondary = False
+        self.rtt_ms = None              # Moving average of the round trip time
+        self.lag = None                 # Replication lag behind the primary (in seconds), if known
+
+    def __repr__(self):
+        role = "primary" if self.is_primary else "secondary" if self.is_secondary else "down" if not self.is_up else "other"
+        return "<Member %s:%s %s>" % (self.address[0], self.address[1], role)
+
+
+class ReplicaSet(object):
+    ''' Tracks the members of a replica set and selects which one to use '''
+
+    def __init__(self, seeds, pool_factory, set_name=None,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL, latency_window=DEFAULT_LATENCY_WINDOW):
+        ''' Create a new replica set
+        seeds:              List of (host, port) to discover the set from
+        pool_factory:       Function returning a connection pool to a given (host, port)
+        set_name:           Name of the replica set, members of other sets are ignored
+        refresh_interval:   Time (in seconds) between two checks of the members
+        latency_window:     Latency (in ms) above that of the nearest member within which members are still used
+        '''
+        self.seeds = list(seeds)
+        self.pool_factory = pool_factory
+        self.set_name = set_name
+        self.refresh_interval = refresh_interval
+        self.latency_window = latency_window
+        self.members = dict()
+        self.lock = threading.RLock()
+        self.last_refresh = None
+
+    ##  INTERNAL METHODS  #######################
+
+    def _get_member(self, address):
+        ''' Return the member at a given address, adding it if needed (must hold the lock) '''
+        member = self.members.get(address)
+        if member is None:
+            member = Member(address, self.pool_factory(address))
+            self.members[address] = member
+        return member
+
+    def _check(self, member):
+        ''' Update the state of a member, return the addresses of the set it knows of '''
+        try:
+            conn = member.pool.acquire()
+        except Exception:
+            member.is_up = member.is_primary = member.is_secondary = False
+            return list()
+        try:
+            start = time()
+            res = conn.admin.command("ismaster")
+            rtt = (time() - start) * 1000
+        except Exception:
+            member.pool.discard(conn)
+            member.is_up = member.is_primary = member.is_secondary = False
+            return list()
+        member.pool.release(conn)
+        if self.set_name and res.get('setName') != self.set_name:
+            # Not part of this replica set
+            member.is_up = member.is_primary = member.is_secondary = False
+            return list()
+        member.is_up = True
+        member.is_primary = bool(res.get('ismaster'))
+        member.is_secondary = bool(res.get('secondary'))
+        if member.rtt_ms is None:
+            member.rtt_ms = rtt
+        else:
+            member.rtt_ms = RTT_WEIGHT * rtt + (1 - RTT_WEIGHT) * member.rtt_ms
+        return res.get('hosts', list())
+
+    def _update_lags(self, primary):
+        ''' Update the replication lag of the members from the status of the set '''
+        for member in self.members.itervalues():
+            member.lag = 0 if member.is_primary else None
+        if primary is None:
+            return
+        try:
+            conn = primary.pool.acquire()
+        except Exception:
+            return
+        try:
+            status = conn.admin.command("replSetGetStatus")
+        except Exception:
+            # Lags stay unknown (e.g. not allowed to run the command)
+            primary.pool.release(conn)
+            return
+        primary.pool.release(conn)
+        optimes = dict()
+        for m in status.get('members', list()):
+            if m.get('optimeDate') is not None:
+                address = parse_hosts([m['name']], None)[0]
+                optimes[address] = m['optimeDate']
+        primary_optime = optimes.get(primary.address)
+        if primary_optime is None:
+            return
+        for address, optime in optimes.iteritems():
+            member = self.members.get(address)
+            if member is not None and not member.is_primary:
+                delta = primary_optime - optime
+                member.lag = max(0.0, delta.days * 86400 + delta.seconds + delta.microseconds / 1e6)
+
+    def _get_eligible(self, read_pref):
+        ''' Return the members a read preference allows to read from, in order of preference (must hold the lock) '''
+        primary = self.get_primary()
+        secondaries = [m for m in self.members.itervalues() if m.is_up and m.is_secondary]
+        if read_pref.max_lag is not None:
+            secondaries = [m for m in secondaries if m.lag is not None and m.lag <= read_pref.max_lag]
+        mode = read_pref.mode
+        if mode == PRIMARY:
+            return [primary] if primary else list()
+        elif mode == PRIMARY_PREFERRED:
+            return [primary] if primary else self._nearest(secondaries)
+        elif mode == SECONDARY:
+            return self._nearest(secondaries)
+        elif mode == SECONDARY_PREFERRED:
+            return self._nearest(secondaries) or ([primary] if primary else list())
+        return self._nearest(secondaries + ([primary] if primary else list()))
+
+    def _nearest(self, members):
+        ''' Return the members within the latency window of the nearest one '''
+        if not members:
+            return list()
+        fastest = min([m.rtt_ms for m in members])
+        return [m for m in members if m.rtt_ms <= fastest + self.latency_window]
+
+    ##  PUBLIC METHODS  #######################
+
+    def refresh(self):
+        ''' Check all known members and discover new ones '''
+        with self.lock:
+            to_check = list(self.seeds) + [a for a in self.members if a not in self.seeds]
+            checked = set()
+            while to_check:
+                address = to_check.pop(0)
+                if address in checked:
+                    continue
+                checked.add(address)
+                for host in self._check(self._get_member(address)):
+                    discovered = parse_hosts([host], address[1])[0]
+                    if discovered not in checked:
+                        to_check.append(discovered)
+            self._update_lags(self.get_primary())
+            self.last_refresh = time()
+
+    def request_refresh(self):
+        ''' Have the members checked again on next use (e.g. after a network error) '''
+        self.last_refresh = None
+
+    def get_primary(self):
+        ''' Return the current primary, or None '''
+        for member in self.members.values():
+            if member.is_up and member.is_primary:
+                return member
+        return None
+
+    def select(self, read_pref=None):
+        ''' Return the member to use for a given read preference (None for the primary) '''
+        read_pref = read_pref or ReadPreference()
+        with self.lock:
+            if self.last_refresh is None or time() - self.last_refresh >= self.refresh_interval:
+                self.refresh()
+            eligible = self._get_eligible(read_pref)
+            if not eligible and self.get_primary() is None:
+                # The primary may have just changed
+                self.refresh()
+                eligible = self._get_eligible(read_pref)
+        if not eligible:
+            raise ReplicaSetError("No member of the replica set matches %r" % read_pref)
+        return random.choice(eligible)
+
+    def close(self):
+        ''' Close the connection pools of all members '''
+        with self.lock:
+            for member in self.members.itervalues():
+                member.pool.close()
+            self.members = dict()
+            self.last_refresh = None
@@ -0,0 +1,215 @@
+'''
+Created on Oct 17, 2026
+
+Partitioned scans: a collection is split into _id ranges (with the
+server's split vector, or by sampling the _id index when it cannot
+compute one), and the ranges are read in parallel, each through its
+own cursor:
+
+    for venue in Venue.scan(partitions=8):
+        ...
+    counts = Venue.scan(partitions=8).map(count_tags, merge=add_counts, processes=True)
+
+Iterating yields results as partitions deliver them, in no particular
+order. map() calls a function on each chunk of results, on worker
+threads or, for CPU bound work, on worker processes (which open their
+own connections), and merges what it returns.
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from orm.db.database import Database
+from orm.db.async_query import QueryExecutor
+from orm.db.query import Query, ASCENDING
+from pymongo.errors import OperationFailure
+from Queue import Queue
+import multiprocessing
+import threading
+
+DEFAULT_PARTITIONS = 4
+DEFAULT_CHUNK_SIZE = 1000
+
+# Maximum number of chunks read ahead of the consumer, per partition
+READ_AHEAD = 2
+
+_DONE = object()
+
+
+def _with_range(conditions, lo, hi):
+    ''' Return the given conditions restricted to the ids in [lo, hi) (None for no bound) '''
+    id_range = dict()
+    if lo is not None:
+        id_range['$gte'] = lo
+    if hi is not None:
+        id_range['$lt'] = hi
+    if not id_range:
+        return conditions
+    if not conditions:
+        return { '_id': id_range }
+    return { '$and': [conditions, { '_id': id_range }] }
+
+def _init_process():
+    ''' Open the connections of a worker process '''
+    Database.reconnect()
+
+def _map_partition(args):
+    ''' Call a function on each chunk of a partition, in a worker process '''
+    scan, lo, hi, fn = args
+    return [fn(chunk) for chunk in scan._iter_chunks(lo, hi)]
+
+
+class PartitionedScan(object):
+    ''' Parallel iteration over the results of a query, partitioned by _id '''
+
+    def __init__(self, query, partitions=DEFAULT_PARTITIONS, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 model_class=None, fields=None):
+        ''' Create a new scan
+        query:          Query whose results are scanned (its sort and limit are ignored)
+        partitions:     Number of _id ranges to split the collection into
+        workers:        Number of partitions read at the same time, all of them by default
+        chunk_size:     Number of results per chunk
+        model_class:    Class to hydrate results into, if any
+        fields:         Fields the results are restricted to, if any
+        '''
+        self.query = query
+        self.partitions = max(1, partitions)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.model_class = model_class
+        self.fields = fields
+        self.ranges = None
+
+
+    ##  INTERNAL METHODS  #######################
+
+    def _get_collection_info(self):
+        ''' Return the database and full name of the scanned collection '''
+        q = self.query
+        return Database._get_db(q.alias), "%s.%s" % (Database._get_db_name(q.alias), q.col_name)
+
+    def _get_split_keys(self):
+        ''' Return the _id bounds of the partitions, as computed by the server '''
+        db, ns = self._get_collection_info()
+        size = db.command("collstats", self.query.col_name).get('size', 0)
+        if not size:
+            return list()
+        res = db.command("splitVector", ns, keyPattern={ '_id': ASCENDING },
+                         maxChunkSizeBytes=max(1, size / self.partitions))
+        return [k['_id'] for k in res.get('splitKeys', list())]
+
+    def _sample_split_keys(self):
+        ''' Return the _id bounds of the partitions, by walking the _id index '''
+        q = self.query
+        db, _ = self._get_collection_info()
+        col = db[q.col_name]
+        n = col.find(q.conditions or None).count()
+        keys = list()
+        for i in range(1, self.partitions):
+            cursor = col.find(q.conditions or None, { '_id': 1 }).sort("_id", ASCENDING).skip(i * n / self.partitions).limit(1)
+            for doc in cursor:
+                if not keys or doc['_id'] != keys[-1]:
+                    keys.append(doc['_id'])
+        return keys
+
+    def _iter_chunks(self, lo, hi):
+        ''' Generate the chunks of results of the partition [lo, hi) '''
+        src = self.query
+        q = Query(src.col_name, alias=src.alias).where(**_with_range(src.conditions, lo, hi))
+        q.read_pref = src.read_pref
+        if src.selected_fields:
+            q.select(*src.selected_fields)
+        if src.raw_mode:
+            q.raw()
+        chunk = list()
+        for doc in q.batch_size(self.chunk_size).cache(False).execute():
+            chunk.append(self.model_class._hydrate(doc, self.fields) if self.model_class else doc)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = list()
+        if chunk:
+            yield chunk
+
+    def _read_partition(self, lo, hi, queue, stop):
+        ''' Put the chunks of a partition on a queue, until done or told to stop '''
+        try:
+            for chunk in self._iter_chunks(lo, hi):
+                if stop.is_set():
+                    return
+                queue.put(chunk)
+        finally:
+            queue.put(_DONE)
+
+    def _run(self, fn, *args):
+        ''' Call a function on each range, on worker threads, and return the executor and the futures '''
+        ranges = self.get_ranges()
+        executor = QueryExecutor(min(self.workers or len(ranges), len(ranges)))
+        return executor, [executor.submit(fn, lo, hi, *args) for lo, hi in ranges]
+
+
+    ##  PUBLIC METHODS  #########################
+
+    def get_ranges(self):
+        ''' Return the [lo, hi) _id ranges of the partitions (None for no bound) '''
+        if self.ranges is None:
+            keys = list()
+            if self.partitions > 1:
+                try:
+                    keys = self._get_split_keys()
+                except OperationFailure:
+                    # Not allowed or not supported (e.g. sharded collection)
+                    keys = self._sample_split_keys()
+            bounds = [None] + keys + [None]
+            self.ranges = [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+        return self.ranges
+
+    def __iter__(self):
+        ''' Generate the results of all partitions as they are read '''
+        ranges = self.get_ranges()
+        queue = Queue(READ_AHEAD * len(ranges))
+        stop = threading.Event()
+        executor, futures = self._run(self._read_partition, queue, stop)
+        left = len(ranges)
+        try:
+            while left:
+                chunk = queue.get()
+                if chunk is _DONE:
+                    left -= 1
+                    continue
+                for item in chunk:
+                    yield item
+            for f in futures:
+                # Raise the errors of the partitions, if any
+                f.result()
+        finally:
+            stop.set()
+            while left:
+                # Unblock the partitions still reading
+                if queue.get() is _DONE:
+                    left -= 1
+            executor.shutdown()
+
+    def map(self, fn, merge=None, processes=False):
+        ''' Call a function on each chunk of results and return what it returns, in _id order
+        fn:           Function taking a list of results (must be a module level function with processes set)
+        merge:        Function merging two values returned by fn into one, to return a single value
+        processes:    Whether to run on worker processes instead of threads
+        '''
+        ranges = self.get_ranges()
+        if processes:
+            pool = multiprocessing.Pool(min(self.workers or len(ranges), len(ranges)), _init_process)
+            try:
+                results = pool.map(_map_partition, [(self, lo, hi, fn) for lo, hi in ranges])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            executor, futures = self._run(lambda lo, hi: [fn(chunk) for chunk in self._iter_chunks(lo, hi)])
+            try:
+                results = [f.result() for f in futures]
+            finally:
+                executor.shutdown()
+        results = sum(results, list())
+        if merge is not None:
+            return reduce(merge, results) if results else None
+        return results
@@ -0,0 +1,963 @@
+'''
+Created on Oct 17, 2026
+
+In-process stand-in for a MongoDB server, implementing the subset
+of the pyMongo API used by the ORM. Use it by setting
+
+    Database.connection_class = FakeConnection
+
+before calling Database.get_instance(). Replica sets are simulated with
+make_replica_set(): members share their data, writes to secondaries fail
+and the replication lag they report is set by hand.
+
+@requires: pyMongo (pip install pymongo)
+@author: Benjamin Dezile
+'''
+
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure, AutoReconnect, ConnectionFailure
+from bson.objectid import ObjectId
+from bson.son import SON
+from bson import BSON, decode_all
+from datetime import datetime, timedelta
+import threading
+import struct
+import copy
+import re
+
+ASCENDING = 1
+DESCENDING = -1
+_MISSING = object()
+
+PRIMARY = "PRIMARY"
+SECONDARY = "SECONDARY"
+DOWN = "DOWN"
+
+def _get_path(doc, path):
+    ''' Return the value at a dotted path in a document, or _MISSING '''
+    val = doc
+    for part in path.split("."):
+        if type(val) is dict and val.has_key(part):
+            val = val[part]
+        elif type(val) is list and part.isdigit() and int(part) < len(val):
+            val = val[int(part)]
+        else:
+            return _MISSING
+    return val
+
+def _set_path(doc, path, value):
+    ''' Set the value at a dotted path in a document '''
+    parts = path.split(".")
+    for part in parts[:-1]:
+        if type(doc) is list:
+            doc = doc[int(part)]
+        else:
+            doc = doc.setdefault(part, dict())
+    if type(doc) is list:
+        doc[int(parts[-1])] = value
+    else:
+        doc[parts[-1]] = value
+
+def _unset_path(doc, path):
+    ''' Remove the value at a dotted path in a document '''
+    parts = path.split(".")
+    for part in parts[:-1]:
+        if type(doc) is list:
+            doc = doc[int(part)] if part.isdigit() and int(part) < len(doc) else None
+        else:
+            doc = doc.get(part) if type(doc) is dict else None
+        if doc is None:
+            return
+    if type(doc) is dict and doc.has_key(parts[-1]):
+        del doc[parts[-1]]
+    elif type(doc) is list and parts[-1].isdigit() and int(parts[-1]) < len(doc):
+        # Array items are set to null rather than removed
+        doc[int(parts[-1])] = None
+
+def _compare(a, b):
+    ''' Compare two values, None and missing values coming first '''
+    if a is _MISSING:
+        a = None
+    if b is _MISSING:
+        b = None
+    return cmp(a, b)
+
+def _match_value(val, cond):
+    ''' Return whether a value satisfies a condition '''
+    if type(cond) is dict and cond and all([k.startswith("$") for k in cond]):
+        for op, arg in cond.iteritems():
+            if op == "$in":
+                if not any([_match_value(val, a) for a in arg]):
+                    return False
+            elif op == "$nin":
+                if any([_match_value(val, a) for a in arg]):
+                    return False
+            elif op == "$ne":
+                if _match_value(val, arg):
+                    return False
+            elif op == "$exists":
+                if (val is not _MISSING) != bool(arg):
+                    return False
+            elif op == "$regex":
+                if type(val) not in (str, unicode) or not re.search(arg, val):
+                    return False
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if val is _MISSING or val is None:
+                    return False
+                c = cmp(val, arg)
+                if (op == "$gt" and c <= 0) or (op == "$gte" and c < 0) or \
+                   (op == "$lt" and c >= 0) or (op == "$lte" and c > 0):
+                    return False
+            else:
+                raise OperationFailure("Unsupported operator: %s" % op)
+        return True
+    if type(val) is list and type(cond) is not list:
+        return cond in val
+    if val is _MISSING:
+        return cond is None
+    return val == cond
+
+def match(doc, spec):
+    ''' Return whether a document matches a query '''
+    for k, cond in (spec or dict()).iteritems():
+        if k == "$and":
+            if not all([match(doc, s) for s in cond]):
+                return False
+        elif k == "$or":
+            if not any([match(doc, s) for s in cond]):
+                return False
+        elif not _match_path(doc, k, cond):
+            return False
+    return True
+
+def _match_path(doc, path, cond):
+    ''' Return whether the value at a dotted path matches a condition, looking into arrays of documents '''
+    parts = path.split(".")
+    for i in range(1, len(parts)):
+        val = _get_path(doc, ".".join(parts[:i]))
+        if type(val) is list and not parts[i].isdigit():
+            rest = ".".join(parts[i:])
+            return any([type(item) is dict and _match_path(item, rest, cond) for item in val])
+    return _match_value(_get_path(doc, path), cond)
+
+def _resolve_positional(doc, spec, rules):
+    ''' Replace the positional operator in update paths with the index of the array item the query matched '''
+    if not any([k.startswith("$") for k in rules]):
+        return rules
+    resolved = dict()
+    for op, fields in rules.iteritems():
+        resolved[op] = dict()
+        for path, arg in fields.iteritems():
+            if ".$" in path:
+                prefix = path.split(".$", 1)[0]
+                items = _get_path(doc, prefix)
+                index = None
+                for k, cond in (spec or dict()).iteritems():
+                    if k.startswith(prefix + ".") and type(items) is list:
+                        for i in range(len(items)):
+                            if type(items[i]) is dict and _match_path(items[i], k[len(prefix) + 1:], cond):
+                                index = i
+                                break
+                    if index is not None:
+                        break
+                if index is None:
+                    raise OperationFailure("The positional operator did not find the match needed from the query")
+                path = path.replace(".$", ".%d" % index, 1)
+            resolved[op][path] = arg
+    return resolved
+
+def apply_update(doc, rules, is_insert=False):
+    ''' Apply update rules to a document '''
+    if not any([k.startswith("$") for k in rules]):
+        # Replacement
+        _id = doc.get("_id")
+        doc.clear()
+        doc.update(copy.deepcopy(rules))
+        if _id is not None:
+            doc["_id"] = _id
+        return
+    for op, fields in rules.iteritems():
+        for path, arg in fields.iteritems():
+            if op == "$set" or (op == "$setOnInsert" and is_insert):
+                _set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                cur = _get_path(doc, path)
+                _set_path(doc, path, (0 if cur is _MISSING else cur) + arg)
+            elif op in ("$push", "$addToSet"):
+                cur = _get_path(doc, path)
+                if cur is _MISSING:
+                    cur = list()
+                    _set_path(doc, path, cur)
+                items = arg["$each"] if type(arg) is dict and arg.has_key("$each") else [arg]
+                for item in items:
+                    if op == "$push" or item not in cur:
+                        cur.append(copy.deepcopy(item))
+            elif op == "$pull":
+                cur = _get_path(doc, path)
+                if type(cur) is list:
+                    if type(arg) is dict and not any([k.startswith("$") for k in arg]):
+                        # Condition on the fields of embedded documents
+                        cur[:] = [item for item in cur if not (type(item) is dict and match(item, arg))]
+                    else:
+                        cur[:] = [item for item in cur if not _match_value(item, arg)]
+            elif op != "$setOnInsert":
+                raise OperationFailure("Unsupported update operator: %s" % op)
+
+def project(doc, fields):
+    ''' Restrict a document to the given fields '''
+    if not fields:
+        return copy.deepcopy(doc)
+    if all([not v for v in fields.values()]):
+        res = copy.deepcopy(doc)
+        for k in fields:
+            _unset_path(res, k)
+        return res
+    res = dict()
+    if fields.get("_id", 1) and doc.has_key("_id"):
+        res["_id"] = doc["_id"]
+    for k, v in fields.iteritems():
+        if v and k != "_id":
+            val = _get_path(doc, k)
+            if val is not _MISSING:
+                _set_path(res, k, copy.deepcopy(val))
+    return res
+
+
+def _eval(doc, expr):
+    ''' Evaluate an aggregation expression (field paths, literals and documents of expressions) '''
+    if isinstance(expr, basestring) and expr.startswith("$"):
+        val = doc
+        for part in expr[1:].split("."):
+            if type(val) is list:
+                # Paths through arrays collect the values of their items
+                val = [item[part] for item in val if type(item) is dict and item.has_key(part)]
+            elif type(val) is dict and val.has_key(part):
+                val = val[part]
+            else:
+                return None
+        return copy.deepcopy(val)
+    if type(expr) is dict:
+        return dict([(k, _eval(doc, v)) for k, v in expr.iteritems()])
+    return expr
+
+def _accumulate(op, values):
+    ''' Apply a $group accumulator to the values of a group '''
+    if op == "$sum":
+        return sum([v for v in values if type(v) in (int, long, float)])
+    if op == "$avg":
+        values = [v for v in values if type(v) in (int, long, float)]
+        return float(sum(values)) / len(values) if values else None
+    if op in ("$min", "$max"):
+        values = [v for v in values if v is not None]
+        return (min if op == "$min" else max)(values) if values else None
+    if op == "$first":
+        return values[0] if values else None
+    if op == "$last":
+        return values[-1] if values else None
+    if op == "$push":
+        return values
+    if op == "$addToSet":
+        res = list()
+        for v in values:
+            if v not in res:
+                res.append(v)
+        return res
+    raise OperationFailure("Unsupported accumulator: %s" % op)
+
+def run_pipeline(docs, pipeline, get_collection):
+    ''' Return the results of an aggregation pipeline 
+    get_collection:    Function returning a collection of the same database given its name, for $lookup
+    '''
+    docs = [copy.deepcopy(d) for d in docs]
+    for stage in pipeline:
+        if len(stage) != 1:
+            raise OperationFailure("A pipeline stage specification object must contain exactly one field")
+        name, arg = stage.items()[0]
+        if name == "$match":
+            docs = [d for d in docs if match(d, arg)]
+        elif name == "$project":
+            res = list()
+            for d in docs:
+                out = project(d, dict([(k, v) for k, v in arg.iteritems() if v in (0, 1, True, False)]))
+                for k, v in arg.iteritems():
+                    if v not in (0, 1, True, False):
+                        _set_path(out, k, _eval(d, v))
+                res.append(out)
+            docs = res
+        elif name == "$group":
+            groups = list()
+            by_key = dict()
+            for d in docs:
+                key = _eval(d, arg["_id"])
+                frozen = repr(key)
+                if not by_key.has_key(frozen):
+                    by_key[frozen] = (key, list())
+                    groups.append(frozen)
+                by_key[frozen][1].append(d)
+            docs = list()
+            for frozen in groups:
+                key, members = by_key[frozen]
+                out = { '_id': key }
+                for k, acc in arg.iteritems():
+                    if k != "_id":
+                        op, expr = acc.items()[0]
+                        out[k] = _accumulate(op, [_eval(d, expr) for d in members])
+                docs.append(out)
+        elif name == "$unwind":
+            path = arg if isinstance(arg, basestring) else arg["path"]
+            keep = type(arg) is dict and arg.get("preserveNullAndEmptyArrays", False)
+            res = list()
+            for d in docs:
+                val = _get_path(d, path[1:])
+                if type(val) is list and val:
+                    for item in val:
+                        out = copy.deepcopy(d)
+                        _set_path(out, path[1:], item)
+                        res.append(out)
+                elif type(val) is not list and val is not _MISSING and val is not None:
+                    res.append(d)
+                elif keep:
+                    res.append(d)
+            docs = res
+        elif name == "$sort":
+            for field, direction in reversed(list(arg.items())):
+                docs.sort(lambda a, b: _compare(_get_path(a, field), _get_path(b, field)), reverse=(direction == DESCENDING))
+        elif name == "$skip":
+            docs = docs[arg:]
+        elif name == "$limit":
+            docs = docs[:arg]
+        elif name == "$lookup":
+            foreign = get_collection(arg["from"])._docs
+            for d in docs:
+                val = _get_path(d, arg["localField"])
+                d[arg["as"]] = [copy.deepcopy(f) for f in foreign
+                                if _compare(_get_path(f, arg["foreignField"]), val) == 0]
+        else:
+            raise OperationFailure("Unsupported pipeline stage: %s" % name)
+    return docs
+
+
+class FakeCommandCursor(object):
+    ''' Cursor over the results of an aggregation '''
+
+    def __init__(self, results):
+        self._results = results
+        self._pos = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._pos >= len(self._results):
+            raise StopIteration()
+        self._pos += 1
+        return self._results[self._pos - 1]
+
+
+class FakeCursor(object):
+    ''' Cursor over the documents of a fake collection '''
+
+    def __init__(self, collection, spec=None, fields=None, slave_okay=False):
+        self.collection = collection
+        self.spec = spec or dict()
+        self.fields = fields
+        self.slave_okay = slave_okay
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._batch_size = 0
+        self._results = None
+        self._pos = 0
+
+    def _check(self):
+        if self._results is not None:
+            raise OperationFailure("Cannot set options after executing query")
+
+    def _get_all(self):
+        ''' Return all matching documents, sorted but without skip/limit '''
+        docs = [d for d in self.collection._docs if match(d, self.spec)]
+        if self._sort:
+            for field, direction in reversed(self._sort):
+                docs.sort(lambda a, b: _compare(_get_path(a, field), _get_path(b, field)), reverse=(direction == DESCENDING))
+        return docs
+
+    def _execute(self):
+        if self._results is None:
+            self.collection._read(self.slave_okay)
+            docs = self._get_all()[self._skip:]
+            if self._limit:
+                docs = docs[:abs(self._limit)]
+            self._results = [project(d, self.fields) for d in docs]
+        return self._results
+
+    def sort(self, key, direction=None):
+        self._check()
+        if type(key) in (list, tuple):
+            self._sort = list(key)
+        else:
+            self._sort = [(key, direction if direction is not None else ASCENDING)]
+        return self
+
+    def skip(self, n):
+        self._check()
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._check()
+        self._limit = n
+        return self
+
+    def batch_size(self, n):
+        self._check()
+        self._batch_size = n
+        return self
+
+    def clone(self):
+        c = FakeCursor(self.collection, self.spec, self.fields, self.slave_okay)
+        c._sort = self._sort
+        c._skip = self._skip
+        c._limit = self._limit
+        c._batch_size = self._batch_size
+        return c
+
+    def count(self, with_limit_and_skip=False):
+        self.collection._read(self.slave_okay)
+        n = len(self._get_all())
+        if with_limit_and_skip:
+            n = max(0, n - self._skip)
+            if self._limit:
+                n = min(n, abs(self._limit))
+        return n
+
+    def distinct(self, field):
+        values = list()
+        for doc in self._get_all():
+            val = _get_path(doc, field)
+            for v in (val if type(val) is list else [val]):
+                if v is not _MISSING and v not in values:
+                    values.append(v)
+        return values
+
+    def explain(self):
+        n = self.count(True)
+        sort_fields = [f for f, _ in self._sort or list()]
+        for name, info in sorted(self.collection._indexes.items()):
+            if self.spec.has_key(info['key'][0][0]):
+                # Pretend the index narrows the scan down to the results, in order if it has the sort fields
+                index_fields = [f for f, _ in info['key']]
+                scan_and_order = not all([f in index_fields for f in sort_fields])
+                return { 'cursor': 'BtreeCursor %s' % name, 'n': n, 'nscanned': n, 'scanAndOrder': scan_and_order }
+        return { 'cursor': 'BasicCursor', 'n': n, 'nscanned': len(self.collection._docs), 'scanAndOrder': bool(sort_fields) }
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            c = self.clone()
+            c._skip = index.start or 0
+            if index.stop is not None:
+                c._limit = max(0, index.stop - (index.start or 0))
+                if c._limit == 0:
+                    c._results = list()
+            return c
+        c = self.clone()
+        c._skip = self._skip + index
+        c._limit = -1
+        res = c._execute()
+        if not res:
+            raise IndexError("no such item for Cursor instance")
+        return res[0]
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        res = self._execute()
+        if self._pos >= len(res):
+            raise StopIteration
+        self._pos += 1
+        return res[self._pos - 1]
+
+    def close(self):
+        self._results = list()
+        self._pos = 0
+
+
+class FakeBulkOperation(object):
+    ''' Bulk write builder of a fake collection '''
+
+    def __init__(self, collection, ordered):
+        self.collection = collection
+        self.ordered = ordered
+        self.ops = list()
+
+    def insert(self, doc):
+        self.ops.append(("insert", doc, None, False, False))
+
+    def find(self, spec):
+        return FakeBulkSelector(self, spec)
+
+    def execute(self):
+        res = { 'nInserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'nUpserted': 0,
+                'upserted': list(), 'writeErrors': list(), 'writeConcernErrors': list() }
+        for i in range(len(self.ops)):
+            kind, arg, rules, upsert, multi = self.ops[i]
+            try:
+                if kind == "insert":
+                    self.collection.insert(arg)
+                    res['nInserted'] += 1
+                elif kind == "update":
+                    r = self.collection.update(arg, rules, upsert, multi)
+                    if r.get('upserted') is not None:
+                        res['nUpserted'] += 1
+                        res['upserted'].append({ 'index': i, '_id': r['upserted'] })
+                    else:
+                        res['nMatched'] += r['n']
+                        res['nModified'] += r['nModified']
+                elif kind == "remove":
+                    res['nRemoved'] += self.collection.remove(arg, multi=multi)['n']
+            except OperationFailure, e:
+                res['writeErrors'].append({ 'index': i, 'code': e.code, 'errmsg': str(e), 'op': arg })
+                if self.ordered:
+                    break
+        if res['writeErrors']:
+            raise BulkWriteError(res)
+        return res
+
+
+class FakeBulkSelector(object):
+    ''' Selector of a fake bulk write builder '''
+
+    def __init__(self, bulk, spec):
+        self.bulk = bulk
+        self.spec = spec
+        self._upsert = False
+
+    def upsert(self):
+        self._upsert = True
+        return self
+
+    def update_one(self, rules):
+        self.bulk.ops.append(("update", self.spec, rules, self._upsert, False))
+
+    def update(self, rules):
+        self.bulk.ops.append(("update", self.spec, rules, self._upsert, True))
+
+    def remove_one(self):
+        self.bulk.ops.append(("remove", self.spec, None, False, False))
+
+    def remove(self):
+        self.bulk.ops.append(("remove", self.spec, None, False, True))
+
+
+class FakeCollection(object):
+    ''' Collection of a fake database '''
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._server = database.connection._server
+        self._reads = 0
+        self._writes = 0
+
+    @property
+    def _docs(self):
+        return self._server.get_storage(self.database.name, self.name)[0]
+
+    @property
+    def _indexes(self):
+        return self._server.get_storage(self.database.name, self.name)[1]
+
+    def __getitem__(self, name):
+        return self.database["%s.%s" % (self.name, name)]
+
+    def _read(self, slave_okay=False):
+        ''' Account for a read served by this member, which must be allowed on secondaries '''
+        self._server.check_up()
+        if self._server.state == SECONDARY and not slave_okay:
+            raise AutoReconnect("not master and slaveOk=false")
+        self._server.reads += 1
+        self._reads += 1
+
+    def _find_by_id(self, _id):
+        for doc in self._docs:
+            if doc.get("_id") == _id:
+                return doc
+        return None
+
+    def insert(self, doc_or_docs, continue_on_error=False, **kwargs):
+        self._server.check_writable()
+        with self.database.lock:
+            docs = doc_or_docs if type(doc_or_docs) is list else [doc_or_docs]
+            ids = list()
+            for doc in docs:
+                if not doc.has_key("_id"):
+                    doc["_id"] = ObjectId()
+                if self._find_by_id(doc["_id"]) is not None:
+                    if continue_on_error:
+                        continue
+                    raise DuplicateKeyError("E11000 duplicate key error index: %s.$_id_ dup key: { : %r }" % (self.name, doc["_id"]), 11000)
+                self._docs.append(copy.deepcopy(doc))
+                self._writes += 1
+                ids.append(doc["_id"])
+            return ids if type(doc_or_docs) is list else ids[0]
+
+    def save(self, doc, **kwargs):
+        if doc.has_key("_id") and self._find_by_id(doc["_id"]) is not None:
+            return self.update({ '_id': doc["_id"] }, doc)
+        return self.insert(doc)
+
+    def find(self, spec=None, fields=None, **kwargs):
+        if type(fields) in (list, tuple):
+            fields = dict([(f, 1) for f in fields])
+        slave_okay = bool(kwargs.get("slave_okay") or kwargs.get("read_preference"))
+        return FakeCursor(self, spec, fields, slave_okay)
+
+    def find_one(self, spec=None, fields=None, **kwargs):
+        if spec is not None and type(spec) is not dict:
+            spec = { '_id': spec }
+        for doc in self.find(spec, fields, **kwargs).limit(-1):
+            return doc
+        return None
+
+    def count(self):
+        self._read()
+        return len(self._docs)
+
+    def update(self, spec, rules, upsert=False, multi=False, **kwargs):
+        self._server.check_writable()
+        with self.database.lock:
+            n = 0
+            modified = 0
+            for doc in self._docs:
+                if match(doc, spec):
+                    before = copy.deepcopy(doc)
+                    apply_update(doc, _resolve_positional(doc, spec, rules))
+                    n += 1
+                    if doc != before:
+                        modified += 1
+                        self._writes += 1
+                    if not multi:
+                        break
+            res = { 'ok': 1, 'err': None, 'n': n, 'nModified': modified, 'updatedExisting': n > 0 }
+            if n == 0 and upsert:
+                doc = dict([(k, v) for k, v in spec.iteritems() if not k.startswith("$") and type(v) is not dict])
+                apply_update(doc, rules, True)
+                if not doc.has_key("_id"):
+                    doc["_id"] = ObjectId()
+                self._docs.append(doc)
+                self._writes += 1
+                res['n'] = 1
+                res['upserted'] = doc["_id"]
+            return res
+
+    def find_and_modify(self, query=None, update=None, upsert=False, sort=None, new=False, fields=None, remove=False, **kwargs):
+        self._server.check_writable()
+        with self.database.lock:
+            cursor = self.find(query)
+            if sort:
+                cursor.sort(sort.items() if type(sort) is dict else sort)
+            docs = cursor._get_all()
+            if not docs:
+                if upsert and update is not None:
+                    res = self.update(query or dict(), update, True)
+                    return project(self._find_by_id(res['upserted']), fields) if new else None
+                return None
+            doc = self._find_by_id(docs[0]["_id"])
+            before = project(doc, fields)
+            if remove:
+                self._docs.remove(doc)
+                return before
+            apply_update(doc, update)
+            self._writes += 1
+            return project(doc, fields) if new else before
+
+    def remove(self, spec=None, safe=None, multi=True, **kwargs):
+        self._server.check_writable()
+        with self.database.lock:
+            if spec is not None and type(spec) is not dict:
+                spec = { '_id': spec }
+            kept = list()
+            n = 0
+            for doc in self._docs:
+                if (multi or n == 0) and match(doc, spec):
+                    n += 1
+                else:
+                    kept.append(doc)
+            self._docs[:] = kept
+            self._writes += n
+            return { 'ok': 1, 'err': None, 'n': n }
+
+    def distinct(self, field):
+        return self.find().distinct(field)
+
+    def aggregate(self, pipeline, **kwargs):
+        self._read(bool(kwargs.get("slave_okay") or kwargs.get("read_preference")))
+        with self.database.lock:
+            results = run_pipeline(self._docs, pipeline, lambda name: self.database[name])
+        if kwargs.has_key("cursor"):
+            return FakeCommandCursor(results)
+        return { 'ok': 1.0, 'result': results }
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+    def initialize_ordered_bulk_op(self):
+        return FakeBulkOperation(self, True)
+
+    def initialize_unordered_bulk_op(self):
+        return FakeBulkOperation(self, False)
+
+    def ensure_index(self, key_or_list, **kwargs):
+        self._server.check_writable()
+        keys = key_or_list if type(key_or_list) is list else [(key_or_list, ASCENDING)]
+        name = kwargs.get("name") or "_".join(["%s_%s" % (k, d) for k, d in keys])
+        info = { 'key': list(keys) }
+        for opt in ("unique", "sparse", "background", "expireAfterSeconds"):
+            if kwargs.has_key(opt):
+                info[opt] = kwargs[opt]
+        self._indexes[name] = info
+        return name
+
+    create_index = ensure_index
+
+    def drop_index(self, name):
+        if self._indexes.has_key(name):
+            del self._indexes[name]
+
+    def index_information(self):
+        return copy.deepcopy(self._indexes)
+
+
+class FakeDatabase(object):
+    ''' Database of a fake server '''
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.lock = connection._server.lock
+        self._collections = dict()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if not self._collections.has_key(name):
+                self._collections[name] = FakeCollection(self, name)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def authenticate(self, user, pwd):
+        return True
+
+    def collection_names(self):
+        return [col for db, col in self.connection._server.storage if db == self.name]
+
+    def drop_collection(self, name):
+        with self.lock:
+            self.connection._server.drop_storage(self.name, name)
+            if self._collections.has_key(name):
+                del self._collections[name]
+
+    def command(self, name, *args, **kwargs):
+        if type(name) is dict:
+            name = name.keys()[0]
+        if name in ("ping", "ismaster", "isMaster", "replSetGetStatus"):
+            return self.connection._server.status(name)
+        if name == "collstats":
+            docs = self[args[0]]._docs
+            size = sum([len(BSON.encode(d)) for d in docs])
+            return { 'ok': 1.0, 'count': len(docs), 'size': size, 'avgObjSize': size / len(docs) if docs else 0 }
+        if name == "splitVector":
+            col = self[args[0].split(".", 1)[1]]
+            ids = sorted([d['_id'] for d in col._docs])
+            stats = self.command("collstats", col.name)
+            step = max(1, kwargs['maxChunkSizeBytes'] / max(1, stats['avgObjSize']))
+            return { 'ok': 1.0, 'splitKeys': [{ '_id': ids[i] } for i in range(step, len(ids), step)] }
+        raise OperationFailure("Unsupported command: %s" % name)
+
+    def eval(self, code):
+        return { 'db': self.name, 'collections': len(self.collection_names()) }
+
+
+class FakeServer(object):
+    ''' State of a fake server, shared by all the connections to it '''
+
+    def __init__(self, address):
+        self.address = address
+        self.lock = threading.RLock()
+        self.databases = dict()
+        self.storage = dict()           # (database, collection) -> (documents, indexes), shared by replica set members
+        self.connections = 0
+        self.reads = 0
+        self.set_name = None
+        self.members = [self]
+        self.state = PRIMARY
+        self.lag = 0                    # Replication lag reported by replSetGetStatus (in seconds)
+        self.cursors = dict()           # Cursor id -> documents left, for raw queries
+        self.last_cursor_id = 0
+
+    def get_storage(self, db_name, col_name):
+        ''' Return the documents and indexes of a collection '''
+        with self.lock:
+            key = (db_name, col_name)
+            if not self.storage.has_key(key):
+                self.storage[key] = (list(), { '_id_': { 'key': [('_id', ASCENDING)] } })
+            return self.storage[key]
+
+    def drop_storage(self, db_name, col_name=None):
+        ''' Drop the data of a collection, or of a whole database '''
+        with self.lock:
+            for key in self.storage.keys():
+                if key[0] == db_name and col_name in (None, key[1]):
+                    del self.storage[key]
+
+    def check_up(self):
+        if self.state == DOWN:
+            raise AutoReconnect("could not connect to %s:%s" % self.address)
+
+    def check_writable(self):
+        self.check_up()
+        if self.state != PRIMARY:
+            raise AutoReconnect("not master")
+
+    def status(self, name):
+        self.check_up()
+        if name == "ping":
+            return { 'ok': 1 }
+        hosts = ["%s:%s" % m.address for m in self.members]
+        if name == "replSetGetStatus":
+            if self.set_name is None:
+                raise OperationFailure("not running with --replSet")
+            now = datetime.utcnow()
+            return { 'ok': 1, 'set': self.set_name, 
+                     'members': [{ 'name': "%s:%s" % m.address, 'stateStr': m.state, 
+                                   'optimeDate': now - timedelta(seconds=m.lag) } 
+                                 for m in self.members if m.state != DOWN] }
+        res = { 'ok': 1, 'ismaster': self.state == PRIMARY, 'secondary': self.state == SECONDARY, 'hosts': hosts }
+        if self.set_name is not None:
+            res['setName'] = self.set_name
+        return res
+
+
+def make_replica_set(name, addresses):
+    ''' Set up fake servers at the given (host, port) as a replica set, the first one being the primary 
+    Return the servers, whose state (PRIMARY, SECONDARY or DOWN) and lag can be changed at will.
+    '''
+    servers = list()
+    with FakeConnection._lock:
+        for address in addresses:
+            if not FakeConnection.servers.has_key(address):
+                FakeConnection.servers[address] = FakeServer(address)
+            servers.append(FakeConnection.servers[address])
+    for server in servers:
+        server.set_name = name
+        server.members = servers
+        server.state = PRIMARY if server is servers[0] else SECONDARY
+        server.lock = servers[0].lock
+        server.storage = servers[0].storage
+    return servers
+
+
+class FakeConnection(object):
+    ''' Connection to a fake server, drop-in replacement for pymongo.Connection '''
+
+    servers = dict()
+    _lock = threading.Lock()
+
+    def __init__(self, host="localhost", port=27017, **kwargs):
+        self.host = host
+        self.port = port
+        with FakeConnection._lock:
+            address = (host, port)
+            if not FakeConnection.servers.has_key(address):
+                FakeConnection.servers[address] = FakeServer(address)
+            self._server = FakeConnection.servers[address]
+            if self._server.state == DOWN:
+                raise ConnectionFailure("could not connect to %s:%s" % address)
+            self._server.connections += 1
+        self.closed = False
+
+    @classmethod
+    def reset(cls):
+        ''' Forget about all fake servers and their data '''
+        with cls._lock:
+            cls.servers = dict()
+
+    def __getitem__(self, name):
+        with self._server.lock:
+            dbs = self._server.databases
+            if not dbs.has_key(name):
+                dbs[name] = FakeDatabase(self, name)
+            return dbs[name]
+
+    @property
+    def admin(self):
+        return self["admin"]
+
+    def database_names(self):
+        return self._server.databases.keys()
+
+    def drop_database(self, name):
+        with self._server.lock:
+            self._server.drop_storage(name)
+            if self._server.databases.has_key(name):
+                # Handles on the database stay usable, as with a real server
+                self._server.databases[name]._collections.clear()
+
+    def server_info(self):
+        return { 'version': '2.6.0-fake', 'ok': 1 }
+
+    def _send_message_with_response(self, message, _must_use_master=False, **kwargs):
+        ''' Answer a query or get more message, as sent over the wire '''
+        data = message[1]
+        op = struct.unpack("<i", data[12:16])[0]
+        ns_end = data.index("\x00", 20)
+        db_name, col_name = data[20:ns_end].split(".", 1)
+        server = self._server
+        if op == 2004:
+            flags, = struct.unpack("<i", data[16:20])
+            if server.state == SECONDARY and not flags & 4:
+                error = BSON.encode({ '$err': "not master and slaveOk=false" })
+                return (None, (struct.pack("<iqii", 2, 0, 0, 1) + error, None, None))
+            skip, n = struct.unpack("<ii", data[ns_end + 1:ns_end + 9])
+            # Conditions are decoded as dicts to be matched, the sort as SON to keep its order
+            docs = decode_all(data[ns_end + 9:])
+            spec = docs[0]
+            sort = None
+            if spec.has_key("$query"):
+                sort = decode_all(data[ns_end + 9:], SON)[0].get("$orderby")
+                spec = spec["$query"]
+            cursor = self[db_name][col_name].find(spec, docs[1] if len(docs) > 1 else None, slave_okay=bool(flags & 4))
+            if sort:
+                cursor.sort(sort.items())
+            left = list(cursor.skip(skip))
+        elif op == 2005:
+            n, cursor_id = struct.unpack("<iq", data[ns_end + 1:ns_end + 13])
+            with server.lock:
+                left = server.cursors.pop(cursor_id, None)
+            if left is None:
+                return (None, (struct.pack("<iqii", 1, 0, 0, 0), None, None))
+        else:
+            raise OperationFailure("Unsupported operation: %s" % op)
+        n = abs(n) or 101
+        batch = left[:n]
+        cursor_id = 0
+        if len(left) > n:
+            with server.lock:
+                server.last_cursor_id += 1
+                cursor_id = server.last_cursor_id
+                server.cursors[cursor_id] = left[n:]
+        response = struct.pack("<iqii", 0, cursor_id, 0, len(batch)) + "".join([BSON.encode(d) for d in batch])
+        return (None, (response, None, None))
+
+    def kill_cursors(self, cursor_ids):
+        with self._server.lock:
+            for cursor_id in cursor_ids:
+                self._server.cursors.pop(cursor_id, None)
+
+    def close(self):
+        self.closed = True
+
@@ -0,0 +1,86 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query, ASCENDING, DESCENDING
+from orm.core.base_object import BaseObject
+from orm.test.fake_mongo import FakeConnection
+
+class Show(BaseObject):
+    ''' Model class to aggregate over '''
+
+    _fields = ('city', 'score', 'tags')
+    _field_types = { 'city': 'str', 'score': 'int', 'tags': 'list' }
+    _col_name = 'shows'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.city = None
+        self.score = None
+        self.tags = None
+
+class TestAggregation(TestSuite):
+    ''' Test aggregation pipelines '''
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(12):
+            s = Show(True)
+            s.city = "city%d" % (k % 3)
+            s.score = k
+            s.tags = ["tag%d" % t for t in range(k % 4)]
+            s.save()
+        Query("cities").insert(_id="city0", name="Paris").execute()
+        Query("cities").insert(_id="city1", name="Lyon").execute()
+
+    def teardown(self):
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    @test_case
+    def test1_group(self):
+        ''' Test grouping documents matched with the query helpers '''
+        agg = Query("shows").where_gte(score=3).aggregate() \
+                .group("city", n=("sum", 1), total=("sum", "score"), best=("max", "score")) \
+                .sort("_id", ASCENDING)
+        self.assert_equal(agg.get_pipeline()[0], { '$match': { 'score': { '$gte': 3 } } })
+        res = list(agg.allow_disk_use().execute())
+        self.assert_equal(res, [{ '_id': 'city0', 'n': 3, 'total': 18, 'best': 9 },
+                                { '_id': 'city1', 'n': 3, 'total': 21, 'best': 10 },
+                                { '_id': 'city2', 'n': 3, 'total': 24, 'best': 11 }])
+        res = list(Query("shows").aggregate().match(Query("shows").where_lt(score=2)).group(n=("sum", 1)).execute())
+        self.assert_equal(res, [{ '_id': None, 'n': 2 }])
+
+    @test_case
+    def test2_unwind_lookup(self):
+        ''' Test unwinding arrays and joining other collections '''
+        res = list(Query("shows").aggregate().unwind("tags").group("tags", n=("sum", 1))
+                   .sort("n", DESCENDING).limit(2).execute())
+        self.assert_equal(res, [{ '_id': 'tag0', 'n': 9 }, { '_id': 'tag1', 'n': 6 }])
+        res = list(Query("shows").where(score=4).aggregate().lookup("cities", "city", "_id", "city_info")
+                   .project("score", name="$city_info.name").execute())
+        self.assert_equal(len(res), 1)
+        self.assert_equal(res[0]['name'], ["Lyon"])
+
+    @test_case
+    def test3_hydrate(self):
+        ''' Test hydrating results that have the shape of model objects '''
+        shows = list(Show.aggregate(city="city1").sort("score", ASCENDING).execute())
+        self.assert_equal([s.score for s in shows], [1, 4, 7, 10])
+        self.assert_equal(isinstance(shows[0], Show), True)
+        shows = list(Show.aggregate().project("score").limit(1).execute())
+        self.assert_equal(shows[0].is_partial(), True)
+        self.assert_equal(shows[0].city is not None, True)
+        res = list(Show.aggregate().group("city", n=("sum", 1)).execute())
+        self.assert_equal(type(res[0]), dict)
+
+if __name__ == "__main__":
+    TestAggregation().run()
@@ -0,0 +1,116 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.async_query import AsyncQuery, run_async
+from orm.core.base_object import BaseObject
+from orm.core.identity_map import IdentityMap, get_identity_map
+from orm.test.fake_mongo import FakeConnection
+import threading
+
+class TestAsyncQuery(TestSuite):
+    ''' Test non-blocking queries against an in-process fake server '''
+
+    N = 20
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(self.N):
+            Database.get_instance()['test'].insert({ 'param1': k, "param2": (k%2==0) })
+
+    def teardown(self):
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    @test_case
+    def test1_execute(self):
+        ''' Test running queries in the background '''
+        f1 = AsyncQuery("test").where(param2=True).execute()
+        f2 = AsyncQuery("test").count()
+        res = f1.result(5)
+        self.assert_equal(res.count(), self.N / 2)
+        self.assert_equal(f2.result(5), self.N)
+        self.assert_equal(AsyncQuery("test").where(param1=3).fetch_one().result(5)['param1'], 3)
+
+    @test_case
+    def test2_each(self):
+        ''' Test streaming results '''
+        items = list()
+        n = AsyncQuery("test").where_lt(param1=5).each(items.append).result(5)
+        self.assert_equal(n, 5)
+        self.assert_equal(sorted([item['param1'] for item in items]), range(5))
+
+    @test_case
+    def test3_writes_and_errors(self):
+        ''' Test writes and error propagation '''
+        AsyncQuery("test").where(param1=0).update(param2=False).result(5)
+        self.assert_equal(AsyncQuery("test").where(param2=True).count().result(5), self.N / 2 - 1)
+        q = AsyncQuery("test")
+        q.insert(_id=1).execute().result(5)
+        f = q.reset().insert(_id=1).execute()
+        self.assert_not_none(f.exception(5))
+        done = list()
+        f.add_done_callback(done.append)
+        self.assert_equal(done, [f])
+
+    @test_case
+    def test4_objects(self):
+        ''' Test saving and finding objects in the background '''
+        o = BaseObject(True)
+        o.save_async().result(5)
+        self.assert_equal(o.is_new(), False)
+        with IdentityMap():
+            o1 = BaseObject.find_async(o.get_id()).result(5)
+            o2 = BaseObject.find_one_by_async(_id=o.get_id()).result(5)
+            self.assert_equal(o1 is o2, True)
+        self.assert_equal(BaseObject.count_async().result(5), 1)
+
+    @test_case
+    def test5_callbacks(self):
+        ''' Test done callbacks touching shared state from a worker thread '''
+        BaseObject.delete_all()
+        Database.enable_query_cache()
+        try:
+            o = BaseObject(True)
+            o.save()
+            gate = threading.Event()
+            finished = threading.Event()
+            seen = dict()
+            with IdentityMap() as id_map:
+                mine = BaseObject.find(o.get_id())
+                def callback(f):
+                    try:
+                        seen['thread'] = threading.current_thread()
+                        seen['map'] = get_identity_map()
+                        with id_map:
+                            seen['obj'] = BaseObject.find(o.get_id())
+                        seen['counts'] = [BaseObject.count(), BaseObject.count()]
+                    finally:
+                        finished.set()
+                # Hold the operation until the callback is registered so that it runs on the worker
+                f = run_async(gate.wait, 5)
+                f.add_done_callback(callback)
+                gate.set()
+                self.assert_equal(finished.wait(5), True)
+                self.assert_equal(seen['thread'] is threading.current_thread(), False)
+                self.assert_equal(seen['map'], None)
+                self.assert_equal(seen['obj'] is mine, True)
+            self.assert_equal(seen['counts'], [1, 1])
+            self.assert_equal(Database.query_cache.hits, 1)
+            # Writes from this thread invalidate what the callback cached
+            BaseObject(True).save()
+            self.assert_equal(BaseObject.count(), 2)
+        finally:
+            Database.enable_query_cache(False)
+            BaseObject.delete_all()
+
+if __name__ == "__main__":
+    TestAsyncQuery().run()
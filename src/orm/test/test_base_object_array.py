@@ -0,0 +1,123 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.core.base_object import BaseObject
+from orm.core.base_object_array import BaseObjectArray
+
+class Record(BaseObject):
+    ''' Model class synced from an external source '''
+
+    _fields = ('source', 'external_id', 'name')
+    _field_types = { 'source': 'str', 'external_id': 'int', 'name': 'str' }
+    _col_name = 'records'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new, timestampable=True)
+        self.source = None
+        self.external_id = None
+        self.name = None
+
+def make_record(source, external_id, name):
+    ''' Create a new record '''
+    r = Record(True)
+    r.source = source
+    r.external_id = external_id
+    r.name = name
+    return r
+
+class TestBaseObjectArray(TestSuite):
+    ''' Test bulk operations on arrays of objects '''
+
+    N = 25
+
+    def teardown(self):
+        BaseObject.delete_all()
+
+    @test_case
+    def test1_bulk_insert(self):
+        ''' Test inserting new objects in several batches '''
+        objs = BaseObjectArray([BaseObject(True) for _ in range(self.N)])
+        res = objs.save(max_batch_docs=10)
+        self.assert_equal(res.ok(), True)
+        self.assert_equal(res.n_inserted, self.N)
+        self.assert_equal(BaseObject.count(), self.N)
+        for o in objs:
+            self.assert_equal(o.is_new(), False)
+
+    @test_case
+    def test2_mixed_writes(self):
+        ''' Test a mix of inserts, updates and deletes '''
+        objs = BaseObjectArray(BaseObject.find_all())
+        removed = objs[0]
+        objs.discard(removed)
+        objs[1].set_deleted(1)
+        objs.append(BaseObject(True))
+        res = objs.save()
+        self.assert_equal(res.ok(), True)
+        self.assert_equal(res.n_inserted, 1)
+        self.assert_equal(res.n_matched, 1)
+        self.assert_equal(res.n_deleted, 1)
+        self.assert_equal(BaseObject.find(removed.get_id()), None)
+        self.assert_equal(BaseObject.find(objs[1].get_id()).get_deleted(), 1)
+
+    @test_case
+    def test3_errors(self):
+        ''' Test per-object errors in unordered mode '''
+        o = BaseObject(True)
+        o.save()
+        dup = BaseObject(True)
+        dup.set_id(o.get_id())
+        objs = BaseObjectArray([dup, BaseObject(True)])
+        res = objs.save(ordered=False)
+        self.assert_equal(len(res.errors), 1)
+        self.assert_equal(res.errors[0].obj is dup, True)
+        self.assert_equal(res.n_inserted, 1)
+        self.assert_equal(dup.is_new(), True)
+
+    @test_case
+    def test4_bulk_delete(self):
+        ''' Test deleting objects in bulk '''
+        objs = BaseObjectArray(BaseObject.find_all())
+        res = objs.delete(max_batch_docs=7)
+        self.assert_equal(res.n_deleted, len(objs))
+        self.assert_equal(BaseObject.count(), 0)
+
+    @test_case
+    def test5_upsert(self):
+        ''' Test upserting objects keyed on natural fields '''
+        Record.delete_all()
+        existing = make_record("crm", 1, "Old")
+        existing.created = 100
+        existing.save()
+        objs = [make_record("crm", k, "Record %d" % k) for k in range(4)]
+        res = Record.upsert_many(objs, key=('source', 'external_id'), max_batch_docs=3)
+        self.assert_equal(res.ok(), True)
+        self.assert_equal(res.n_upserted, 3)
+        self.assert_equal(res.n_matched, 1)
+        self.assert_equal(res.n_modified, 1)
+        self.assert_equal(str(res), "0 inserted, 3 upserted, 1 matched, 1 modified, 0 deleted, 0 errors, 0 skipped")
+        self.assert_equal(Record.count(), 4)
+        res = Record.upsert_many([make_record("crm", 3, "Record 3")], key=('source', 'external_id'))
+        self.assert_equal(res.n_matched, 1)
+        self.assert_equal(res.n_modified, 0)
+        self.assert_equal(str(res), "0 inserted, 0 upserted, 1 matched, 0 modified, 0 deleted, 0 errors, 0 skipped")
+        self.assert_equal(objs[1].get_id(), existing.get_id())
+        self.assert_equal(objs[1].created, 100)
+        self.assert_equal(Record.find(existing.get_id()).name, "Record 1")
+        self.assert_equal(Record.find(objs[2].get_id()).name, "Record 2")
+        for o in objs:
+            self.assert_equal(o.is_new(), False)
+        objs[0].name = "Renamed"
+        self.assert_equal(objs[0]._get_update_rules(), { '$set': { 'name': "Renamed" } })
+        res = Record.upsert_many([make_record("crm", 0, "Again"), make_record("crm", None, "No key")], key=('source', 'external_id'))
+        self.assert_equal(len(res.errors), 1)
+        self.assert_equal(res.n_matched, 0)
+        Record.delete_all()
+
+if __name__ == "__main__":
+    TestBaseObjectArray().run()
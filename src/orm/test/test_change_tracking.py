@@ -0,0 +1,204 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.core.base_object import BaseObject, Serializable
+from orm.core.change_tracking import diff_documents
+from orm.db.query import Query
+from orm.test.fake_mongo import FakeConnection
+import orm.core.base_object
+
+class Address(Serializable):
+    ''' Embedded class, as generated by build_model '''
+
+    _fields = ('city', 'zip')
+    _field_types = { 'city': 'str', 'zip': 'int' }
+    _embedded = True
+
+    def __init__(self):
+        Serializable.__init__(self)
+        self.city = None
+        self.zip = None
+
+class Customer(BaseObject):
+    ''' Model class, as generated by build_model '''
+
+    _fields = ('name', 'address', 'tags', 'orders', 'visits')
+    _field_types = { 'name': 'str', 'address': 'Address', 'tags': 'list[str]', 'orders': 'list[Address]', 'visits': 'int' }
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new, True)
+        self.name = None
+        self.address = None
+        self.tags = None
+        self.orders = None
+        self.visits = None
+
+class TestChangeTracking(TestSuite):
+    ''' Test change tracking by snapshot diffing '''
+
+    def setup(self):
+        orm.core.base_object.Address = Address
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+
+    def teardown(self):
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _make_customer(self):
+        c = Customer(True)
+        c.name = "Customer"
+        c.address = Address()
+        c.address.city = "Paris"
+        c.address.zip = 75001
+        c.tags = ["a", "b"]
+        c.save()
+        return Customer.find(c.get_id())
+
+    @test_case
+    def test1_diff(self):
+        ''' Test computing minimal update rules '''
+        old = { '_id': 1, 'a': 1, 'b': { 'c': 1, 'd': 2 }, 'e': [1, 2], 'f': [{ 'g': 1 }], 'h': 1 }
+        new = { 'id': 1, 'a': 1, 'b': { 'c': 1, 'd': 3 }, 'e': [1, 2, 3], 'f': [{ 'g': 2 }] }
+        rules = diff_documents(old, new)
+        self.assert_equal(rules, { '$set': { 'b.d': 3, 'f.0.g': 2 }, '$unset': { 'h': 1 }, '$push': { 'e': { '$each': [3] } } })
+        self.assert_equal(diff_documents(old, old), dict())
+        self.assert_equal(diff_documents({ 'e': [1, 2] }, { 'e': [2] }), { '$set': { 'e': [2] } })
+
+    @test_case
+    def test2_hydration(self):
+        ''' Test that loaded and saved objects have no changes '''
+        c = self._make_customer()
+        self.assert_equal(c.has_changes(), False)
+        self.assert_equal(c.update(), None)
+        c.tags.append("c")
+        self.assert_equal(c.get_changed_fields(), set(["tags"]))
+        # Lists are not shared with the snapshot
+        self.assert_equal(c._snapshot['tags'], ["a", "b"])
+
+    @test_case
+    def test3_nested_updates(self):
+        ''' Test persisting nested changes '''
+        c = self._make_customer()
+        c.address.city = "Lyon"
+        c.tags.append("c")
+        c.orders = [Address()]
+        self.assert_equal(c._get_update_rules(), { '$set': { 'address.city': u'Lyon', 'orders': [{ '_class': 'Address' }] },
+                                                   '$push': { 'tags': { '$each': [u'c'] } } })
+        c.save()
+        self.assert_equal(c.has_changes(), False)
+        c2 = Customer.find(c.get_id())
+        self.assert_equal(c2.address.city, "Lyon")
+        self.assert_equal(c2.address.zip, 75001)
+        self.assert_equal(c2.tags, ["a", "b", "c"])
+        c2.address = None
+        c2.save()
+        c3 = Customer.find(c.get_id())
+        self.assert_equal(c3.address, None)
+        self.assert_equal(c3.name, "Customer")
+
+    @test_case
+    def test4_refresh(self):
+        ''' Test that refreshing discards local changes '''
+        c = self._make_customer()
+        c.name = "Other"
+        c.refresh()
+        self.assert_equal(c.name, "Customer")
+        self.assert_equal(c.address.city, "Paris")
+        self.assert_equal(c.has_changes(), False)
+
+    @test_case
+    def test5_atomic_operations(self):
+        ''' Test batching atomic operations into a single update '''
+        c = self._make_customer()
+        c.incr("visits").incr("visits", 2).incr("address.zip")
+        c.push("tags", "c", "d")
+        self.assert_equal(c.visits, 3)
+        self.assert_equal(c.tags, ["a", "b", "c", "d"])
+        self.assert_equal(c._get_update_rules(), { '$inc': { 'visits': 3, 'address.zip': 1 }, 
+                                                   '$push': { 'tags': { '$each': ["c", "d"] } } })
+        # Concurrent change
+        Customer.find(c.get_id()).incr("visits", 10).save()
+        c.save()
+        self.assert_equal(c.has_changes(), False)
+        c2 = Customer.find(c.get_id())
+        self.assert_equal(c2.visits, 13)
+        self.assert_equal(c2.address.zip, 75002)
+        self.assert_equal(c2.tags, ["a", "b", "c", "d"])
+        c2.add_to_set("tags", "a", "e")
+        c2.pull("tags", "b")
+        c2.name = "Other"
+        self.assert_equal(c2._get_update_rules(), { '$set': { 'name': "Other", 'tags': ["a", "c", "d", "e"] } })
+        c2.save()
+        self.assert_equal(Customer.find(c.get_id()).tags, ["a", "c", "d", "e"])
+
+    @test_case
+    def test6_return_new(self):
+        ''' Test syncing an object with the result of its atomic operations '''
+        c = self._make_customer()
+        c2 = Customer.find(c.get_id())
+        c2.incr("visits", 5).save()
+        c.incr("visits")
+        c.add_to_set("tags", "x")
+        doc = c.save(True)
+        self.assert_equal(doc['visits'], 6)
+        self.assert_equal(c.visits, 6)
+        self.assert_equal(c.tags, ["a", "b", "x"])
+        self.assert_equal(c.has_changes(), False)
+
+    @test_case
+    def test7_shared_document(self):
+        ''' Test that objects hydrated from the same document do not share their snapshots '''
+        doc = { '_id': 1, 'name': "Customer", 'visits': 1, 'tags': ["a"] }
+        c = Customer.from_dict(doc)
+        c2 = Customer.from_dict(doc)
+        c.incr("visits")
+        self.assert_equal(doc, { '_id': 1, 'name': "Customer", 'visits': 1, 'tags': ["a"] })
+        self.assert_equal(c2._snapshot, doc)
+        self.assert_equal(c2.has_changes(), False)
+
+    @test_case
+    def test8_operations_on_shared_document(self):
+        ''' Test that atomic operations leave other objects hydrated from the same document alone '''
+        c = Customer(True)
+        c.name = "Customer"
+        c.visits = 1
+        c.tags = [u"a"]
+        c.save()
+        doc = Customer.find(c.get_id())._snapshot
+        c1 = Customer.from_dict(doc)
+        c2 = Customer.from_dict(doc)
+        c1.incr("visits")
+        c1.push("tags", u"b")
+        self.assert_equal((doc['visits'], doc['tags']), (1, [u"a"]))
+        self.assert_equal(c2.has_changes(), False)
+        c1.save()
+        c2.name = "Other"
+        self.assert_equal(c2._get_update_rules(), { '$set': { 'name': "Other" } })
+        c2.save()
+        c3 = Customer.find(c.get_id())
+        self.assert_equal((c3.name, c3.visits, c3.tags), ("Other", 2, [u"a", u"b"]))
+
+    @test_case
+    def test9_private_keys(self):
+        ''' Test that stored keys starting with an underscore are left alone by updates '''
+        c = self._make_customer()
+        Query(Customer).where(_id=c.get_id()).update(_meta={ 'source': "import" })
+        c = Customer.find(c.get_id())
+        self.assert_equal(c.has_changes(), False)
+        c.visits = 2
+        self.assert_equal(c._get_update_rules(), { '$set': { 'visits': 2 } })
+        c.save()
+        doc = Query(Customer).where(_id=c.get_id()).fetch_one()
+        self.assert_equal((doc['visits'], doc['_meta']), (2, { 'source': "import" }))
+
+if __name__ == "__main__":
+    TestChangeTracking().run()
@@ -0,0 +1,88 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database, DBInitError
+from orm.db.query import Query
+from orm.core.base_object import BaseObject
+from orm.core.base_object_array import BaseObjectArray
+from orm.test.fake_mongo import FakeConnection
+
+class Event(BaseObject):
+    ''' Model class living in a collection of its own, on another server '''
+
+    _fields = ('kind',)
+    _field_types = { 'kind': 'str' }
+    _col_name = 'events'
+    _db_alias = 'events'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.kind = None
+
+class TestDatabase(TestSuite):
+    ''' Test registering several databases '''
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        Database.get_instance("events", host="events-host", db_name="events_db")
+
+    def teardown(self):
+        Database.remove_instance("events")
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _docs(self, host, db_name, col_name):
+        ''' Return the documents stored in a collection of a fake server '''
+        return FakeConnection(host)[db_name][col_name]._docs
+
+    @test_case
+    def test1_aliases(self):
+        ''' Test that queries go to the database registered under their alias '''
+        Query("test").insert(param1=1).execute()
+        Query("test", alias="events").insert(param1=2).execute()
+        self.assert_equal(Query("test").where(param1=2).count(), 0)
+        self.assert_equal(Query("test", alias="events").where(param1=2).count(), 1)
+        self.assert_equal(len(self._docs("events-host", "events_db", "test")), 1)
+        self.assert_equal(sorted(Database.get_aliases()), ["default", "events"])
+        try:
+            Query("test", alias="unknown").count()
+            self.assert_equal("counted", "not registered")
+        except DBInitError:
+            pass
+
+    @test_case
+    def test2_model_classes(self):
+        ''' Test storing objects in the database and collection declared by their class '''
+        e = Event(True)
+        e.kind = "click"
+        e.save()
+        BaseObjectArray([Event(True), Event(True)]).save()
+        self.assert_equal(Event.count(), 3)
+        self.assert_equal(Event.find(e.get_id()).kind, "click")
+        e.kind = "view"
+        e.save()
+        self.assert_equal(Event.find_by(kind="view")[0].get_id(), e.get_id())
+        self.assert_equal(len(self._docs("events-host", "events_db", "events")), 3)
+        self.assert_equal(Query("events").count(), 0)
+
+    @test_case
+    def test3_reconnect(self):
+        ''' Test that reconnecting a database leaves the others alone '''
+        db = Database.get_instance()
+        pool = Database._get_alias().pool
+        Database.get_instance("events", host="events-host", db_name="events_db")
+        self.assert_equal(Database.get_instance() is db, True)
+        self.assert_equal(Database._get_alias().pool is pool, True)
+        self.assert_equal(Query("test").where(param1=1).count(), 1)
+        self.assert_equal(Event.count(), 3)
+
+if __name__ == "__main__":
+    TestDatabase().run()
@@ -0,0 +1,163 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query
+from orm.core.base_object import BaseObject
+from orm.core.base_object_array import BaseObjectArray
+from orm.core.build_model import get_embedding_relations, _make_relations_code, _make_relational_getter_code
+from orm.test.fake_mongo import FakeConnection
+import orm.core.base_object
+
+class Member(BaseObject):
+    ''' Model class whose objects are embedded by relations '''
+
+    _fields = ('name', 'avatar', 'email')
+    _field_types = { 'name': 'str', 'avatar': 'str', 'email': 'str' }
+    _col_name = 'members'
+    _embedded_in = (('Post', 'author'), ('Post', 'reviewers'))
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.name = None
+        self.avatar = None
+        self.email = None
+
+class Post(BaseObject):
+    ''' Model class embedding copies of related objects '''
+
+    _fields = ('title', 'author_id', 'author_embed', 'reviewer_ids', 'reviewers_embed')
+    _field_types = { 'title': 'str', 'author_id': None, 'author_embed': 'dict', 'reviewer_ids': 'list', 'reviewers_embed': 'list' }
+    _relations = {
+        'author': { 'class': 'Member', 'local': 'author_id', 'foreign': '_id', 'multi': False,
+                    'embed': ('name', 'avatar', ), 'embed_field': 'author_embed' },
+        'reviewers': { 'class': 'Member', 'local': 'reviewer_ids', 'foreign': '_id', 'multi': True,
+                       'embed': ('name', ), 'embed_field': 'reviewers_embed' },
+    }
+    _col_name = 'posts'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.title = None
+        self.author_id = None
+        self.author_embed = None
+        self.reviewer_ids = None
+        self.reviewers_embed = None
+
+    def set_author_id(self, val):
+        self.author_id = val
+
+    def set_reviewer_ids(self, val):
+        self.reviewer_ids = val
+
+    def get_author(self, full=False):
+        return self._get_related('Member', self.author_id, '_id', 'author', not full)
+
+    def set_author(self, obj):
+        return self._set_related(obj, 'author_id', '_id', 'author')
+
+    def get_reviewers(self, full=False):
+        return self._get_related_array('Member', self.reviewer_ids, '_id', 'reviewers', not full)
+
+    def set_reviewers(self, objs):
+        return self._set_related_array(objs, 'reviewer_ids', '_id', 'reviewers')
+
+def make_member(name):
+    ''' Create and save a new member '''
+    m = Member(True)
+    m.name = name
+    m.avatar = "%s.png" % name.lower()
+    m.email = "%s@example.com" % name.lower()
+    m.save()
+    return m
+
+class TestEmbeddedRelations(TestSuite):
+    ''' Test relations embedding copies of the related objects '''
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        orm.core.base_object.Member = Member
+        orm.core.base_object.Post = Post
+
+    def teardown(self):
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _make_post(self, author, reviewers):
+        ''' Create and save a new post, read back from the database '''
+        p = Post(True)
+        p.title = "Hello"
+        p.set_author(author)
+        p.set_reviewers(reviewers)
+        p.save()
+        return Post.find(p.get_id())
+
+    @test_case
+    def test1_getters(self):
+        ''' Test getting related objects from their embedded copies '''
+        ann, bob = make_member("Ann"), make_member("Bob")
+        post = self._make_post(ann, [ann, bob])
+        self.assert_equal(post.author_embed, { '_id': ann.get_id(), 'name': "Ann", 'avatar': "ann.png" })
+        # Gone from the database, still served from the copies
+        Query("members").where(_id=bob.get_id()).delete()
+        author = post.get_author()
+        self.assert_equal(author.is_partial(), True)
+        self.assert_equal((author.get_id(), author.name, author.avatar), (ann.get_id(), "Ann", "ann.png"))
+        self.assert_equal([m.name for m in post.get_reviewers()], ["Ann", "Bob"])
+        self.assert_equal(author.email, "ann@example.com")
+        self.assert_equal(post.get_author(True).is_partial(), False)
+        self.assert_equal(len(post.get_reviewers(True)), 1)
+        # Stale copy after the reference changed on its own
+        post.set_author_id(bob.get_id())
+        self.assert_equal(post.get_author(), None)
+
+    @test_case
+    def test2_fan_out(self):
+        ''' Test refreshing the embedded copies when the related objects change '''
+        Query("posts").delete()
+        ann, bob = make_member("Ann"), make_member("Bob")
+        posts = [self._make_post(ann, [bob, ann]) for _ in range(3)]
+        ann.name = "Anna"
+        ann.save()
+        for p in Post.find_all():
+            self.assert_equal(p.get_author().name, "Anna")
+            self.assert_equal([m.name for m in p.get_reviewers()], ["Bob", "Anna"])
+            self.assert_equal(p.get_author().avatar, "ann.png")
+        ann.email = "anna@example.com"
+        self.assert_equal(ann._get_update_rules(), { '$set': { 'email': "anna@example.com" } })
+        ann.save()
+        bob.name = "Robert"
+        BaseObjectArray([bob]).save()
+        self.assert_equal(Post.find(posts[0].get_id()).reviewers_embed[0], { '_id': bob.get_id(), 'name': "Robert" })
+        # Missing copies are filled in by a full refresh
+        Query("posts").where(_id=posts[0].get_id()).unset("author_embed").update()
+        self.assert_equal(ann.update_embedded_copies(), 3 + 3)
+        self.assert_equal(Post.find(posts[0].get_id()).author_embed['name'], "Anna")
+        bob.delete()
+        for p in Post.find_all():
+            self.assert_equal([m.name for m in p.get_reviewers()], ["Anna"])
+            self.assert_equal(p.get_author().name, "Anna")
+
+    @test_case
+    def test3_build_model(self):
+        ''' Test generating relations embedding copies '''
+        model = { 'Member': { 'fields': dict() },
+                  'Post': { 'relations': { 'author': { 'class': 'Member', 'local': 'author_id', 'foreign': 'id', 'embed': ['name'] },
+                                           'editor': { 'class': 'Member', 'local': 'editor_id', 'foreign': 'id' } } } }
+        self.assert_equal(get_embedding_relations(model), { 'Member': [('Post', 'author')] })
+        code = _make_relations_code(model['Post']['relations'])
+        self.assert_equal(eval(code.split("=", 1)[1])['author']['embed_field'], "author_embed")
+        code = _make_relational_getter_code('author', model['Post']['relations']['author'])
+        self.assert_equal(code.split("\n")[0], "    def get_author(self, full=False):")
+        self.assert_equal(code.split("\n")[2].strip(), "return self._get_related('Member', ref, '_id', 'author', not full)")
+
+if __name__ == "__main__":
+    TestEmbeddedRelations().run()
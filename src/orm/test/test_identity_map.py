@@ -0,0 +1,69 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.core.base_object import BaseObject
+from orm.core.identity_map import IdentityMap, get_identity_map
+import gc
+
+class TestIdentityMap(TestSuite):
+    ''' Test the identity map '''
+
+    def teardown(self):
+        BaseObject.delete_all()
+
+    @test_case
+    def test1_scope(self):
+        ''' Test activating and deactivating identity maps '''
+        self.assert_equal(get_identity_map(), None)
+        with IdentityMap() as m1:
+            self.assert_equal(get_identity_map() is m1, True)
+            with IdentityMap() as m2:
+                self.assert_equal(get_identity_map() is m2, True)
+            self.assert_equal(get_identity_map() is m1, True)
+        self.assert_equal(get_identity_map(), None)
+
+    @test_case
+    def test2_single_instance(self):
+        ''' Test that the same id resolves to the same instance '''
+        o = BaseObject(True)
+        o.save()
+        with IdentityMap(weak=False):
+            o1 = BaseObject.find(o.get_id())
+            o2 = BaseObject.find(o.get_id())
+            o3 = BaseObject.find_one_by(_id=o.get_id())
+            self.assert_equal(o1 is o2, True)
+            self.assert_equal(o1 is o3, True)
+            self.assert_equal(o1 is o, False)
+        self.assert_equal(BaseObject.find(o.get_id()) is o1, False)
+
+    @test_case
+    def test3_weak_references(self):
+        ''' Test that weakly held instances are dropped when unused '''
+        m = IdentityMap()
+        o = BaseObject(True)
+        m.add(o)
+        self.assert_equal(len(m), 1)
+        del o
+        gc.collect()
+        self.assert_equal(len(m), 0)
+
+    @test_case
+    def test4_flush_and_clear(self):
+        ''' Test flushing changes and clearing the map '''
+        with IdentityMap(weak=False) as m:
+            o = BaseObject(True)
+            m.add(o)
+            res = m.flush()
+            self.assert_equal(res.n_inserted, 1)
+            self.assert_equal(o.is_new(), False)
+            m.clear()
+            self.assert_equal(len(m), 0)
+            self.assert_equal(BaseObject.find(o.get_id()) is o, False)
+
+if __name__ == "__main__":
+    TestIdentityMap().run()
@@ -0,0 +1,128 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query, DESCENDING
+from orm.db import instrumentation
+from orm.db.indexes import get_model_indexes, CREATE, REPLACE, SKIP
+from orm.db.index_advisor import IndexAdvisor, get_filter_fields, is_in_memory_sort
+from orm.test.fake_mongo import FakeConnection
+
+MODEL = { 'Venue': { 'collection': 'venues',
+                     'fields': { 'name': { 'type': 'str', 'required': True, 'index': 1 },
+                                 'city': { 'type': 'str', 'required': True },
+                                 'score': { 'type': 'int', 'required': False },
+                                 'created': { 'type': 'int', 'required': True } },
+                     'indexes': [{ 'fields': ['city', '-created'], 'unique': True, 'sparse': True },
+                                 { 'fields': 'expires', 'ttl': 3600 }] },
+          'Address': { 'as': { 'embedded': None },
+                       'fields': { 'zip': { 'type': 'int', 'required': True, 'index': 1 } } } }
+
+class TestIndexAdvisor(TestSuite):
+    ''' Test model indexes and index suggestions '''
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(20):
+            Query("shows").insert(city="city%d" % (k % 4), score=k, created=k).execute()
+        self.advisor = instrumentation.add_listener(IndexAdvisor())
+
+    def teardown(self):
+        instrumentation.remove_listener(self.advisor)
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    @test_case
+    def test1_model_indexes(self):
+        ''' Test building single field, compound, unique, sparse and TTL indexes '''
+        self.assert_equal([(i.collection, i.keys) for i in get_model_indexes(MODEL)],
+                          [('venues', [('name', 1)]), ('venues', [('city', 1), ('created', -1)]), ('venues', [('expires', 1)])])
+        Database.build_indexes(MODEL, background=False)
+        info = Database._get_collection("venues").index_information()
+        self.assert_equal(info['city_1_created_-1'], { 'key': [('city', 1), ('created', -1)], 'unique': True, 'sparse': True })
+        self.assert_equal(info['expires_1']['expireAfterSeconds'], 3600)
+        self.assert_equal(info.has_key('name_1'), True)
+        try:
+            get_model_indexes({ 'A': { 'fields': dict(), 'indexes': [{ 'fields': ['a', 'b'], 'ttl': 10 }] } })
+            self.assert_equal("built", "rejected")
+        except ValueError:
+            pass
+
+    @test_case
+    def test2_suggestions(self):
+        ''' Test suggesting indexes for recorded query shapes '''
+        self.assert_equal(get_filter_fields({ 'a': 1, 'b': { '$gt': 1 }, 'c': { '$in': [1] }, '$and': [{ 'd': 1 }] }),
+                          (['a', 'c', 'd'], ['b']))
+        self.advisor.reset()
+        for k in range(5):
+            Query("shows").where(city="city1", score={ '$gte': k }).sort("created", DESCENDING)._find(True)
+            Query("shows").where(_id=k).count()
+        suggestions = self.advisor.analyze()
+        self.assert_equal(len(suggestions), 1)
+        s = suggestions[0]
+        self.assert_equal(s.index.keys, [('city', 1), ('created', -1), ('score', 1)])
+        self.assert_equal(s.collection_scan, True)
+        self.assert_equal(s.in_memory_sort, True)
+        self.assert_equal(s.is_needed(), True)
+        model = { 'Show': { 'collection': 'shows', 'fields': dict() } }
+        report = self.advisor.report(model)
+        self.assert_equal(report.splitlines()[0], "Show:")
+        self.assert_equal(report.splitlines()[-1], "        - fields: [city, -created, score]")
+
+        # Apply the suggestion
+        model['Show']['indexes'] = [s.index.to_config()]
+        Database.build_indexes(model)
+        s = self.advisor.analyze()[0]
+        self.assert_equal(s.covered, True)
+        self.assert_equal(s.collection_scan, False)
+        self.assert_equal(s.in_memory_sort, False)
+        self.assert_equal(self.advisor.report(model), "")
+
+    @test_case
+    def test3_build_plan(self):
+        ''' Test skipping existing indexes and building the others in parallel '''
+        Database.build_indexes(MODEL)
+        plan = Database.build_indexes(MODEL, dry_run=True)
+        self.assert_equal([a.action for a in plan], [SKIP, SKIP, SKIP])
+        model = { 'Venue': { 'collection': 'venues', 'fields': dict(),
+                             'indexes': [{ 'fields': ['city', '-created'] }, { 'fields': ['name'] }] },
+                  'Show': { 'collection': 'shows', 'fields': { 'score': { 'type': 'int', 'required': True, 'index': -1 } } } }
+        plan = Database.build_indexes(model, dry_run=True)
+        self.assert_equal([(a.spec.get_name(), a.action) for a in plan], 
+                          [('score_-1', CREATE), ('city_1_created_-1', REPLACE), ('name_1', SKIP)])
+        self.assert_equal(Database._get_collection("venues").index_information()['city_1_created_-1']['unique'], True)
+        done = list()
+        Database.build_indexes(model, parallel=2, progress=lambda n, total, action, duration: done.append((n, total)))
+        self.assert_equal(sorted(done), [(1, 2), (2, 2)])
+        info = Database._get_collection("venues").index_information()['city_1_created_-1']
+        self.assert_equal(info.has_key('unique'), False)
+        self.assert_equal(info['background'], True)
+        self.assert_equal([a.action for a in Database.build_indexes(model, dry_run=True)], [SKIP, SKIP, SKIP])
+
+    @test_case
+    def test4_in_memory_sort(self):
+        ''' Test suggesting indexes for queries that are filtered by an index but sorted in memory '''
+        plan = { 'queryPlanner': { 'winningPlan': { 'stage': 'SORT', 'inputStage': { 'stage': 'IXSCAN' } } } }
+        self.assert_equal(is_in_memory_sort(plan), True)
+        self.assert_equal(is_in_memory_sort({ 'queryPlanner': { 'winningPlan': { 'stage': 'IXSCAN' } } }), False)
+        col = Database._get_collection("shows")
+        col.ensure_index([("city", 1), ("created", DESCENDING)])
+        col.ensure_index([("city", 1)])
+        self.advisor.reset()
+        Query("shows").where(city="city2").sort("created", DESCENDING)._find(True)
+        s = self.advisor.analyze()[0]
+        self.assert_equal(s.index.keys, [('city', 1), ('created', -1)])
+        self.assert_equal((s.covered, s.collection_scan, s.in_memory_sort), (True, False, True))
+        self.assert_equal(s.is_needed(), True)
+        self.assert_equal("in-memory sort" in self.advisor.report(), True)
+
+if __name__ == "__main__":
+    TestIndexAdvisor().run()
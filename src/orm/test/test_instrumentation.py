@@ -0,0 +1,143 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query
+from orm.db import instrumentation
+from orm.db.instrumentation import QueryListener, QueryStats, query_shape
+from orm.test.fake_mongo import FakeConnection, FakeCursor
+import time
+
+class EventRecorder(QueryListener):
+    ''' Keeps all the events it is notified of '''
+
+    def __init__(self):
+        self.events = list()
+
+    def started(self, event):
+        self.events.append(("started", event))
+
+    def succeeded(self, event):
+        self.events.append(("succeeded", event))
+
+    def failed(self, event):
+        self.events.append(("failed", event))
+
+class TestInstrumentation(TestSuite):
+    ''' Test query listeners and statistics '''
+
+    N = 10
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(self.N):
+            Database.get_instance()['test'].insert({ 'param1': k })
+        self.recorder = instrumentation.add_listener(EventRecorder())
+        self.stats = instrumentation.add_listener(QueryStats())
+
+    def teardown(self):
+        instrumentation.remove_listener(self.recorder)
+        instrumentation.remove_listener(self.stats)
+        instrumentation.set_sample_rate(1.0)
+        instrumentation.set_slow_query_threshold(None)
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    @test_case
+    def test1_shape(self):
+        ''' Test that values are left out of query shapes '''
+        self.assert_equal(query_shape({ 'b': 1, 'a': { '$in': [1, 2] } }), "{a: {$in: ?}, b: ?}")
+        self.assert_equal(query_shape({ '$or': [{ 'a': 1 }, { 'b': 2 }] }), "{$or: [{a: ?}, {b: ?}]}")
+        self.assert_equal(query_shape({ 'a': { 'x': 1 } }), "{a: ?}")
+
+    @test_case
+    def test2_events(self):
+        ''' Test the events sent to listeners '''
+        del self.recorder.events[:]
+        Query("test").where(param1=3).cache(False)._find(True)
+        kinds = [kind for kind, _ in self.recorder.events]
+        self.assert_equal(kinds, ["started", "succeeded"])
+        event = self.recorder.events[1][1]
+        self.assert_equal(event.op, "find")
+        self.assert_equal(event.collection, "test")
+        self.assert_equal(event.shape, "{param1: ?}")
+        self.assert_equal(event.n_docs, 1)
+        self.assert_equal(event.n_bytes > 0, True)
+        self.assert_equal(__file__.rstrip("c") in event.caller, True)
+        q = Query("test")
+        q.insert(_id=1).execute()
+        try:
+            q.reset().insert(_id=1).execute()
+        except Exception:
+            pass
+        self.assert_equal(self.recorder.events[-1][0], "failed")
+        self.assert_not_none(self.recorder.events[-1][1].error)
+
+    @test_case
+    def test3_stats(self):
+        ''' Test aggregating statistics per query shape '''
+        self.stats.reset()
+        for k in range(5):
+            Query("test").where(param1=k).count()
+        Query("test").where_gt(param1=5).delete()
+        report = self.stats.report()
+        self.assert_equal(len(report), 2)
+        counts = dict([(r['op'], r) for r in report])
+        self.assert_equal(counts['count']['count'], 5)
+        self.assert_equal(counts['delete']['docs'], self.N - 6)
+        self.assert_equal(counts['count']['p50_ms'] <= counts['count']['p99_ms'], True)
+
+    @test_case
+    def test4_sampling_and_slow_queries(self):
+        ''' Test sampling and slow query reports '''
+        self.stats.reset()
+        instrumentation.set_sample_rate(0)
+        Query("test").count()
+        self.assert_equal(len(self.stats.report()), 0)
+        instrumentation.set_slow_query_threshold(0)
+        Query("test").where(param1=1).count()
+        self.assert_equal(len(self.stats.report()), 0)
+        slow = self.stats.get_slow_queries()
+        self.assert_equal(len(slow), 1)
+        self.assert_equal(slow[0].slow, True)
+        self.assert_not_none(slow[0].plan)
+
+    @test_case
+    def test5_lazy_finds(self):
+        ''' Test that finds returning cursors are timed until their first results arrive '''
+        execute = FakeCursor._execute
+        def slow_execute(cursor):
+            if cursor._results is None:
+                time.sleep(0.05)
+            return execute(cursor)
+        FakeCursor._execute = slow_execute
+        try:
+            instrumentation.set_sample_rate(1.0)
+            instrumentation.set_slow_query_threshold(40)
+            del self.recorder.events[:]
+            cursor = Query("test").where(param1=2).cache(False).execute()
+            self.assert_equal([kind for kind, _ in self.recorder.events], ["started"])
+            self.assert_equal(cursor.next()['param1'], 2)
+            kind, event = self.recorder.events[-1]
+            self.assert_equal(kind, "succeeded")
+            self.assert_equal(event.duration_ms >= 40, True)
+            self.assert_equal((event.slow, event.plan is not None), (True, True))
+            self.assert_equal(list(cursor), [])
+            self.assert_equal(len(self.recorder.events), 2)
+            del self.recorder.events[:]
+            self.assert_equal(Query("test").where(param1=3).cache(False).fetch_one()['param1'], 3)
+            self.assert_equal(self.recorder.events[-1][1].slow, True)
+            self.assert_equal(Database._get_pool().in_use(), 0)
+        finally:
+            FakeCursor._execute = execute
+
+if __name__ == "__main__":
+    TestInstrumentation().run()
@@ -0,0 +1,112 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query, ASCENDING, DESCENDING
+from orm.core.base_object import BaseObject
+from orm.test.fake_mongo import FakeConnection
+
+class Score(BaseObject):
+    ''' Model class to paginate over '''
+
+    _fields = ('value',)
+    _field_types = { 'value': 'int' }
+    _col_name = 'scores'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.value = None
+
+class TestPagination(TestSuite):
+    ''' Test keyset pagination '''
+
+    N = 23
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(self.N):
+            # Lots of ties, and a few null values
+            Query("test").insert(_id=k, param1=k % 5 if k % 7 else None, param2="value%d" % k).execute()
+
+    def teardown(self):
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _get_all_pages(self, q, size):
+        ''' Return the ids of all results, page by page '''
+        pages = list()
+        token = None
+        while len(pages) <= self.N:
+            page = q.page_after(token, size)
+            pages.append([doc['_id'] for doc in page])
+            if not page.has_next():
+                break
+            token = page.next_token
+        return pages
+
+    @test_case
+    def test1_pages(self):
+        ''' Test going through all pages, with ties and null values on the sort field '''
+        for direction in (ASCENDING, DESCENDING):
+            expected = [doc['_id'] for doc in Query("test").sort("param1", direction).sort_by_id().execute()]
+            pages = self._get_all_pages(Query("test").sort("param1", direction), 5)
+            self.assert_equal([len(p) for p in pages], [5, 5, 5, 5, 3])
+            self.assert_equal(sum(pages, []), expected)
+        self.assert_equal(self._get_all_pages(Query("test").where_gte(_id=10), 10), [range(10, 20), range(20, 23)])
+        self.assert_equal(self._get_all_pages(Query("test").where(param1=1).sort("_id", DESCENDING), 2), [[16, 11], [6, 1]])
+
+    @test_case
+    def test2_tokens(self):
+        ''' Test that pages follow their token even when documents are added or removed '''
+        q = Query("test").select("param2").sort("param1", ASCENDING)
+        page = q.page_after(None, 10)
+        self.assert_equal(page[0].has_key('param1'), False)
+        Query("test").where(_id=page[0]['_id']).delete()
+        Query("test").insert(_id=100, param1=None, param2="first").execute()
+        next_page = q.page_after(page.next_token, 10)
+        self.assert_equal(set([d['_id'] for d in page]) & set([d['_id'] for d in next_page]), set())
+        self.assert_equal(100 in [d['_id'] for d in next_page], False)
+        try:
+            Query("test").sort("param2").page_after(page.next_token, 10)
+            self.assert_equal("paginated", "rejected")
+        except ValueError:
+            pass
+
+    @test_case
+    def test3_find_by(self):
+        ''' Test paginating through model objects '''
+        for k in range(7):
+            s = Score(True)
+            s.value = k % 3
+            s.save()
+        page = Score.find_by(page_size=4, sort="value")
+        self.assert_equal([s.value for s in page], [2, 2, 1, 1])
+        self.assert_equal(isinstance(page[0], Score), True)
+        page = Score.find_by(page_size=4, page_token=page.next_token, sort="value")
+        self.assert_equal([s.value for s in page], [0, 0, 0])
+        self.assert_equal(page.next_token, None)
+        self.assert_equal(len(Score.find_by(page_size=10, value=0)), 3)
+
+    @test_case
+    def test4_nested_sort(self):
+        ''' Test paginating on an embedded document field '''
+        for k in range(6):
+            Query("places").insert(_id=k, name="p%d" % k, loc={ 'city': "c%d" % (k % 3), 'country': "fr" }).execute()
+        expected = [doc['_id'] for doc in Query("places").sort("loc.city", ASCENDING).sort_by_id().execute()]
+        pages = self._get_all_pages(Query("places").sort("loc.city", ASCENDING), 2)
+        self.assert_equal(pages, [expected[0:2], expected[2:4], expected[4:6]])
+        page = Query("places").select("name").sort("loc.city", DESCENDING).page_after(None, 2)
+        self.assert_equal(page[0], { '_id': 5, 'name': "p5" })
+        page = Query("places").select("loc.country").sort("loc.city", DESCENDING).page_after(page.next_token, 2)
+        self.assert_equal(page[0], { '_id': 4, 'loc': { 'country': "fr" } })
+
+if __name__ == "__main__":
+    TestPagination().run()
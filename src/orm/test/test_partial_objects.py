@@ -0,0 +1,115 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db import instrumentation
+from orm.db.instrumentation import QueryListener
+from orm.core.base_object import BaseObject, PartialObjectError
+from orm.core.base_object_array import BaseObjectArray
+from orm.test.fake_mongo import FakeConnection
+
+class Profile(BaseObject):
+    ''' Model class to load partially '''
+
+    _fields = ('name', 'bio', 'visits')
+    _field_types = { 'name': 'str', 'bio': 'str', 'visits': 'int' }
+    _col_name = 'profiles'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.name = None
+        self.bio = None
+        self.visits = None
+
+class FindRecorder(QueryListener):
+    ''' Counts the finds it is notified of '''
+
+    def __init__(self):
+        self.n_finds = 0
+
+    def succeeded(self, event):
+        if event.op == "find":
+            self.n_finds += 1
+
+class TestPartialObjects(TestSuite):
+    ''' Test partially loaded objects '''
+
+    N = 3
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(self.N):
+            p = Profile(True)
+            p.name = "p%d" % k
+            p.bio = "Bio %d" % k
+            p.visits = k
+            p.save()
+        self.recorder = instrumentation.add_listener(FindRecorder())
+
+    def teardown(self):
+        instrumentation.remove_listener(self.recorder)
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _load(self, name):
+        ''' Load a profile with its name only '''
+        return Profile.find_one_by(fields=["name"], name=name)
+
+    @test_case
+    def test1_lazy_load(self):
+        ''' Test loading the missing fields on first access '''
+        p = self._load("p1")
+        self.assert_equal(p.is_partial(), True)
+        n = self.recorder.n_finds
+        self.assert_equal(p.name, "p1")
+        self.assert_equal(self.recorder.n_finds, n)
+        self.assert_equal(p.bio, "Bio 1")
+        self.assert_equal(self.recorder.n_finds, n + 1)
+        self.assert_equal(p.visits, 1)
+        self.assert_equal(self.recorder.n_finds, n + 1)
+        self.assert_equal(p.is_partial(), False)
+        self.assert_equal(p.has_changes(), False)
+
+    @test_case
+    def test2_update(self):
+        ''' Test updating the loaded fields and refusing to overwrite the others '''
+        p = self._load("p0")
+        p.name = "first"
+        self.assert_equal(p._get_update_rules(), { '$set': { 'name': "first" } })
+        p.save()
+        p = self._load("first")
+        p.bio = "Overwritten"
+        try:
+            p.update()
+            self.assert_equal("update", "rejected")
+        except PartialObjectError:
+            pass
+        full = Profile.find_one_by(name="first")
+        self.assert_equal((full.bio, full.visits), ("Bio 0", 0))
+
+    @test_case
+    def test3_bulk(self):
+        ''' Test writing partial objects in bulk '''
+        objs = BaseObjectArray(Profile.find_all(fields=["name"]))
+        for p in objs:
+            self.assert_equal(p.is_partial(), True)
+        objs[0].name = "renamed"
+        objs[1].visits = 100
+        res = objs.save(ordered=False)
+        self.assert_equal(res.n_matched, 1)
+        self.assert_equal(len(res.errors), 1)
+        self.assert_equal(res.errors[0].obj is objs[1], True)
+        self.assert_equal("not loaded" in res.errors[0].message, True)
+        self.assert_equal(Profile.find(objs[0].get_id()).name, "renamed")
+        self.assert_equal(Profile.find(objs[1].get_id()).visits, 1)
+
+if __name__ == "__main__":
+    TestPartialObjects().run()
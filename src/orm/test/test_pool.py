@@ -0,0 +1,138 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.pool import ConnectionPool, PoolTimeoutError
+from orm.db.database import Database
+from orm.db.query import Query
+from orm.test.fake_mongo import FakeConnection
+
+class DummyConnection(object):
+    ''' Connection stand-in that records whether it was closed '''
+
+    healthy = True
+
+    def __init__(self):
+        self.closed = False
+        self.admin = self
+
+    def command(self, name):
+        if not self.healthy:
+            raise IOError("Connection lost")
+        return { 'ok': 1 }
+
+    def close(self):
+        self.closed = True
+
+class TestConnectionPool(TestSuite):
+    ''' Test connection pooling '''
+
+    @test_case
+    def test1_reuse(self):
+        ''' Test that released connections are reused and not closed '''
+        pool = ConnectionPool(DummyConnection, 1, 2)
+        pool.fill()
+        self.assert_equal(pool.size(), 1)
+        c1 = pool.acquire()
+        pool.release(c1)
+        c2 = pool.acquire()
+        self.assert_equal(c1 is c2, True)
+        self.assert_equal(c1.closed, False)
+        pool.release(c2)
+        self.assert_equal(pool.available(), 1)
+
+    @test_case
+    def test2_max_size(self):
+        ''' Test that the pool never opens more than max_size connections '''
+        pool = ConnectionPool(DummyConnection, 0, 2)
+        c1 = pool.acquire()
+        c2 = pool.acquire()
+        try:
+            pool.acquire(0.01)
+            self.assert_equal("acquired", "timed out")
+        except PoolTimeoutError:
+            pass
+        pool.release(c1)
+        pool.release(c2)
+        self.assert_equal(pool.size(), 2)
+
+    @test_case
+    def test3_idle_eviction(self):
+        ''' Test that idle connections above min_size are evicted '''
+        pool = ConnectionPool(DummyConnection, 1, 3, idle_timeout=0)
+        c1 = pool.acquire()
+        c2 = pool.acquire()
+        pool.release(c1)
+        pool.release(c2)
+        self.assert_equal(pool.size(), 1)
+        self.assert_equal(c1.closed, True)
+        self.assert_equal(c2.closed, False)
+
+    @test_case
+    def test4_health_check(self):
+        ''' Test that unhealthy connections are replaced '''
+        pool = ConnectionPool(DummyConnection, 1, 1, check_interval=0)
+        c1 = pool.acquire()
+        c1.healthy = False
+        pool.release(c1)
+        c2 = pool.acquire()
+        self.assert_equal(c1 is c2, False)
+        self.assert_equal(c1.closed, True)
+        pool.release(c2)
+
+    @test_case
+    def test5_close(self):
+        ''' Test closing the pool '''
+        pool = ConnectionPool(DummyConnection, 0, 2)
+        c1 = pool.acquire()
+        c2 = pool.acquire()
+        pool.release(c1)
+        pool.close()
+        self.assert_equal(c1.closed, True)
+        self.assert_equal(c2.closed, False)
+        pool.release(c2)
+        self.assert_equal(c2.closed, True)
+
+    @test_case
+    def test6_cursors(self):
+        ''' Test that cursors keep their connection borrowed until done reading '''
+        connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        try:
+            Database.get_instance(db_name="test", min_pool_size=0, max_pool_size=2)
+            pool = Database._get_pool()
+            for k in range(3):
+                Query("items").insert(k=k).execute()
+            self.assert_equal(pool.in_use(), 0)
+            c1 = Query("items").cache(False).execute()
+            c2 = Query("items").cache(False).execute()
+            self.assert_equal(pool.in_use(), 2)
+            try:
+                pool.acquire(0.01)
+                self.assert_equal("acquired", "timed out")
+            except PoolTimeoutError:
+                pass
+            # Not closed by the pool while still read
+            pool.evict_idle()
+            self.assert_equal(c1.next()['k'], 0)
+            self.assert_equal(pool.in_use(), 2)
+            self.assert_equal([d['k'] for d in c1], [1, 2])
+            self.assert_equal(pool.in_use(), 1)
+            c2.close()
+            self.assert_equal(pool.in_use(), 0)
+            c3 = Query("items").cache(False).execute()
+            c3.next()
+            del c3
+            self.assert_equal(pool.in_use(), 0)
+            self.assert_equal(pool.size(), 2)
+        finally:
+            Database.connection_class = connection_class
+            FakeConnection.reset()
+
+if __name__ == "__main__":
+    TestConnectionPool().run()
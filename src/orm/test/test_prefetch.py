@@ -0,0 +1,147 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db import instrumentation
+from orm.db.instrumentation import QueryListener
+from orm.core.base_object import BaseObject
+from orm.test.fake_mongo import FakeConnection
+import orm.core.base_object
+
+class Label(BaseObject):
+    ''' Model class referenced by albums '''
+
+    _fields = ('name',)
+    _field_types = { 'name': 'str' }
+    _col_name = 'labels'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.name = None
+
+class Album(BaseObject):
+    ''' Model class with a single and a multi relation '''
+
+    _fields = ('title', 'label_id', 'guest_ids')
+    _field_types = { 'title': 'str', 'label_id': None, 'guest_ids': 'list' }
+    _relations = {
+        'label': { 'class': 'Label', 'local': 'label_id', 'foreign': '_id', 'multi': False },
+        'guests': { 'class': 'Label', 'local': 'guest_ids', 'foreign': '_id', 'multi': True },
+    }
+    _col_name = 'albums'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.title = None
+        self.label_id = None
+        self.guest_ids = None
+
+    def set_label_id(self, val):
+        self.label_id = val
+
+    def get_label(self):
+        return self._get_related('Label', self.label_id, '_id', 'label')
+
+    def set_label(self, obj):
+        return self._set_related(obj, 'label_id', '_id', 'label')
+
+    def get_guests(self):
+        return self._get_related_array('Label', self.guest_ids, '_id', 'guests')
+
+class FindRecorder(QueryListener):
+    ''' Keeps the finds it is notified of '''
+
+    def __init__(self):
+        self.events = list()
+
+    def succeeded(self, event):
+        if event.op == "find":
+            self.events.append(event)
+
+    def get_finds(self, collection):
+        ''' Return the finds on a given collection, and forget about all finds '''
+        events = [e for e in self.events if e.collection == collection]
+        self.events = list()
+        return events
+
+class TestPrefetch(TestSuite):
+    ''' Test prefetching related objects '''
+
+    N = 6
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        orm.core.base_object.Label = Label
+        self.labels = list()
+        for k in range(4):
+            l = Label(True)
+            l.name = "l%d" % k
+            l.save()
+            self.labels.append(l)
+        for k in range(self.N):
+            a = Album(True)
+            a.title = "a%d" % k
+            a.label_id = self.labels[k % 2].get_id()
+            a.guest_ids = [self.labels[2].get_id(), self.labels[3].get_id()] if k % 3 else None
+            a.save()
+        self.recorder = instrumentation.add_listener(FindRecorder())
+
+    def teardown(self):
+        instrumentation.remove_listener(self.recorder)
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _check_in_query(self, events, field="_id"):
+        ''' Check that there was a single $in query on a given field '''
+        self.assert_equal(len(events), 1)
+        self.assert_equal(events[0].conditions.keys(), [field])
+        self.assert_equal(events[0].conditions[field].keys(), ['$in'])
+
+    @test_case
+    def test1_single(self):
+        ''' Test prefetching a single relation '''
+        self.recorder.events = list()
+        albums = Album.find_all(prefetch=['label'])
+        self.assert_equal(len(albums), self.N)
+        self._check_in_query(self.recorder.get_finds("labels"))
+        self.assert_equal([a.get_label().name for a in albums], ["l%d" % (k % 2) for k in range(self.N)])
+        self.assert_equal(self.recorder.get_finds("labels"), [])
+        self.assert_equal(albums[0].get_label() is albums[2].get_label(), True)
+        # A changed reference is resolved again
+        albums[0].set_label_id(self.labels[3].get_id())
+        self.assert_equal(albums[0].get_label().name, "l3")
+        self.assert_equal(len(self.recorder.get_finds("labels")), 1)
+        albums[0].set_label(self.labels[1])
+        self.assert_equal(albums[0].get_label() is self.labels[1], True)
+        self.assert_equal(self.recorder.get_finds("labels"), [])
+
+    @test_case
+    def test2_multi(self):
+        ''' Test prefetching a multi relation along with a single one '''
+        self.recorder.events = list()
+        albums = Album.find_by(prefetch=['label', 'guests'], title={ '$in': ["a0", "a1", "a2"] })
+        events = self.recorder.get_finds("labels")
+        self.assert_equal(len(events), 2)
+        self._check_in_query(events[:1])
+        self._check_in_query(events[1:])
+        self.assert_equal([[g.name for g in a.get_guests() or []] for a in albums], [[], ["l2", "l3"], ["l2", "l3"]])
+        self.assert_equal(self.recorder.get_finds("labels"), [])
+        albums[1].guest_ids.append(self.labels[0].get_id())
+        self.assert_equal([g.name for g in albums[1].get_guests()], ["l0", "l2", "l3"])
+        self.assert_equal(len(self.recorder.get_finds("labels")), 1)
+        try:
+            Album.prefetch_related(albums, "missing")
+            self.assert_equal("missing", "rejected")
+        except ValueError:
+            pass
+
+if __name__ == "__main__":
+    TestPrefetch().run()
@@ -73,6 +73,19 @@ class TestQuery(TestSuite):
         item = Query("test").where(_id=1).fetch_one()
         self.assert_not_none(item)
         self.assert_equal(item['success'], False)
+        # Nothing to set must not replace the document with an empty one
+        try:
+            Query("test").where(_id=1).update()
+            self.assert_equal("update", "rejected")
+        except ValueError:
+            pass
+        try:
+            Query("test").where(_id=1).find_and_modify()
+            self.assert_equal("find_and_modify", "rejected")
+        except ValueError:
+            pass
+        item = Query("test").where(_id=1).fetch_one()
+        self.assert_equal(item, { '_id': 1, 'success': False })
             
     @test_case
     def test4_delete_query(self):
@@ -0,0 +1,79 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query
+from orm.db.query_cache import QueryCache, MISS
+import time
+
+class TestQueryCache(TestSuite):
+    ''' Test query result caching '''
+
+    N = 10
+
+    def setup(self):
+        db = Database.get_instance()
+        Database.drop()
+        for k in range(self.N):
+            db['test'].insert({ 'param1': k, "param2": (k%2==0) })
+        Database.enable_query_cache()
+
+    def teardown(self):
+        Database.enable_query_cache(False)
+
+    @test_case
+    def test1_lru(self):
+        ''' Test least recently used eviction '''
+        cache = QueryCache(max_entries=2)
+        cache.set("a", "col", 1, cache.generation("col"))
+        cache.set("b", "col", 2, cache.generation("col"))
+        cache.get("a")
+        cache.set("c", "col", 3, cache.generation("col"))
+        self.assert_equal(cache.get("a"), 1)
+        self.assert_equal(cache.get("b"), MISS)
+        self.assert_equal(cache.get("c"), 3)
+
+    @test_case
+    def test2_ttl(self):
+        ''' Test expiration '''
+        cache = QueryCache(ttl=0.01)
+        cache.set("a", "col", [{ 'x': 1 }], cache.generation("col"))
+        self.assert_equal(cache.get("a"), [{ 'x': 1 }])
+        time.sleep(0.02)
+        self.assert_equal(cache.get("a"), MISS)
+
+    @test_case
+    def test3_invalidation(self):
+        ''' Test invalidation, including of results computed before a write '''
+        cache = QueryCache()
+        generation = cache.generation("col")
+        cache.set("a", "col", 1, generation)
+        cache.set("b", "other", 2, cache.generation("other"))
+        cache.invalidate("col")
+        self.assert_equal(cache.get("a"), MISS)
+        self.assert_equal(cache.get("b"), 2)
+        cache.set("a", "col", 1, generation)
+        self.assert_equal(cache.get("a"), MISS)
+
+    @test_case
+    def test4_cached_queries(self):
+        ''' Test that writes through Query invalidate cached results '''
+        self.assert_equal(Query("test").where(param2=True).count(), self.N / 2)
+        self.assert_equal(Query("test").where(param2=True).execute().count(), self.N / 2)
+        hits = Database.query_cache.hits
+        self.assert_equal(Query("test").where(param2=True).count(), self.N / 2)
+        self.assert_equal(Database.query_cache.hits, hits + 1)
+        Query("test").insert(param1=self.N, param2=True).execute()
+        self.assert_equal(Query("test").where(param2=True).count(), self.N / 2 + 1)
+        Query("test").where(param1=0).update(param2=False)
+        self.assert_equal(len(Query("test").where(param2=True).execute()), self.N / 2)
+        Query("test").where(param2=True).delete()
+        self.assert_equal(Query("test").where(param2=True).count(), 0)
+
+if __name__ == "__main__":
+    TestQueryCache().run()
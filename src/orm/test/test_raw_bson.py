@@ -0,0 +1,137 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query, ASCENDING
+from orm.db.raw_bson import RawDocument, split_documents, write_bson
+from orm.db.query_cache import estimate_size
+from orm.core.base_object import BaseObject
+from orm.core import json_encoder
+from orm.test.fake_mongo import FakeConnection
+from bson import BSON, Binary, Code
+from bson.objectid import ObjectId
+from bson.regex import Regex
+from datetime import datetime
+from StringIO import StringIO
+import json
+
+class Track(BaseObject):
+    ''' Model class to read raw documents of '''
+
+    _fields = ('title', 'plays')
+    _field_types = { 'title': 'str', 'plays': 'int' }
+    _col_name = 'tracks'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.title = None
+        self.plays = None
+
+class TestRawBSON(TestSuite):
+    ''' Test raw BSON documents and queries '''
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(250):
+            Query("test").insert(_id=k, param1=k % 10, param2="value%d" % k).execute()
+
+    def teardown(self):
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    @test_case
+    def test1_document(self):
+        ''' Test decoding the fields of raw documents one at a time '''
+        oid = ObjectId()
+        doc = { '_id': oid, 'f': 1.5, 's': u"caf\xe9", 'd': { 'a': [1, 2] }, 'b': Binary("xyz"), 'n': None,
+                't': True, 'dt': datetime(2026, 10, 17), 'r': Regex("^a", "i"), 'c': Code("f()"), 'l': 2 ** 40 }
+        raw = RawDocument(BSON.encode(doc))
+        self.assert_equal(sorted(raw.keys()), sorted(doc.keys()))
+        self.assert_equal(raw['_id'], oid)
+        self.assert_equal(raw['d'], { 'a': [1, 2] })
+        self.assert_equal(raw['l'], 2 ** 40)
+        self.assert_equal(raw.get('missing', 0), 0)
+        self.assert_equal(raw.has_key('n'), True)
+        self.assert_equal(raw.to_dict()['s'], u"caf\xe9")
+        data = BSON.encode({ 'a': 1 }) + BSON.encode({ 'a': 2 })
+        self.assert_equal([d['a'] for d in split_documents(data)], [1, 2])
+
+    @test_case
+    def test2_query(self):
+        ''' Test getting raw documents in batches, and writing them out as they are '''
+        docs = list(Query("test").raw().where(param1=3).sort("_id", ASCENDING).batch_size(7).execute())
+        self.assert_equal(isinstance(docs[0], RawDocument), True)
+        self.assert_equal([d['_id'] for d in docs], range(3, 250, 10))
+        docs = list(Query("test").raw().select("param2").sort("_id", ASCENDING).limit(120).batch_size(50).execute())
+        self.assert_equal(len(docs), 120)
+        self.assert_equal(docs[-1].keys(), ['_id', 'param2'])
+        self.assert_equal(Query("test").raw().where(_id=5).fetch_one()['param2'], "value5")
+        fp = StringIO()
+        write_bson(docs[:2], fp)
+        self.assert_equal(fp.getvalue(), docs[0].raw + docs[1].raw)
+        self.assert_equal(json.loads("".join(json_encoder.iter_json(docs[:2]))),
+                          [{ '_id': 0, 'param2': "value0" }, { '_id': 1, 'param2': "value1" }])
+
+    @test_case
+    def test3_finders(self):
+        ''' Test getting raw documents from the finders '''
+        t = Track(True)
+        t.title = "Intro"
+        t.plays = 3
+        t.save()
+        doc = Track.find_by(raw=True, title="Intro")
+        doc = list(doc)[0]
+        self.assert_equal(isinstance(doc, RawDocument), True)
+        self.assert_equal(doc['plays'], 3)
+        self.assert_equal(Track.find_one_by(raw=True, title="Intro")['_id'], t.get_id())
+        self.assert_equal(len(list(Track.find_all(raw=True))), 1)
+        for find in (lambda: Track.find_all(raw=True, lazy=True), lambda: Track.find_by(raw=True, lazy=True, title="Intro")):
+            try:
+                find()
+                self.assert_equal("lazy", "rejected")
+            except ValueError:
+                pass
+
+    @test_case
+    def test4_cache(self):
+        ''' Test raw queries with the query cache on '''
+        Database.enable_query_cache()
+        try:
+            docs = list(Query("test").raw().where(param1=4).execute())
+            self.assert_equal(isinstance(docs[0], RawDocument), True)
+            self.assert_equal(len(docs), 25)
+            self.assert_equal(len(Database.query_cache._entries), 0)
+            self.assert_equal(Query("test").raw().where(_id=4).fetch_one()['param2'], "value4")
+            self.assert_equal(estimate_size(docs), sum([len(d.raw) for d in docs]))
+        finally:
+            Database.enable_query_cache(False)
+
+    @test_case
+    def test5_pages(self):
+        ''' Test paginating raw documents sorted by a field that is not selected '''
+        Query("test").where(_id=3).update(meta={ 'rank': 3, 'tag': "x" })
+        doc = RawDocument(BSON.encode({ '_id': 1, 'meta': { 'rank': 2 }, 'other': { 'rank': 1, 'tag': "y" } }))
+        self.assert_equal(doc.without("meta.rank").to_dict(), { '_id': 1, 'other': { 'rank': 1, 'tag': "y" } })
+        self.assert_equal(doc.without("other.rank").to_dict(), { '_id': 1, 'meta': { 'rank': 2 }, 'other': { 'tag': "y" } })
+        self.assert_equal(doc.without("missing.rank") is doc, True)
+        q = Query("test").raw().select("param2").where_lt(_id=20).sort("param1", ASCENDING)
+        page = q.page_after(size=5)
+        self.assert_equal([d.keys() for d in page], [['_id', 'param2']] * 5)
+        self.assert_equal([d['_id'] for d in page], [0, 10, 1, 11, 2])
+        page = q.page_after(page.next_token, 5)
+        self.assert_equal([d['_id'] for d in page], [12, 3, 13, 4, 14])
+        page = Query("test").raw().select("param2").where_in("_id", [3, 4]).sort("meta.rank", ASCENDING).page_after(size=1)
+        self.assert_equal(page[0].to_dict(), { '_id': 4, 'param2': "value4" })
+        page = Query("test").raw().select("param2").where_in("_id", [3, 4]).sort("meta.rank", ASCENDING).page_after(page.next_token, 1)
+        self.assert_equal(page[0].to_dict(), { '_id': 3, 'param2': "value3" })
+
+if __name__ == "__main__":
+    TestRawBSON().run()
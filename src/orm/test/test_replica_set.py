@@ -0,0 +1,142 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query
+from orm.db.replica_set import ReplicaSetError, SECONDARY, SECONDARY_PREFERRED, NEAREST
+from orm.core.base_object import BaseObject
+from orm.test.fake_mongo import FakeConnection, make_replica_set, PRIMARY, DOWN
+import pymongo.errors
+
+ADDRESSES = [("localhost", 27017), ("localhost", 27018), ("localhost", 27019)]
+
+class Report(BaseObject):
+    ''' Model class whose reads go to secondaries '''
+
+    _fields = ('title',)
+    _field_types = { 'title': 'str' }
+    _read_preference = SECONDARY
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.title = None
+
+class TestReplicaSet(TestSuite):
+    ''' Test routing queries to the members of a replica set '''
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+
+    def teardown(self):
+        Database.remove_instance()
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _connect(self):
+        ''' Connect to a new replica set '''
+        FakeConnection.reset()
+        self.servers = make_replica_set("rs0", ADDRESSES)
+        # Only give a secondary, the other members are discovered
+        Database.get_instance(hosts="localhost:27018", replica_set="rs0", db_name="test", refresh_interval=3600)
+
+    def _reads(self):
+        ''' Return the number of reads served by each member so far '''
+        return [s.reads for s in self.servers]
+
+    def _lag(self, *lags):
+        ''' Set the replication lag of the secondaries '''
+        for server, lag in zip(self.servers[1:], lags):
+            server.lag = lag
+        Database._get_alias().replica_set.request_refresh()
+
+    @test_case
+    def test1_discovery(self):
+        ''' Test discovering the members and writing to the primary '''
+        self._connect()
+        self.assert_equal(sorted(Database._get_alias().replica_set.members.keys()), ADDRESSES)
+        self.assert_equal(Database._get_alias().replica_set.get_primary().address, ADDRESSES[0])
+        Query("test").insert(param1=1).execute()
+        self.assert_equal(Query("test").count(), 1)
+        self.assert_equal(self._reads(), [1, 0, 0])
+
+    @test_case
+    def test2_read_preferences(self):
+        ''' Test routing reads according to per query and per class read preferences '''
+        self._connect()
+        for k in range(10):
+            Query("test").insert(param1=k).execute()
+        self.assert_equal(Query("test").read_preference(SECONDARY).where(param1=1).count(), 1)
+        self.assert_equal(len(list(Query("test").read_preference(SECONDARY).execute())), 10)
+        reads = self._reads()
+        self.assert_equal(reads[0], 0)
+        self.assert_equal(reads[1] + reads[2], 2)
+        r = Report(True)
+        r.title = "Report"
+        r.save()
+        self.assert_equal(Report.find(r.get_id()).title, "Report")
+        self.assert_equal(self._reads()[0], 0)
+        n = sum(self._reads())
+        for k in range(10):
+            Query("test").read_preference(NEAREST).count()
+        self.assert_equal(sum(self._reads()), n + 10)
+
+    @test_case
+    def test3_max_lag(self):
+        ''' Test that lagging secondaries are not read from '''
+        self._connect()
+        self._lag(30, 1)
+        Query("test").read_preference(SECONDARY, 5).count()
+        self.assert_equal(self._reads(), [0, 0, 1])
+        self._lag(30, 30)
+        try:
+            Query("test").read_preference(SECONDARY, 5).count()
+            self.assert_equal("read", "no member")
+        except ReplicaSetError:
+            pass
+        Query("test").read_preference(SECONDARY_PREFERRED, 5).count()
+        self.assert_equal(self._reads(), [1, 0, 1])
+
+    @test_case
+    def test4_failover(self):
+        ''' Test that writes follow the primary after a failover '''
+        self._connect()
+        Query("test").insert(param1=1).execute()
+        self.servers[0].state = DOWN
+        self.servers[1].state = PRIMARY
+        try:
+            Query("test").insert(param1=2).execute()
+            self.assert_equal("written", "not written")
+        except pymongo.errors.AutoReconnect:
+            pass
+        Query("test").insert(param1=2).execute()
+        self.assert_equal(Database._get_alias().replica_set.get_primary().address, ADDRESSES[1])
+        self.assert_equal(Query("test").count(), 2)
+        self.assert_equal(self.servers[1].reads, 1)
+
+    @test_case
+    def test5_slave_ok(self):
+        ''' Test that reads sent to secondaries are allowed to be served by them '''
+        self._connect()
+        for k in range(10):
+            Query("test").insert(param1=k).execute()
+        try:
+            FakeConnection(*ADDRESSES[1])["test"]["test"].find().count()
+            self.assert_equal("read", "rejected")
+        except pymongo.errors.AutoReconnect:
+            pass
+        q = lambda: Query("test").read_preference(SECONDARY).cache(False)
+        self.assert_equal(q().count(), 10)
+        self.assert_equal(q().where(param1=3).fetch_one()['param1'], 3)
+        self.assert_equal(len(list(q().where_lt(param1=5).execute())), 5)
+        self.assert_equal(q().raw().where(param1=4).fetch_one()['param1'], 4)
+        self.assert_equal(list(q().aggregate().group(None, n=("sum", 1)).execute())[0]['n'], 10)
+        self.assert_equal(self._reads()[0], 0)
+
+if __name__ == "__main__":
+    TestReplicaSet().run()
@@ -0,0 +1,160 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query, ASCENDING
+from orm.db import instrumentation
+from orm.db.instrumentation import QueryListener
+from orm.core.base_object import BaseObject
+from orm.core.result_set import ResultSet
+from orm.test.fake_mongo import FakeConnection
+import orm.core.base_object
+
+class Writer(BaseObject):
+    ''' Model class referenced by articles '''
+
+    _fields = ('name',)
+    _field_types = { 'name': 'str' }
+    _col_name = 'writers'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.name = None
+
+class Article(BaseObject):
+    ''' Model class to get lazy results of '''
+
+    _fields = ('rank', 'writer_id')
+    _field_types = { 'rank': 'int', 'writer_id': None }
+    _relations = { 'writer': { 'class': 'Writer', 'local': 'writer_id', 'foreign': '_id', 'multi': False } }
+    _col_name = 'articles'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.rank = None
+        self.writer_id = None
+
+    def get_writer(self):
+        return self._get_related('Writer', self.writer_id, '_id', 'writer')
+
+class FindRecorder(QueryListener):
+    ''' Keeps the finds it is notified of '''
+
+    def __init__(self):
+        self.events = list()
+
+    def succeeded(self, event):
+        if event.op == "find":
+            self.events.append(event)
+
+class TestResultSet(TestSuite):
+    ''' Test lazily hydrated results '''
+
+    N = 10
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        orm.core.base_object.Writer = Writer
+        self.writers = list()
+        for k in range(3):
+            w = Writer(True)
+            w.name = "w%d" % k
+            w.save()
+            self.writers.append(w)
+        for k in range(self.N):
+            a = Article(True)
+            a.rank = k
+            a.writer_id = self.writers[k % 3].get_id()
+            a.save()
+        self.recorder = instrumentation.add_listener(FindRecorder())
+
+    def teardown(self):
+        instrumentation.remove_listener(self.recorder)
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    def _results(self, **params):
+        ''' Return the articles sorted by rank, as a ResultSet '''
+        return ResultSet(Query(Article).sort("rank", ASCENDING), Article, **params)
+
+    def _ranks(self, objs):
+        return [o.rank for o in objs]
+
+    @test_case
+    def test1_iteration(self):
+        ''' Test iterating over hydrated objects and raw documents '''
+        rs = self._results()
+        self.assert_equal(self._ranks(rs), range(self.N))
+        self.assert_equal(isinstance(list(rs)[0], Article), True)
+        # Iterating again runs the query again
+        self.assert_equal(self._ranks(rs.to_list()), range(self.N))
+        self.assert_equal([d['rank'] for d in self._results(hydrate=False)], range(self.N))
+        self.assert_equal(bool(rs), True)
+        self.assert_equal(bool(ResultSet(Query(Article).where(rank=100), Article)), False)
+
+    @test_case
+    def test2_slices(self):
+        ''' Test slicing and indexing results '''
+        rs = self._results()
+        self.assert_equal(rs[3].rank, 3)
+        self.assert_equal(rs[-1].rank, self.N - 1)
+        self.assert_equal(self._ranks(rs[2:8]), range(2, 8))
+        self.assert_equal(self._ranks(rs[2:8][1:3]), [3, 4])
+        self.assert_equal(self._ranks(rs[2:8][4:]), [6, 7])
+        self.assert_equal(self._ranks(rs[2:8][3:100]), [5, 6, 7])
+        self.assert_equal(self._ranks(rs[2:8][10:]), [])
+        self.assert_equal(rs[2:8][-1].rank, 7)
+        self.assert_equal(rs[2:8][0].rank, 2)
+        self.assert_equal(len(rs[2:8][1:3]), 2)
+        for index in (6, -7):
+            try:
+                rs[2:8][index]
+                self.assert_equal(index, "out of range")
+            except IndexError:
+                pass
+        try:
+            rs[::2]
+            self.assert_equal("step", "rejected")
+        except IndexError:
+            pass
+        limited = ResultSet(Query(Article).sort("rank", ASCENDING).limit(4), Article)
+        self.assert_equal(self._ranks(limited[1:10]), [1, 2, 3])
+        self.assert_equal(len(limited), 4)
+
+    @test_case
+    def test3_count(self):
+        ''' Test that the count is only asked for when needed '''
+        rs = self._results()
+        self.assert_equal(rs._count, None)
+        a = Article(True)
+        a.rank = self.N
+        a.save()
+        self.assert_equal(len(rs), self.N + 1)
+        self.assert_equal(rs.count(), self.N + 1)
+        self.assert_equal(len(rs[5:]), self.N - 4)
+        Query(Article).where(rank=self.N).delete()
+
+    @test_case
+    def test4_prefetch(self):
+        ''' Test prefetching relations batch by batch '''
+        self.recorder.events = list()
+        rs = self._results(prefetch=['writer'], batch_size=4)
+        articles = list(rs)
+        writer_finds = [e for e in self.recorder.events if e.collection == "writers"]
+        self.assert_equal(len(writer_finds), 3)
+        self.assert_equal(writer_finds[0].conditions.keys(), ['_id'])
+        self.assert_equal(writer_finds[0].conditions['_id'].keys(), ['$in'])
+        self.recorder.events = list()
+        self.assert_equal([a.get_writer().name for a in articles], ["w%d" % (k % 3) for k in range(self.N)])
+        self.assert_equal(self.recorder.events, [])
+
+if __name__ == "__main__":
+    TestResultSet().run()
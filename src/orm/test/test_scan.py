@@ -0,0 +1,77 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.db.database import Database
+from orm.db.query import Query
+from orm.core.base_object import BaseObject
+from orm.test.fake_mongo import FakeConnection
+import operator
+
+class Reading(BaseObject):
+    ''' Model class to scan '''
+
+    _fields = ('sensor', 'value')
+    _field_types = { 'sensor': 'str', 'value': 'int' }
+    _col_name = 'readings'
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.sensor = None
+        self.value = None
+
+def sum_values(chunk):
+    ''' Add up the values of a chunk of readings '''
+    return sum([r.value for r in chunk])
+
+class TestScan(TestSuite):
+    ''' Test partitioned scans '''
+
+    N = 500
+
+    def setup(self):
+        self.connection_class = Database.connection_class
+        Database.connection_class = FakeConnection
+        FakeConnection.reset()
+        Database.get_instance(db_name="test")
+        for k in range(self.N):
+            Query("readings").insert(_id=k, sensor="s%d" % (k % 3), value=k).execute()
+
+    def teardown(self):
+        Database.connection_class = self.connection_class
+        FakeConnection.reset()
+
+    @test_case
+    def test1_partitions(self):
+        ''' Test splitting a collection into _id ranges '''
+        scan = Query("readings").scan(partitions=4)
+        ranges = scan.get_ranges()
+        self.assert_equal(len(ranges), 4)
+        self.assert_equal(ranges[0][0], None)
+        self.assert_equal(ranges[-1][1], None)
+        self.assert_equal(sorted([d['_id'] for d in scan]), range(self.N))
+        scan = Query("readings").where(sensor="s1").scan(partitions=5, chunk_size=10)
+        self.assert_equal(scan._sample_split_keys(), [100, 199, 301, 400])
+        self.assert_equal(sorted([d['_id'] for d in scan]), range(1, self.N, 3))
+        self.assert_equal([len(r) for r in Query("readings").scan(partitions=1).map(lambda chunk: chunk)], [self.N])
+
+    @test_case
+    def test2_model_scan(self):
+        ''' Test scanning model objects on threads and processes '''
+        readings = list(Reading.scan(partitions=3, workers=2, sensor="s0"))
+        self.assert_equal(len(readings), 167)
+        self.assert_equal(isinstance(readings[0], Reading), True)
+        total = sum(range(0, self.N, 3))
+        self.assert_equal(Reading.scan(partitions=3, chunk_size=50, sensor="s0").map(sum_values, operator.add), total)
+        self.assert_equal(Reading.scan(partitions=3, chunk_size=50, sensor="s0").map(sum_values, operator.add, processes=True), total)
+        for r in Reading.scan(partitions=4, chunk_size=5):
+            # Stopping early leaves no partition blocked
+            break
+        self.assert_equal(Reading.scan(partitions=2, fields=["value"]).map(lambda chunk: chunk[0].is_partial())[0], True)
+
+if __name__ == "__main__":
+    TestScan().run()
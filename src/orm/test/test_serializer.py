@@ -0,0 +1,190 @@
+'''
+Created on Oct 17, 2026
+
+@requires: py-utils (https://github.com/benjdezi/Python-Utils)
+@author: Benjamin Dezile
+'''
+
+from pyutils.lib.unit_test import TestSuite, test_case
+from orm.core.base_object import BaseObject, Serializable
+from orm.core.base_object_array import BaseObjectArray
+from orm.core.serializer import get_serializer, PLAIN, STRING, OBJECT, OBJECT_LIST, UNKNOWN
+from orm.core import json_encoder
+from bson.objectid import ObjectId
+from datetime import datetime
+from StringIO import StringIO
+import orm.core.base_object
+import json
+
+class Location(Serializable):
+    ''' Embedded class, as generated by build_model '''
+
+    _fields = ('city', )
+    _field_types = { 'city': 'str' }
+    _embedded = True
+
+    def __init__(self):
+        Serializable.__init__(self)
+        self.city = None
+
+class Venue(BaseObject):
+    ''' Model class, as generated by build_model '''
+
+    _fields = ('name', 'location', 'branches', 'tags', 'extra')
+    _field_types = { 'name': 'str', 'location': 'Location', 'branches': 'list[Location]', 'tags': 'list[str]', 'extra': None }
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new, True)
+        self.name = None
+        self.location = None
+        self.branches = None
+        self.tags = None
+        self.extra = None
+
+class SlottedLocation(Serializable):
+    ''' Embedded class, as generated by build_model with slots '''
+
+    _fields = ('city', )
+    _field_types = { 'city': 'str' }
+    _embedded = True
+    __slots__ = ('city', )
+
+    def __init__(self):
+        Serializable.__init__(self)
+        self.city = None
+
+class SlottedVenue(BaseObject):
+    ''' Model class, as generated by build_model with slots '''
+
+    _fields = ('name', 'location', 'tags')
+    _field_types = { 'name': 'str', 'location': 'SlottedLocation', 'tags': 'list[str]' }
+    _col_name = 'SlottedVenue'
+    _timestampable = True
+    _softdeletable = False
+    __slots__ = ('name', 'location', 'tags')
+
+    def __init__(self, is_new=False):
+        BaseObject.__init__(self, is_new)
+        self.name = None
+        self.location = None
+        self.tags = None
+
+class TestSerializer(TestSuite):
+    ''' Test compiled serializers '''
+
+    def setup(self):
+        orm.core.base_object.Location = Location
+        orm.core.base_object.SlottedLocation = SlottedLocation
+
+    @test_case
+    def test1_compile(self):
+        ''' Test the field kinds compiled from declared types '''
+        s = get_serializer(Venue, Venue._base_fields)
+        self.assert_equal(s is get_serializer(Venue), True)
+        self.assert_equal(s.kinds['id'], PLAIN)
+        self.assert_equal(s.kinds['name'], STRING)
+        self.assert_equal(s.kinds['location'], OBJECT)
+        self.assert_equal(s.kinds['branches'], OBJECT_LIST)
+        self.assert_equal(s.kinds['tags'], PLAIN)
+        self.assert_equal(s.kinds['extra'], UNKNOWN)
+
+    @test_case
+    def test2_round_trip(self):
+        ''' Test exporting to and instanciating from dictionaries '''
+        v = Venue(True)
+        v.name = "Venue"
+        v.location = Location()
+        v.location.city = "Paris"
+        v.branches = [v.location]
+        v.extra = v.location
+        d = v.to_dict()
+        self.assert_equal(d.has_key(Serializable.CLASS_KEY), False)
+        self.assert_equal(d['location'], { 'city': u'Paris', Serializable.CLASS_KEY: 'Location' })
+        self.assert_equal(d['extra'], d['location'])
+        self.assert_equal(type(d['name']), unicode)
+        v2 = Venue.from_dict(d)
+        self.assert_equal(v2.get_id(), v.get_id())
+        self.assert_equal(v2.location.city, "Paris")
+        self.assert_equal(v2.branches[0].city, "Paris")
+        self.assert_equal(v2.to_dict(), d)
+        self.assert_equal(v2.has_changes(), False)
+
+    @test_case
+    def test3_slots(self):
+        ''' Test classes using __slots__ instead of __dict__ '''
+        v = SlottedVenue(True)
+        self.assert_equal(SlottedVenue.__dictoffset__, 0)
+        self.assert_not_none(v.get_created())
+        v.name = "Venue"
+        v.location = SlottedLocation()
+        v.location.city = "Paris"
+        v.tags = ["a"]
+        d = v.to_dict()
+        self.assert_equal(d['location'], { 'city': u'Paris', Serializable.CLASS_KEY: 'SlottedLocation' })
+        d['_id'] = d.pop('id')
+        d['legacy'] = 1
+        v2 = SlottedVenue.from_dict(d)
+        self.assert_equal(v2.get_id(), v.get_id())
+        self.assert_equal(v2.location.city, "Paris")
+        self.assert_equal(v2.has_changes(), False)
+        v2.location.city = "Lyon"
+        v2.tags.append("b")
+        # Undeclared fields are dropped, not unset
+        self.assert_equal(v2._get_update_rules(), { '$set': { 'location.city': u'Lyon' }, '$push': { 'tags': { '$each': ["b"] } } })
+        v2._set_partial(["name"])
+        self.assert_equal(v2.is_partial(), True)
+        self.assert_equal(get_serializer(SlottedVenue).has_value(v2, "tags"), False)
+
+    @test_case
+    def test4_json(self):
+        ''' Test exporting objects and documents to JSON, in one go or chunk by chunk '''
+        v = Venue(True)
+        v.name = u"Caf\xe9"
+        v.location = Location()
+        v.location.city = "Paris"
+        d = json.loads(v.to_json())
+        self.assert_equal(d['id'], str(v.get_id()))
+        self.assert_equal(d['location']['city'], "Paris")
+        venues = BaseObjectArray([Venue(True) for _ in range(50)] + [v])
+        expected = [o.to_dict() for o in venues]
+        self.assert_equal(json.loads(venues.to_json()), expected)
+        chunks = list(venues.iter_json(chunk_size=256))
+        self.assert_equal(len(chunks) > 1, True)
+        self.assert_equal(json.loads("".join(chunks)), expected)
+        fp = StringIO()
+        venues.to_json(fp, chunk_size=256)
+        self.assert_equal(json.loads(fp.getvalue()), expected)
+        oid = ObjectId()
+        docs = [{ '_id': oid, 'date': datetime(2026, 10, 17, 12, 30), 'tags': set(["a"]) }]
+        self.assert_equal(json.loads("".join(json_encoder.iter_json(iter(docs)))),
+                          [{ '_id': str(oid), 'date': "2026-10-17T12:30:00", 'tags': ["a"] }])
+        self.assert_equal("".join(json_encoder.iter_json([])), "[]")
+
+    @test_case
+    def test5_flags(self):
+        ''' Test overriding the timestampable and softdeletable flags of a class when creating instances '''
+        o = BaseObject(True, True, True)
+        self.assert_not_none(o.get_created())
+        self.assert_equal((o._is_timestampable, o._is_softdeletable), (True, True))
+        self.assert_equal(BaseObject(True)._is_timestampable, False)
+        v = SlottedVenue(True)
+        BaseObject.__init__(v, True, False, True)
+        self.assert_equal(v.get_created(), None)
+        self.assert_equal((v._is_softdeletable, SlottedVenue._softdeletable), (True, False))
+
+    @test_case
+    def test6_undeclared_attributes(self):
+        ''' Test that only classes without __slots__ take undeclared attributes '''
+        v = Venue(True)
+        v.notes = "Undeclared"
+        self.assert_equal(v.to_dict()['notes'], "Undeclared")
+        self.assert_equal(Venue.from_dict(v.to_dict()).notes, "Undeclared")
+        for o in (BaseObject(True), SlottedVenue(True)):
+            try:
+                o.notes = "Undeclared"
+                self.assert_equal("set", "rejected")
+            except AttributeError:
+                pass
+
+if __name__ == "__main__":
+    TestSerializer().run()